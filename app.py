@@ -1,11 +1,15 @@
-from recipe_hub import app, db
-from recipe_hub.db_funcs import reset_units
+from recipe_hub import app
+from recipe_hub.db_funcs import requeue_stale_costs, reset_units
+from recipe_hub.migrations import upgrade
 
-UNITS = [{'name': 'grams', 'symbol': 'g'},
-         {'name': 'milliliter', 'symbol': 'ml'},
-         {'name': 'whole'}]
+UNITS = [{'name': 'grams', 'symbol': 'g', 'dimension': 'mass', 'factor': 1},
+         {'name': 'milliliter', 'symbol': 'ml', 'dimension': 'volume', 'factor': 1},
+         {'name': 'whole', 'dimension': 'count', 'factor': 1},
+         {'name': 'kilograms', 'symbol': 'kg', 'dimension': 'mass', 'factor': 1000},
+         {'name': 'liter', 'symbol': 'l', 'dimension': 'volume', 'factor': 1000}]
 
 if __name__ == '__main__':
-    db.create_all()
+    upgrade()
     reset_units(UNITS)
+    requeue_stale_costs()
     app.run(threaded=True, port=5000)
\ No newline at end of file
@@ -0,0 +1,46 @@
+import random
+import time
+from decimal import Decimal
+
+from recipe_hub.cost_graph import CostGraph, Line
+
+NODES = 5000
+LINES_PER_NODE = 6
+INGREDIENTS = 500
+
+
+def build_graph(nodes: int) -> CostGraph:
+    rng = random.Random(0)
+    yields = {}
+    lines = {}
+    for product_id in range(nodes):
+        yields[product_id] = rng.randint(100, 1000)
+        product_lines = []
+        for _ in range(LINES_PER_NODE):
+            if product_id and rng.random() < 0.5:
+                sub_product_id = rng.randrange(product_id)
+                product_lines.append(Line(-sub_product_id, sub_product_id, rng.randint(1, 100), None))
+            else:
+                product_lines.append(Line(rng.randrange(INGREDIENTS), None, rng.randint(1, 100),
+                                          Decimal(rng.randint(1, 500)) / 100))
+        lines[product_id] = product_lines
+    return CostGraph(yields, lines)
+
+
+def main() -> None:
+    graph = build_graph(NODES)
+    start = time.perf_counter()
+    for product_id in range(NODES):
+        graph.cost(product_id)
+    cost_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for product_id in range(NODES):
+        graph.quantities(product_id)
+    quantity_time = time.perf_counter() - start
+    print(f'{NODES} products, {NODES * LINES_PER_NODE} lines, every product evaluated')
+    print(f'cost rollup:     {cost_time * 1000:8.1f} ms')
+    print(f'quantity rollup: {quantity_time * 1000:8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+RUNS = 5
+UNREACHABLE_DATABASE_URL = 'postgresql://nobody@127.0.0.1:1/unreachable'
+
+
+def time_import(database_url: str) -> None:
+    env = dict(os.environ, DATABASE_URL=database_url)
+    env.setdefault('SECRET_KEY', 'bench')
+    timings = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', 'import recipe_hub'],
+                                env=env, capture_output=True)
+        timings.append(time.perf_counter() - start)
+        if result.returncode:
+            print(f'  import failed: {result.stderr.decode().strip().splitlines()[-1]}')
+            return
+    print(f'  median {statistics.median(timings) * 1000:7.1f} ms, '
+          f'max {max(timings) * 1000:7.1f} ms over {RUNS} runs')
+
+
+def main() -> None:
+    if 'DATABASE_URL' in os.environ:
+        print('import recipe_hub with a reachable database:')
+        time_import(os.environ['DATABASE_URL'])
+    print('import recipe_hub with an unreachable database:')
+    time_import(UNREACHABLE_DATABASE_URL)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from recipe_hub import app, db_funcs
+
+EMAIL = 'bench-login@example.com'
+PASSWORD = 'bench-password'
+CONCURRENCY = 16
+LOGINS = 32
+
+
+def login(_: int) -> int:
+    client = app.test_client()
+    return client.post('/login/', data={'email': EMAIL, 'password': PASSWORD}).status_code
+
+
+def probe(stop: threading.Event, latencies: list) -> None:
+    # A cheap request issued alongside the logins shows how much they stall
+    # everything else in the worker.
+    client = app.test_client()
+    while not stop.is_set():
+        start = time.perf_counter()
+        client.get('/api/v1/units/')
+        latencies.append(time.perf_counter() - start)
+        time.sleep(0.01)
+
+
+def run(label: str, **config) -> None:
+    app.config.update(config)
+    db_funcs.password_hasher.shutdown()
+    latencies = []
+    stop = threading.Event()
+    prober = threading.Thread(target=probe, args=(stop, latencies))
+    prober.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(CONCURRENCY) as pool:
+        statuses = list(pool.map(login, range(LOGINS)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    prober.join()
+    print(f'{label:>24}: {statuses.count(302) / elapsed:5.2f} logins/s, '
+          f'{statuses.count(503)} rejected, probe median '
+          f'{statistics.median(latencies) * 1000:6.1f} ms, '
+          f'max {max(latencies) * 1000:6.1f} ms')
+
+
+def main() -> None:
+    app.config['WTF_CSRF_ENABLED'] = False
+    if db_funcs.get_user_by_email(EMAIL) is None:
+        db_funcs.add_user('bench-login', EMAIL, PASSWORD, 'bench')
+    run('inline', PASSWORD_HASH_WORKERS=0)
+    # One process stands in for the whole server here, so it gets every CPU.
+    workers = os.cpu_count()
+    run('process pool', PASSWORD_HASH_WORKERS=workers, PASSWORD_HASH_QUEUE=LOGINS)
+    run('process pool, queue 4', PASSWORD_HASH_WORKERS=workers, PASSWORD_HASH_QUEUE=4)
+    db_funcs.password_hasher.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+import io
+import random
+import sys
+import time
+
+from recipe_hub import db
+from recipe_hub.db_funcs import add_user, cost_queue, get_user_by_email
+from recipe_hub.importer import RecipeImporter, read_rows
+from recipe_hub.mappings import Ingredient, Product, Recipe
+
+LINES = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+LINES_PER_PRODUCT = 20
+INGREDIENTS = 2000
+EMAIL = 'bench-import@example.com'
+
+
+def csv_rows(lines: int) -> io.StringIO:
+    rng = random.Random(0)
+    text = io.StringIO()
+    text.write('product,product_amount,product_unit,ingredient,amount,unit\n')
+    for number in range(lines):
+        product = f'bench product {number // LINES_PER_PRODUCT}'
+        definition = '1000,g' if number % LINES_PER_PRODUCT == 0 else ','
+        text.write(f'{product},{definition},bench ingredient {number % LINES_PER_PRODUCT}-'
+                   f'{rng.randrange(INGREDIENTS)},{rng.randint(1, 500)},g\n')
+    text.seek(0)
+    return text
+
+
+def cleanup(user_id: int) -> None:
+    product_ids = db.session.query(Product.product_id).filter(Product.user_id == user_id).subquery()
+    Recipe.query.filter(Recipe.product_id.in_(product_ids)).delete(synchronize_session=False)
+    Product.query.filter(Product.user_id == user_id).delete(synchronize_session=False)
+    Ingredient.query.filter(Ingredient.name.like('bench ingredient %')).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def main() -> None:
+    user = get_user_by_email(EMAIL)
+    user_id = user.user_id if user else add_user('bench', EMAIL, 'bench-password', 'bench')
+    cleanup(user_id)
+    rows = read_rows(csv_rows(LINES), 'csv')
+    start = time.perf_counter()
+    stats = RecipeImporter(user_id).run(rows)
+    elapsed = time.perf_counter() - start
+    print(f'{stats.lines} lines, {stats.products} products in {elapsed:.1f} s '
+          f'({stats.lines / elapsed:,.0f} lines/s)')
+    cost_queue.join()
+    cleanup(user_id)
+
+
+if __name__ == '__main__':
+    main()
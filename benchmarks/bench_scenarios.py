@@ -0,0 +1,59 @@
+import random
+import time
+from decimal import Decimal
+
+from recipe_hub.cost_graph import CostGraph, Line
+from recipe_hub.scenarios import RecipeMatrix
+
+LINES = 200
+SCALES = [float(scale) for scale in range(1, 101)]
+# Two ingredients at ten prices each: 100 price scenarios, 10k grid cells.
+PRICES = {0: [0.001 * step for step in range(1, 11)], 1: [0.002 * step for step in range(1, 11)]}
+PRODUCTS = 100
+REPEATS = 20
+
+
+def build_rows(rng: random.Random) -> dict:
+    return {ingredient_id: (rng.randint(1, 1000), rng.randint(1, 500) / 100) for ingredient_id in range(LINES)}
+
+
+def loop_grid(rows: dict, yield_amount: int) -> list:
+    # The per-scenario Decimal rollup the grid replaces.
+    grid = []
+    for scale in SCALES:
+        for price_0 in PRICES[0]:
+            for price_1 in PRICES[1]:
+                prices = {0: Decimal(str(price_0)), 1: Decimal(str(price_1))}
+                lines = {1: [Line(ingredient_id, None, quantity,
+                                  prices[ingredient_id] * quantity if ingredient_id in prices
+                                  else Decimal(str(cost)))
+                             for ingredient_id, (quantity, cost) in rows.items()]}
+                total, _ = CostGraph({1: yield_amount}, lines).cost(1)
+                grid.append(total * Decimal(str(scale)))
+    return grid
+
+
+def timed(function, repeats: int = REPEATS) -> float:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function()
+    return (time.perf_counter() - start) / repeats
+
+
+def main() -> None:
+    rng = random.Random(0)
+    rows = build_rows(rng)
+    matrix = RecipeMatrix.from_rows({1: rows}, {1: 1000})
+    grid = matrix.price_grid(SCALES, PRICES)
+    cells = grid.totals.size
+    print(f'{LINES}-line recipe, {len(SCALES)} scales x {len(grid.prices)} price scenarios = {cells} cells')
+    print(f'matrix grid:         {timed(lambda: matrix.price_grid(SCALES, PRICES)) * 1000:8.2f} ms')
+    print(f'Decimal loop:        {timed(lambda: loop_grid(rows, 1000), 1) * 1000:8.2f} ms')
+    many = RecipeMatrix.from_rows({product_id: build_rows(rng) for product_id in range(PRODUCTS)},
+                                  {product_id: 1000 for product_id in range(PRODUCTS)})
+    print(f'{PRODUCTS} products at once: {timed(lambda: many.price_grid(SCALES, PRICES)) * 1000:8.2f} ms '
+          f'({PRODUCTS * cells} cells)')
+
+
+if __name__ == '__main__':
+    main()
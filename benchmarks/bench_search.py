@@ -0,0 +1,51 @@
+import random
+import statistics
+import sys
+import time
+
+from recipe_hub import db, db_funcs
+from recipe_hub.mappings import Ingredient
+
+INGREDIENTS = 1000000
+BATCH = 10000
+QUERIES = 2000
+SYLLABLES = ['ba', 'ca', 'do', 'fe', 'gi', 'ho', 'ju', 'ka', 'lo', 'mi', 'na', 'pe', 'qu', 'ri',
+             'sa', 'to', 'un', 've', 'wa', 'ze', 'sugar', 'flour', 'salt', 'oil']
+
+
+def make_name(rng: random.Random) -> str:
+    words = [''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(rng.randint(1, 3))]
+    return ' '.join(words)
+
+
+def seed(count: int, rng: random.Random) -> None:
+    # Names are unique per unit, so spread them over the first few units.
+    existing = db.session.query(db.func.count(Ingredient.ingredient_id)).scalar()
+    while existing < count:
+        db_funcs.add_ingredients([(make_name(rng), rng.randint(1, 5)) for _ in range(BATCH)])
+        db.session.commit()
+        existing = db.session.query(db.func.count(Ingredient.ingredient_id)).scalar()
+    db.session.execute('ANALYZE ingredients')
+    db.session.commit()
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else INGREDIENTS
+    rng = random.Random(0)
+    seed(count, rng)
+    # What a debounced client sends: the first 1-8 characters of a name.
+    queries = [name[:rng.randint(1, 8)] for name in (make_name(rng) for _ in range(QUERIES))]
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        db_funcs.search_ingredients(query)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    print(f'{count} ingredients, {QUERIES} queries, trigram {db_funcs.has_trigram_search()}: '
+          f'p50 {statistics.median(latencies) * 1000:.2f} ms, '
+          f'p99 {latencies[int(QUERIES * 0.99)] * 1000:.2f} ms, '
+          f'max {latencies[-1] * 1000:.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
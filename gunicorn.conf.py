@@ -0,0 +1,40 @@
+import logging
+import multiprocessing
+import os
+
+# Each worker process owns one connection pool, so the server can open up to
+# workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections; keep that below the
+# database's max_connections minus whatever other clients need. Each worker
+# also starts PASSWORD_HASH_WORKERS bcrypt processes, which by default share
+# out the CPUs between the workers.
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
+preload_app = True
+
+logger = logging.getLogger('gunicorn.error')
+
+
+def when_ready(server):
+    from recipe_hub import app, db
+    from recipe_hub.db_funcs import requeue_stale_costs
+    from recipe_hub.pool import connection_budget
+    budget = connection_budget(workers, app.config['SQLALCHEMY_ENGINE_OPTIONS'])
+    if db.engine.dialect.name == 'postgresql':
+        with db.engine.connect() as connection:
+            max_connections = int(connection.scalar('SHOW max_connections'))
+        if budget > max_connections:
+            logger.warning('%d workers may open %d connections but max_connections is %d.',
+                           workers, budget, max_connections)
+    # Recompute costs left stale by the last run once, here in the master,
+    # rather than in every worker as it starts.
+    with app.app_context():
+        stale_ids = requeue_stale_costs(sync=True)
+    if stale_ids:
+        logger.info('Recomputed %d stale product costs.', len(stale_ids))
+
+
+def pre_fork(server, worker):
+    # Close the master's connections before forking so no worker inherits a
+    # socket; each worker opens its own on first use.
+    from recipe_hub import db
+    db.engine.dispose()
@@ -4,11 +4,34 @@ from flask import Flask
 from flask_login.login_manager import LoginManager
 from flask_sqlalchemy import SQLAlchemy
 
+from recipe_hub.cache import cache_config
+from recipe_hub.passwords import hasher_config
+from recipe_hub.pool import enable_sqlite_foreign_keys, engine_options, get_bool, install_fork_guard
+from recipe_hub.profiling import LATENCY_BUDGET_MS, QUERY_BUDGET, SLOW_QUERY_MS, Profiler
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ['SECRET_KEY']
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['DATABASE_URL']
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = True
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'], os.environ)
+app.config.update(hasher_config(os.environ))
+app.config.update(cache_config(os.environ))
+# The profile endpoint is only on by default in debug mode.
+app.config['PROFILE_ENDPOINT'] = get_bool(os.environ, 'PROFILE_ENDPOINT', app.debug)
+app.config['STATS_ENDPOINTS'] = get_bool(os.environ, 'STATS_ENDPOINTS', False)
+app.config['PROFILE_QUERY_BUDGET'] = int(os.environ.get('PROFILE_QUERY_BUDGET', QUERY_BUDGET))
+app.config['PROFILE_LATENCY_BUDGET_MS'] = float(os.environ.get('PROFILE_LATENCY_BUDGET_MS', LATENCY_BUDGET_MS))
+app.config['PROFILE_SLOW_QUERY_MS'] = float(os.environ.get('PROFILE_SLOW_QUERY_MS', SLOW_QUERY_MS))
 login_manager = LoginManager(app)
 db = SQLAlchemy(app)
+with app.app_context():
+    install_fork_guard(db.engine)
+    if db.engine.dialect.name == 'sqlite':
+        enable_sqlite_foreign_keys(db.engine)
+    profiler = Profiler(app, db.engine)
+
+import recipe_hub.views
+import recipe_hub.commands
+from recipe_hub.api import api
 
-import recipe_hub.views
\ No newline at end of file
+app.register_blueprint(api)
\ No newline at end of file
@@ -0,0 +1,246 @@
+import zlib
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from flask import Blueprint, abort, current_app, jsonify, request
+from flask.json import JSONEncoder
+from flask_login import current_user
+from flask_login.utils import login_required
+from werkzeug.exceptions import HTTPException
+from werkzeug.wrappers import Response
+
+from recipe_hub import db, db_funcs
+from recipe_hub.pool import MeteredQueuePool
+from recipe_hub.search import MAX_SEARCH_LIMIT, SEARCH_LIMIT
+from recipe_hub.units import get_unit_registry
+from recipe_hub.views import get_page_args, paginate, render_cache
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+PRODUCT_FIELDS = ('product_id', 'name', 'amount', 'unit', 'user_id', 'username', 'public',
+                  'cost', 'cost_complete', 'version')
+RECIPE_FIELDS = ('ingredient_id', 'ingredient', 'amount', 'unit', 'sub_product_id')
+UNIT_FIELDS = ('unit_id', 'name', 'symbol', 'dimension', 'factor')
+
+
+class ApiJSONEncoder(JSONEncoder):
+    # Decimals are sent as strings so prices and costs keep their precision.
+    def default(self, o: Any) -> Any:
+        if isinstance(o, Decimal):
+            return str(o)
+        return super().default(o)
+
+
+api.json_encoder = ApiJSONEncoder
+
+
+@api.errorhandler(HTTPException)
+def handle_http_error(error: HTTPException) -> Tuple[Response, int]:
+    return jsonify(error=error.description), error.code
+
+
+def get_fields(allowed: Tuple[str, ...]) -> Tuple[str, ...]:
+    # Defaults to every allowed field, which keeps internal keys out of responses.
+    fields = request.args.get('fields')
+    if not fields:
+        return allowed
+    selected = tuple(field.strip() for field in fields.split(',') if field.strip())
+    unknown = set(selected) - set(allowed)
+    if unknown:
+        abort(400, f"Unknown fields: {', '.join(sorted(unknown))}.")
+    return selected
+
+
+def select_fields(item: Dict[str, Any], fields: Optional[Tuple[str, ...]]) -> Dict[str, Any]:
+    if 'unit' in item and isinstance(item['unit'], str):
+        item = dict(item, unit=item['unit'].strip())
+    if fields is None:
+        return item
+    return {field: item[field] for field in fields}
+
+
+def make_etag(*parts: Any) -> str:
+    # Versions identify the data, the query string identifies the representation.
+    return f"{zlib.crc32(repr(parts).encode()):08x}-{zlib.crc32(request.query_string):08x}"
+
+
+def conditional(etag: str, build: Callable[[], Any]) -> Response:
+    # build() is only called on a miss, so a 304 skips loading and serializing.
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def get_visible_product(product_id: int, owner_only: bool = False):
+    product = db_funcs.get_product_version(product_id)
+    if product is None:
+        abort(404, 'Product not found.')
+    is_owner = current_user.is_authenticated and product.user_id == current_user.user_id
+    if not (is_owner or (product.public and not owner_only)):
+        abort(404, 'Product not found.')
+    return product
+
+
+def serialize_page(products: List[Dict[str, Any]], limit: int,
+                   fields: Optional[Tuple[str, ...]]) -> Response:
+    products, next_url = paginate(products, limit)
+    etag = make_etag([(product['product_id'], product['random_key'], product['version'])
+                      for product in products], next_url)
+    return conditional(etag, lambda: {'data': [select_fields(product, fields) for product in products],
+                                      'next': next_url})
+
+
+@api.route('/products/')
+def products() -> Response:
+    fields = get_fields(PRODUCT_FIELDS)
+    after, limit = get_page_args()
+    return serialize_page(db_funcs.get_all_public_products(after=after, limit=limit + 1), limit, fields)
+
+
+@api.route('/me/products/')
+@login_required
+def my_products() -> Response:
+    fields = get_fields(PRODUCT_FIELDS)
+    after, limit = get_page_args()
+    return serialize_page(db_funcs.get_all_products(current_user.user_id, after=after, limit=limit + 1),
+                          limit, fields)
+
+
+@api.route('/products/<int:product_id>/')
+def product(product_id: int) -> Response:
+    fields = get_fields(PRODUCT_FIELDS)
+    version = get_visible_product(product_id)
+    return conditional(make_etag('product', product_id, version.random_key, version.version),
+                       lambda: select_fields(db_funcs.get_product(product_id), fields))
+
+
+@api.route('/products/<int:product_id>/recipe/')
+def recipe(product_id: int) -> Response:
+    fields = get_fields(RECIPE_FIELDS)
+    version = get_visible_product(product_id)
+    return conditional(make_etag('recipe', product_id, version.random_key, version.version),
+                       lambda: {'data': [select_fields(line, fields)
+                                         for line in db_funcs.get_recipe(product_id)]})
+
+
+@api.route('/products/<int:product_id>/cost/')
+@login_required
+def cost(product_id: int) -> Response:
+    version = get_visible_product(product_id, owner_only=True)
+    return conditional(make_etag('cost', product_id, version.random_key, version.version),
+                       lambda: db_funcs.compute_product_cost(product_id))
+
+
+def parse_positive_numbers(values: Any, name: str) -> List[float]:
+    if not isinstance(values, list) or not values:
+        abort(400, f'{name} must be a non-empty list of numbers.')
+    try:
+        numbers = [float(Decimal(str(value))) for value in values]
+    except (ArithmeticError, ValueError):
+        abort(400, f'{name} must be a non-empty list of numbers.')
+    if not all(0 < number < float('inf') for number in numbers):
+        abort(400, f'{name} must all be positive.')
+    return numbers
+
+
+@api.route('/products/<int:product_id>/scenarios/', methods=['POST'])
+@login_required
+def scenarios(product_id: int) -> Response:
+    # Body: {"scales": [10, 37], "prices": [{"ingredient_id": 1, "prices": [1.2, 1.5],
+    # "package_amount": 1000, "unit": "g"}]}; package_amount and unit default
+    # to the saved package. Returns the cost of every scale x price combination.
+    get_visible_product(product_id, owner_only=True)
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        abort(400, 'Expected a JSON object.')
+    scales = parse_positive_numbers(body.get('scales', [1]), 'scales')
+    overrides = body.get('prices', [])
+    if not isinstance(overrides, list) or not all(isinstance(override, dict) for override in overrides):
+        abort(400, 'prices must be a list of objects.')
+    prices = {}
+    factors = {}
+    for override in overrides:
+        try:
+            ingredient_id = int(override['ingredient_id'])
+        except (KeyError, TypeError, ValueError):
+            abort(400, 'Each price needs an ingredient_id.')
+        prices[ingredient_id] = parse_positive_numbers(override.get('prices'), 'prices')
+        unit = None
+        if override.get('unit') is not None:
+            unit = db_funcs.resolve_unit(override['unit'])
+            if unit is None:
+                abort(400, f"Unknown unit: {override['unit']}.")
+        package_amount = override.get('package_amount')
+        if package_amount is not None:
+            package_amount = parse_positive_numbers([package_amount], 'package_amount')[0]
+        try:
+            factors[ingredient_id] = db_funcs.get_price_factor(ingredient_id, current_user.user_id,
+                                                               package_amount, unit and unit.unit_id)
+        except ValueError as error:
+            abort(400, str(error))
+    try:
+        grid = db_funcs.load_recipe_matrix([product_id]).price_grid(scales, prices, factors)
+    except ValueError as error:
+        abort(400, str(error))
+    return jsonify(grid.product_dict())
+
+
+@api.route('/search/')
+def search() -> Response:
+    # Autocomplete: ?q=<typed text>&type=ingredients|products. Identical
+    # queries within a minute are answered from the browser cache, so
+    # clients can debounce and still resend on backspace for free.
+    text = request.args.get('q', '')
+    kind = request.args.get('type')
+    if kind not in (None, 'ingredients', 'products'):
+        abort(400, 'type must be ingredients or products.')
+    limit = request.args.get('limit', SEARCH_LIMIT, type=int)
+    if not 0 < limit <= MAX_SEARCH_LIMIT:
+        abort(400, f'limit must be between 1 and {MAX_SEARCH_LIMIT}.')
+    results = {}
+    if kind in (None, 'ingredients'):
+        results['ingredients'] = db_funcs.search_ingredients(text, limit)
+    if kind in (None, 'products'):
+        fields = get_fields(PRODUCT_FIELDS)
+        user_id = current_user.user_id if current_user.is_authenticated else None
+        results['products'] = [select_fields(product, fields)
+                               for product in db_funcs.search_products(text, user_id, limit)]
+    response = jsonify(results)
+    response.headers['Cache-Control'] = 'private, max-age=60'
+    return response
+
+
+@api.route('/units/')
+def units() -> Response:
+    fields = get_fields(UNIT_FIELDS)
+    registry = get_unit_registry()
+    return conditional(make_etag('units', registry.units),
+                       lambda: {'data': [select_fields(unit._asdict(), fields) for unit in registry.units]})
+
+
+def require_stats_endpoints() -> None:
+    # Internal metrics are off unless STATS_ENDPOINTS is set, and then only
+    # shown to logged-in users.
+    if not current_app.config.get('STATS_ENDPOINTS'):
+        abort(404)
+
+
+@api.route('/cache/')
+@login_required
+def cache_stats() -> Response:
+    require_stats_endpoints()
+    return jsonify(render_cache.stats.to_dict())
+
+
+@api.route('/pool/')
+@login_required
+def pool_stats() -> Response:
+    require_stats_endpoints()
+    pool = db.engine.pool
+    if not isinstance(pool, MeteredQueuePool):
+        abort(404, 'Pool metrics are not collected for this database.')
+    return jsonify(pool.status_dict())
@@ -0,0 +1,173 @@
+import json
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Mapping, Optional, Tuple
+
+RENDER_CACHE_SIZE = 2048
+RENDER_CACHE_TTL = 300
+USER_CACHE_SIZE = 4096
+USER_CACHE_TTL = 60
+
+
+def make_key(*parts: Any) -> str:
+    return ':'.join(str(part) for part in parts)
+
+
+class CacheStats:
+    # Shared by every thread of the worker.
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def hit(self) -> None:
+        with self._lock:
+            self.hits += 1
+
+    def miss(self) -> None:
+        with self._lock:
+            self.misses += 1
+
+    def evict(self) -> None:
+        with self._lock:
+            self.evictions += 1
+
+    def to_dict(self) -> Dict[str, int]:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+class RenderCache(ABC):
+    # StoreCache values must be JSON-serializable; LocalCache holds any object.
+    def __init__(self) -> None:
+        self.stats = CacheStats()
+
+    def get_or_set(self, key: str, build: Callable[[], Any]) -> Any:
+        value = self._get(key)
+        if value is not None:
+            self.stats.hit()
+            return value
+        self.stats.miss()
+        value = build()
+        self._set(key, value)
+        return value
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        pass
+
+    @abstractmethod
+    def _get(self, key: str) -> Optional[Any]:
+        pass
+
+    @abstractmethod
+    def _set(self, key: str, value: Any) -> None:
+        pass
+
+
+class LocalCache(RenderCache):
+    # In-process LRU: at most max_entries values, each kept for ttl seconds.
+    def __init__(self, max_entries: int = 2048, ttl: float = 300,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        super().__init__()
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self._entries: 'OrderedDict[str, Tuple[float, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def _get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= self.clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats.evict()
+
+
+class StoreCache(RenderCache):
+    # Shared store with the redis-py get/set(ex=) interface, so several
+    # workers reuse one another's renders.
+    def __init__(self, store: Any, ttl: int = 300, prefix: str = 'recipe_hub:render:') -> None:
+        super().__init__()
+        self.store = store
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def delete(self, key: str) -> None:
+        self.store.delete(self.prefix + key)
+
+    def _get(self, key: str) -> Optional[Any]:
+        value = self.store.get(self.prefix + key)
+        if value is None:
+            return None
+        return json.loads(value)
+
+    def _set(self, key: str, value: Any) -> None:
+        self.store.set(self.prefix + key, json.dumps(value), ex=self.ttl)
+
+
+class DictStore:
+    # Local stand-in for a shared store in tests and single-process setups.
+    def __init__(self, clock: Callable[[], float] = time.monotonic) -> None:
+        self.clock = clock
+        self._values: Dict[str, Tuple[Optional[float], bytes]] = {}
+
+    def get(self, name: str) -> Optional[bytes]:
+        entry = self._values.get(name)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires is not None and expires <= self.clock():
+            del self._values[name]
+            return None
+        return value
+
+    def set(self, name: str, value: str, ex: Optional[int] = None) -> None:
+        expires = self.clock() + ex if ex else None
+        self._values[name] = (expires, value.encode())
+
+    def delete(self, name: str) -> None:
+        self._values.pop(name, None)
+
+
+def make_render_cache(config: Mapping[str, Any]) -> RenderCache:
+    ttl = config.get('RENDER_CACHE_TTL', RENDER_CACHE_TTL)
+    url = config.get('RENDER_CACHE_URL')
+    if url:
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('RENDER_CACHE_URL requires the redis package.')
+        return StoreCache(redis.Redis.from_url(url), ttl=ttl)
+    return LocalCache(max_entries=config.get('RENDER_CACHE_SIZE', RENDER_CACHE_SIZE), ttl=ttl)
+
+
+def cache_config(environ: Mapping[str, str]) -> Dict[str, Any]:
+    return {'RENDER_CACHE_URL': environ.get('RENDER_CACHE_URL'),
+            'RENDER_CACHE_SIZE': int(environ.get('RENDER_CACHE_SIZE', RENDER_CACHE_SIZE)),
+            'RENDER_CACHE_TTL': int(environ.get('RENDER_CACHE_TTL', RENDER_CACHE_TTL)),
+            'USER_CACHE_SIZE': int(environ.get('USER_CACHE_SIZE', USER_CACHE_SIZE)),
+            'USER_CACHE_TTL': int(environ.get('USER_CACHE_TTL', USER_CACHE_TTL))}
@@ -0,0 +1,57 @@
+import io
+from typing import Optional
+
+import click
+
+from recipe_hub import app
+from recipe_hub.db_funcs import GC_BATCH_SIZE, collect_unused_ingredients, get_user_by_email
+from recipe_hub.importer import BATCH_SIZE, FORMATS, ImportStats, RecipeImporter, detect_format, read_rows
+from recipe_hub.migrations import upgrade
+
+
+def echo_progress(stats: ImportStats) -> None:
+    click.echo(f'{stats.rows} rows: {stats.products} products, {stats.lines} lines, '
+               f'{stats.skipped} skipped, {stats.error_count} errors')
+
+
+@app.cli.command('import-recipes')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--user', 'email', required=True, help='Email of the account that will own the products.')
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help='Defaults to the file extension.')
+@click.option('--batch-size', default=BATCH_SIZE, show_default=True, help='Rows per transaction.')
+@click.option('--checkpoint', type=click.Path(dir_okay=False),
+              help='Progress file used to resume an interrupted import. Defaults to PATH.checkpoint.')
+def import_recipes(path: str, email: str, fmt: Optional[str], batch_size: int,
+                   checkpoint: Optional[str]) -> None:
+    user = get_user_by_email(email)
+    if user is None:
+        raise click.BadParameter(f'No account exists for {email}.', param_hint='--user')
+    try:
+        fmt = fmt or detect_format(path)
+    except ValueError as error:
+        raise click.BadParameter(str(error), param_hint='--format')
+    importer = RecipeImporter(user.user_id, batch_size=batch_size,
+                              checkpoint_path=checkpoint or f'{path}.checkpoint',
+                              progress=echo_progress)
+    with io.open(path, newline='', encoding='utf-8') as stream:
+        stats = importer.run(read_rows(stream, fmt))
+    for error in stats.errors:
+        click.echo(f"line {error['line']}: {error['error']}", err=True)
+    click.echo(f'Imported {stats.products} products and {stats.lines} recipe lines.')
+
+
+@app.cli.command('upgrade-db')
+def upgrade_db() -> None:
+    applied = upgrade()
+    if applied:
+        click.echo(f"Applied migrations {', '.join(map(str, applied))}.")
+    else:
+        click.echo('The database is up to date.')
+
+
+@app.cli.command('gc-ingredients')
+@click.option('--batch-size', default=GC_BATCH_SIZE, show_default=True, help='Ingredients per transaction.')
+@click.option('--pause', default=0.0, show_default=True, help='Seconds to sleep between batches.')
+def gc_ingredients(batch_size: int, pause: float) -> None:
+    deleted = collect_unused_ingredients(batch_size, pause)
+    click.echo(f'Deleted {deleted} unused ingredients.')
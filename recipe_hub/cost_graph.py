@@ -0,0 +1,104 @@
+from decimal import Decimal
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+
+class RecipeCycleError(ValueError):
+    pass
+
+
+class Line(NamedTuple):
+    ingredient_id: int
+    sub_product_id: Optional[int]
+    amount: int
+    cost: Optional[Decimal]
+    name: Optional[str] = None
+
+
+class CostGraph:
+    # Costs and raw quantities are memoized per product, so a sub-product
+    # shared by many lines of the graph is only evaluated once.
+    def __init__(self, yields: Dict[int, int], lines: Dict[int, List[Line]]) -> None:
+        self.yields = yields
+        self.lines = lines
+        self._costs: Dict[int, Tuple[Decimal, bool]] = {}
+        self._quantities: Dict[int, Dict[int, float]] = {}
+        self._raw_costs: Dict[int, Dict[int, Optional[Decimal]]] = {}
+
+    def _post_order(self, product_id: int, memo: Dict) -> Iterator[int]:
+        if product_id in memo:
+            return
+        visiting = {product_id}
+        stack = [(product_id, iter(self.lines.get(product_id, ())))]
+        while stack:
+            node, children = stack[-1]
+            for line in children:
+                child = line.sub_product_id
+                if child is None or child in memo:
+                    continue
+                if child in visiting:
+                    raise RecipeCycleError(f'Product {child} is part of a cycle.')
+                visiting.add(child)
+                stack.append((child, iter(self.lines.get(child, ()))))
+                break
+            else:
+                stack.pop()
+                visiting.discard(node)
+                yield node
+
+    def _scale(self, line: Line) -> Decimal:
+        return Decimal(line.amount) / self.yields[line.sub_product_id]
+
+    def line_cost(self, line: Line) -> Tuple[Optional[Decimal], bool]:
+        if line.sub_product_id is None:
+            return line.cost, line.cost is not None
+        total, complete = self.cost(line.sub_product_id)
+        return total * self._scale(line), complete
+
+    def cost(self, product_id: int) -> Tuple[Decimal, bool]:
+        for node in self._post_order(product_id, self._costs):
+            total, complete = Decimal(0), True
+            for line in self.lines.get(node, ()):
+                if line.sub_product_id is None:
+                    if line.cost is None:
+                        complete = False
+                    else:
+                        total += line.cost
+                else:
+                    sub_total, sub_complete = self._costs[line.sub_product_id]
+                    total += sub_total * self._scale(line)
+                    complete = complete and sub_complete
+            self._costs[node] = (total, complete)
+        return self._costs[product_id]
+
+    def quantities(self, product_id: int) -> Dict[int, float]:
+        for node in self._post_order(product_id, self._quantities):
+            totals: Dict[int, float] = {}
+            for line in self.lines.get(node, ()):
+                if line.sub_product_id is None:
+                    totals[line.ingredient_id] = totals.get(line.ingredient_id, 0) + line.amount
+                else:
+                    scale = line.amount / self.yields[line.sub_product_id]
+                    for ingredient_id, amount in self._quantities[line.sub_product_id].items():
+                        totals[ingredient_id] = totals.get(ingredient_id, 0) + amount * scale
+            self._quantities[node] = totals
+        return self._quantities[product_id]
+
+    def raw_costs(self, product_id: int) -> Dict[int, Optional[Decimal]]:
+        # Cost of each raw ingredient in one batch; None where any use of the
+        # ingredient is unpriced.
+        for node in self._post_order(product_id, self._raw_costs):
+            totals: Dict[int, Optional[Decimal]] = {}
+            for line in self.lines.get(node, ()):
+                if line.sub_product_id is None:
+                    costs = [(line.ingredient_id, line.cost)]
+                else:
+                    scale = self._scale(line)
+                    costs = [(ingredient_id, None if cost is None else cost * scale)
+                             for ingredient_id, cost in self._raw_costs[line.sub_product_id].items()]
+                for ingredient_id, cost in costs:
+                    if cost is None or (ingredient_id in totals and totals[ingredient_id] is None):
+                        totals[ingredient_id] = None
+                    else:
+                        totals[ingredient_id] = totals.get(ingredient_id, Decimal(0)) + cost
+            self._raw_costs[node] = totals
+        return self._raw_costs[product_id]
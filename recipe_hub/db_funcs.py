@@ -1,54 +1,297 @@
+import hashlib
+import time
 from datetime import date
-from random import shuffle
-from typing import Dict, List, Optional, Union
+from itertools import islice
+from decimal import Decimal
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Set, Tuple, Union
 
-import bcrypt
-from flask_login import current_user
-from sqlalchemy import and_, or_
+from flask import g, has_request_context
+from flask_login import UserMixin, current_user
+from sqlalchemy import and_, bindparam, event, exists, func, inspect, or_, select, tuple_
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Query, joinedload
 
-from recipe_hub import db, login_manager
-from recipe_hub.mappings import Ingredient, Product, Recipe, Unit, User
+from recipe_hub import app, db, login_manager
+from recipe_hub.cache import LocalCache, make_key
+from recipe_hub.cost_graph import CostGraph, Line, RecipeCycleError
+from recipe_hub.mappings import Ingredient, IngredientPrice, IngredientUsage, Product, Recipe, Unit, User
+from recipe_hub.passwords import PasswordHasher
+from recipe_hub.scenarios import RecipeMatrix
+from recipe_hub.search import MIN_FUZZY_LENGTH, SEARCH_LIMIT, PrefixTrie, normalize_query, prefix_pattern
+from recipe_hub.tasks import RecomputeQueue
+from recipe_hub.units import (UnitRecord, find_unit, get_conversion_table, get_unit,
+                              get_unit_registry, invalidate_unit_registry)
 
 
 # Ingredient
+GC_BATCH_SIZE = 1000
+# Keys per SQLite upsert, keeping the bound parameters under its limit.
+SQLITE_UPSERT_BATCH = 5000
+
+
 def add_ingredient(name: str, unit_id: int) -> int:
-    ingredient_id = get_ingredient_id(name, unit_id)
-    if ingredient_id:
-        return ingredient_id
-    ingredient = Ingredient(name=name.lower(), unit_id=unit_id)
-    db.session.add(ingredient)
+    ingredient_id = add_ingredients([(name, unit_id)])[(name.lower(), unit_id)]
     db.session.commit()
-    return ingredient.ingredient_id
+    return ingredient_id
+
+
+def add_ingredients(keys: Iterable[Tuple[str, int]]) -> Dict[Tuple[str, int], int]:
+    # Race-free upsert of (name, unit_id) pairs against ux_ingredients_name_unit_id;
+    # the caller commits. Keys are sorted so concurrent batches lock rows in
+    # the same order and cannot deadlock.
+    keys = sorted({(name.lower(), unit_id) for name, unit_id in keys})
+    if not keys:
+        return {}
+    rows = [{'name': name, 'unit_id': unit_id} for name, unit_id in keys]
+    if db.engine.dialect.name == 'postgresql':
+        # The no-op update makes RETURNING include rows that already existed,
+        # so one statement resolves every key.
+        statement = postgresql.insert(Ingredient.__table__).values(rows)
+        statement = (statement.on_conflict_do_update(index_elements=['name', 'unit_id'],
+                                                     index_where=Ingredient.product_id == None,
+                                                     set_={'name': statement.excluded.name})
+                     .returning(Ingredient.name, Ingredient.unit_id, Ingredient.ingredient_id))
+        result = db.session.execute(statement)
+    elif db.engine.dialect.dbapi.sqlite_version_info >= (3, 35):
+        # SQLAlchemy 1.3 has no SQLite upsert construct, so the same statement
+        # is written out; SQLite 3.35 added RETURNING.
+        result = []
+        for start in range(0, len(keys), SQLITE_UPSERT_BATCH):
+            batch = keys[start:start + SQLITE_UPSERT_BATCH]
+            values = ', '.join(f'(:name_{i}, :unit_id_{i})' for i in range(len(batch)))
+            params = {}
+            for i, (name, unit_id) in enumerate(batch):
+                params[f'name_{i}'], params[f'unit_id_{i}'] = name, unit_id
+            result.extend(db.session.execute(
+                f'INSERT INTO ingredients (name, unit_id) VALUES {values} '
+                'ON CONFLICT (name, unit_id) WHERE product_id IS NULL DO UPDATE SET name = excluded.name '
+                'RETURNING name, unit_id, ingredient_id', params))
+    else:
+        # SQLite serializes writers, so ignoring conflicts and reading back in
+        # the same transaction is just as safe.
+        db.session.execute(Ingredient.__table__.insert().prefix_with('OR IGNORE'), rows)
+        result = (db.session.query(Ingredient.name, Ingredient.unit_id, Ingredient.ingredient_id)
+                  .filter(Ingredient.name.in_(bindparam('names', expanding=True)),
+                          Ingredient.product_id == None)
+                  .params(names=sorted({name for name, _ in keys})))
+    invalidate_search('ingredients')
+    wanted = set(keys)
+    return {(row.name, row.unit_id): row.ingredient_id for row in result
+            if (row.name, row.unit_id) in wanted}
 
 
 def get_ingredient_id(name: str, unit_id: int) -> Optional[int]:
     ingredient = Ingredient.query.filter(and_(Ingredient.name == name.lower(),
-                                           Ingredient.unit_id == unit_id)).first()
+                                           Ingredient.unit_id == unit_id,
+                                           Ingredient.product_id == None)).first()
     try:
         return ingredient.ingredient_id
     except AttributeError:
         return None
 
 
-def get_ingredient_name(ingredient_id: int) -> str:
-    return Ingredient.query.get(ingredient_id).name
+def add_product_ingredient(product_id: int) -> int:
+    ingredient = Ingredient.query.filter(Ingredient.product_id == product_id).first()
+    if ingredient:
+        return ingredient.ingredient_id
+    product = Product.query.get(product_id)
+    ingredient = Ingredient(name=product.name, unit_id=product.unit_id, product_id=product_id)
+    db.session.add(ingredient)
+    db.session.commit()
+    return ingredient.ingredient_id
+
+
+def add_product_ingredients(product_ids: Iterable[int]) -> Dict[int, int]:
+    # add_product_ingredient for many products at once; the caller commits.
+    product_ids = sorted(set(product_ids))
 
+    def select_ingredients() -> Dict[int, int]:
+        rows = (db.session.query(Ingredient.product_id, Ingredient.ingredient_id)
+                .filter(Ingredient.product_id.in_(bindparam('product_ids', expanding=True)))
+                .params(product_ids=product_ids))
+        return {row.product_id: row.ingredient_id for row in rows}
+
+    ingredient_ids = select_ingredients()
+    missing = [product_id for product_id in product_ids if product_id not in ingredient_ids]
+    if missing:
+        db.session.execute(Ingredient.__table__.insert().from_select(
+            ['name', 'unit_id', 'product_id'],
+            select([Product.name, Product.unit_id, Product.product_id])
+            .where(Product.product_id.in_(missing))))
+        ingredient_ids = select_ingredients()
+    return ingredient_ids
+
+
+def collect_unused_ingredients(batch_size: int = GC_BATCH_SIZE, pause: float = 0) -> int:
+    # Deletes ingredients no recipe uses and nobody has priced, one short
+    # transaction per batch so locks are never held for long. Rows another
+    # transaction holds are skipped, not waited for, and the DELETE checks
+    # again in case a recipe arrived after the SELECT. Returns the count.
+    unused = and_(~exists().where(Recipe.ingredient_id == Ingredient.ingredient_id),
+                  ~exists().where(IngredientPrice.ingredient_id == Ingredient.ingredient_id))
+    deleted = 0
+    after = 0
+    while True:
+        query = (db.session.query(Ingredient.ingredient_id)
+                 .filter(Ingredient.ingredient_id > after, unused)
+                 .order_by(Ingredient.ingredient_id).limit(batch_size))
+        if db.engine.dialect.name == 'postgresql':
+            query = query.with_for_update(skip_locked=True)
+        ingredient_ids = [row.ingredient_id for row in query]
+        if not ingredient_ids:
+            db.session.commit()
+            return deleted
+        deleted += db.session.execute(Ingredient.__table__.delete().where(
+            and_(Ingredient.ingredient_id.in_(ingredient_ids), unused))).rowcount
+        db.session.commit()
+        invalidate_search('ingredients')
+        after = ingredient_ids[-1]
+        if pause:
+            time.sleep(pause)
+
+
+# Ingredient usage
+def usage_deltas(lines: Iterable[Tuple[int, int]], sign: int = 1) -> Dict[int, Tuple[int, int]]:
+    # (ingredient_id, amount) recipe lines to per-ingredient (count, amount) deltas.
+    deltas: Dict[int, Tuple[int, int]] = {}
+    for ingredient_id, amount in lines:
+        count, total = deltas.get(ingredient_id, (0, 0))
+        deltas[ingredient_id] = (count + sign, total + sign * amount)
+    return deltas
+
+
+def apply_usage_deltas(deltas: Mapping[int, Tuple[int, int]], connection: Optional[Connection] = None) -> None:
+    # Increments rather than recounts, so concurrent writers queue on the
+    # summary row's lock instead of overwriting each other; the caller commits.
+    # ORM recipe writes are counted by the mapper events below; bulk Core
+    # inserts and deletes must call this themselves.
+    executor = connection or db.session
+    ingredient_ids = sorted(ingredient_id for ingredient_id, delta in deltas.items() if delta != (0, 0))
+    if not ingredient_ids:
+        return
+    table = IngredientUsage.__table__
+    if db.engine.dialect.name == 'postgresql':
+        insert = postgresql.insert(table).on_conflict_do_nothing(index_elements=['ingredient_id'])
+    else:
+        insert = table.insert().prefix_with('OR IGNORE')
+    executor.execute(insert, [{'ingredient_id': ingredient_id, 'product_count': 0, 'total_amount': 0}
+                              for ingredient_id in ingredient_ids])
+    executor.execute(table.update()
+                     .where(table.c.ingredient_id == bindparam('usage_id'))
+                     .values(product_count=table.c.product_count + bindparam('count_delta'),
+                             total_amount=table.c.total_amount + bindparam('amount_delta')),
+                     [{'usage_id': ingredient_id, 'count_delta': deltas[ingredient_id][0],
+                       'amount_delta': deltas[ingredient_id][1]} for ingredient_id in ingredient_ids])
 
-def get_ingredient_unit(ingredient_id: int) -> str:
-    ingredient = Ingredient.query.get(ingredient_id)
-    return get_unit_name(ingredient.unit_id)
+
+@event.listens_for(Recipe, 'after_insert')
+def count_recipe_insert(mapper, connection: Connection, recipe: Recipe) -> None:
+    apply_usage_deltas(usage_deltas([(recipe.ingredient_id, recipe.amount)]), connection)
+
+
+@event.listens_for(Recipe, 'after_delete')
+def count_recipe_delete(mapper, connection: Connection, recipe: Recipe) -> None:
+    apply_usage_deltas(usage_deltas([(recipe.ingredient_id, recipe.amount)], sign=-1), connection)
+
+
+@event.listens_for(Recipe, 'after_update')
+def count_recipe_update(mapper, connection: Connection, recipe: Recipe) -> None:
+    state = inspect(recipe)
+    old = {}
+    for name in ('ingredient_id', 'amount'):
+        history = state.attrs[name].history
+        old[name] = history.deleted[0] if history.deleted else getattr(recipe, name)
+    deltas = usage_deltas([(old['ingredient_id'], old['amount'])], sign=-1)
+    for ingredient_id, (count, amount) in usage_deltas([(recipe.ingredient_id, recipe.amount)]).items():
+        old_count, old_amount = deltas.get(ingredient_id, (0, 0))
+        deltas[ingredient_id] = (old_count + count, old_amount + amount)
+    apply_usage_deltas(deltas, connection)
+
+
+def remove_product_usage(product_id: int, connection: Optional[Connection] = None) -> None:
+    # ON DELETE CASCADE drops a deleted product's recipe lines without any
+    # recipe events, so their usage is taken off beforehand.
+    lines = (connection or db.session).execute(select([Recipe.ingredient_id, Recipe.amount])
+                                               .where(Recipe.product_id == product_id))
+    apply_usage_deltas(usage_deltas(lines, sign=-1), connection)
+
+
+@event.listens_for(Product, 'before_delete')
+def count_product_delete(mapper, connection: Connection, product: Product) -> None:
+    remove_product_usage(product.product_id, connection)
+
+
+def rebuild_ingredient_usage() -> None:
+    table = IngredientUsage.__table__
+    db.session.execute(table.delete())
+    db.session.execute(table.insert().from_select(
+        ['ingredient_id', 'product_count', 'total_amount'],
+        select([Recipe.ingredient_id, func.count(), func.sum(Recipe.amount)]).group_by(Recipe.ingredient_id)))
+    db.session.commit()
+
+
+def get_ingredient_usage(ingredient_id: int) -> Optional[Dict[str, Union[int, str, None]]]:
+    row = (db.session.query(Ingredient.ingredient_id, Ingredient.name, Ingredient.unit_id,
+                            Ingredient.product_id, IngredientUsage.product_count,
+                            IngredientUsage.total_amount)
+           .outerjoin(IngredientUsage, IngredientUsage.ingredient_id == Ingredient.ingredient_id)
+           .filter(Ingredient.ingredient_id == ingredient_id).first())
+    if row is None:
+        return None
+    return {'ingredient_id': row.ingredient_id,
+            'name': row.name,
+            'unit': get_unit_name(row.unit_id),
+            'sub_product_id': row.product_id,
+            'product_count': row.product_count or 0,
+            'total_amount': row.total_amount or 0}
+
+
+def get_ingredient_products(ingredient_id: int, user_id: Optional[int] = None,
+                            after: Optional[int] = None,
+                            limit: Optional[int] = None) -> List[Dict[str, Union[int, str]]]:
+    # Public products plus the viewer's own, in product order along
+    # ix_recipes_ingredient_id_product_id.
+    visible = Product.public == True
+    if user_id is not None:
+        visible = or_(visible, Product.user_id == user_id)
+    query = (query_products().add_columns(Recipe.amount)
+             .join(Recipe, Recipe.product_id == Product.product_id)
+             .filter(Recipe.ingredient_id == ingredient_id, visible))
+    if after is not None:
+        query = query.filter(Recipe.product_id > after)
+    rows = query.order_by(Recipe.product_id).limit(limit).all()
+    return [dict(product_to_dict(product), usage_amount=amount) for product, amount in rows]
 
 
 # Product
-def get_product(product_id: int) -> Dict[str, Union[bool, int, str]]:
-    product = Product.query.get(product_id)
+def get_product_id(user_id: int, name: str) -> Optional[int]:
+    product = (db.session.query(Product.product_id)
+               .filter(Product.user_id == user_id, Product.name == name.lower()).first())
+    return product.product_id if product else None
+
+
+def product_to_dict(product: Product) -> Dict[str, Union[bool, int, str]]:
     return {'product_id': product.product_id,
             'name': product.name,
             'amount': product.amount,
             'unit': get_unit_name(product.unit_id),
             'user_id': product.user_id,
-            'username': get_user(product.user_id).username,
-            'public': product.public == 1}
+            'username': product.user.username,
+            'public': product.public == 1,
+            'cost': None if product.cost_stale else product.cost,
+            'cost_complete': product.cost_complete,
+            'random_key': product.random_key,
+            'version': product.version}
+
+
+def query_products() -> Query:
+    return Product.query.options(joinedload(Product.user))
+
+
+def get_product(product_id: int) -> Dict[str, Union[bool, int, str]]:
+    product = query_products().filter(Product.product_id == product_id).first()
+    return product_to_dict(product)
 
 
 def add_product(name: str, amount: int, unit: int, public: bool,
@@ -62,96 +305,669 @@ def add_product(name: str, amount: int, unit: int, public: bool,
     return product.product_id
 
 
-def delete_product(product_id: int) -> None:
-    product = Product.query.filter(Product.product_id == product_id).first()
-    db.session.delete(product)
+def delete_product(product_id: int, user_id: Optional[int] = None) -> bool:
+    # One DELETE; the database cascades to the product's recipe lines, its
+    # sub-product ingredient and the lines of other products that used it.
+    # Those products are marked stale first, while the join still finds them.
+    # Given a user_id, only that user's product is deleted.
+    condition = Product.product_id == product_id
+    if user_id is not None:
+        condition = and_(condition, Product.user_id == user_id)
+    stale_ids = mark_costs_stale(select([Recipe.product_id])
+                                 .select_from(Recipe.__table__.join(
+                                     Ingredient, Ingredient.ingredient_id == Recipe.ingredient_id))
+                                 .where(Ingredient.product_id == product_id))
+    remove_product_usage(product_id)
+    if not Product.query.filter(condition).delete(synchronize_session='evaluate'):
+        db.session.rollback()
+        return False
     db.session.commit()
+    invalidate_search('products')
+    cost_queue.enqueue(stale_ids)
+    return True
 
 
-def get_all_products(user_id: int, public_only: bool = False) -> List[Dict[str, Union[int, str]]]:
+def get_all_products(user_id: int, public_only: bool = False,
+                     after: Optional[int] = None,
+                     limit: Optional[int] = None,
+                     prefix: Optional[str] = None) -> List[Dict[str, Union[int, str]]]:
+    query = query_products().filter(Product.user_id == user_id)
     if public_only:
-        products = db.session.query(Product.product_id).filter(and_(Product.user_id == user_id,
-                                                        Product.public == public_only)).all()
+        query = query.filter(Product.public == True)
+    if prefix:
+        query = query.filter(Product.name.like(prefix_pattern(normalize_query(prefix)), escape='\\'))
+    if after is not None:
+        cursor = (db.session.query(Product.name, Product.product_id)
+                  .filter(Product.product_id == after).subquery())
+        query = query.join(cursor, tuple_(Product.name, Product.product_id)
+                           > tuple_(cursor.c.name, cursor.c.product_id))
+    products = query.order_by(Product.name, Product.product_id).limit(limit).all()
+    return [product_to_dict(product) for product in products]
+
+
+def get_all_public_products(after: Optional[int] = None,
+                            limit: Optional[int] = None) -> List[Dict[str, Union[int, str]]]:
+    query = query_products().filter(Product.public == True)
+    if after is not None:
+        query = query.filter(Product.product_id < after)
+    products = query.order_by(Product.product_id.desc()).limit(limit).all()
+    return [product_to_dict(product) for product in products]
+
+
+def get_random_public_products(seed: float, after: Optional[int] = None,
+                               limit: int = 48) -> List[Dict[str, Union[int, str]]]:
+    # The feed walks the random_key ring starting at the visitor's seed, so
+    # every page is an index range scan and the order is stable per seed.
+    query = query_products().filter(Product.public == True)
+    wrapped = False
+    if after is None:
+        products = (query.filter(Product.random_key >= seed)
+                    .order_by(Product.random_key, Product.product_id).limit(limit).all())
     else:
-        products = db.session.query(Product.product_id).filter(Product.user_id == user_id).all()
-    all_products = tuple(get_product(product_id) for product_id in tuple(product.product_id for product in products))
-    return sorted(all_products, key=lambda product: product['name'])
+        cursor = (db.session.query(Product.random_key, Product.product_id)
+                  .filter(Product.product_id == after).first())
+        if cursor is None:
+            return []
+        wrapped = cursor.random_key < seed
+        position = tuple_(Product.random_key, Product.product_id) > tuple_(*cursor)
+        if wrapped:
+            query = query.filter(and_(position, Product.random_key < seed))
+        else:
+            query = query.filter(position)
+        products = query.order_by(Product.random_key, Product.product_id).limit(limit).all()
+    if not wrapped and len(products) < limit:
+        products += (query_products()
+                     .filter(and_(Product.public == True, Product.random_key < seed))
+                     .order_by(Product.random_key, Product.product_id)
+                     .limit(limit - len(products)).all())
+    return [product_to_dict(product) for product in products]
+
 
+def iter_product_lines(user_id: int, batch_size: int = 1000) -> Iterator[Dict[str, Any]]:
+    # One row per recipe line (products without lines get one empty line),
+    # fetched through a server-side cursor batch_size rows at a time.
+    rows = (db.session.query(Product.product_id, Product.name.label('product'),
+                             Product.amount.label('product_amount'),
+                             Product.unit_id.label('product_unit_id'), Product.public,
+                             Product.cost, Product.cost_stale, Ingredient.name.label('ingredient'),
+                             Ingredient.product_id.label('sub_product_id'),
+                             Ingredient.unit_id, Recipe.amount)
+            .outerjoin(Recipe, Recipe.product_id == Product.product_id)
+            .outerjoin(Ingredient, Ingredient.ingredient_id == Recipe.ingredient_id)
+            .filter(Product.user_id == user_id)
+            .order_by(Product.name, Product.product_id, Ingredient.name)
+            .yield_per(batch_size))
+    unit_names = {}
+    for row in rows:
+        for unit_id in (row.product_unit_id, row.unit_id):
+            if unit_id is not None and unit_id not in unit_names:
+                unit = get_unit(unit_id)
+                unit_names[unit_id] = unit.symbol or unit.name
+        yield {'product': row.product,
+               'product_amount': row.product_amount,
+               'product_unit': unit_names[row.product_unit_id],
+               'public': bool(row.public),
+               'cost': None if row.cost_stale else row.cost,
+               'ingredient': row.ingredient,
+               'amount': row.amount,
+               'unit': unit_names.get(row.unit_id),
+               'sub_product_id': row.sub_product_id}
 
-def get_all_public_products() -> List[Dict[str, Union[int, str]]]:
-    products = db.session.query(Product.product_id).filter(Product.public == True).all()
-    all_products = [get_product(product_id) for product_id in tuple(product.product_id for product in products)]
-    shuffle(all_products)
-    return all_products
 
+def get_product_version(product_id: int):
+    # Just the columns needed to authorize and validate an ETag. Ids can be
+    # reused after a delete and versions restart at 1, so ETags and cache keys
+    # also carry random_key, which a new product draws afresh.
+    return (db.session.query(Product.product_id, Product.user_id, Product.public,
+                             Product.random_key, Product.version)
+            .filter(Product.product_id == product_id).first())
 
-def share_product(product_id: int) -> None:
+
+def share_product(product_id: int, user_id: Optional[int] = None) -> bool:
+    # Given a user_id, only that user's product is shared or unshared.
     product = Product.query.get(product_id)
+    if product is None or (user_id is not None and product.user_id != user_id):
+        return False
     product.public = not product.public
+    product.version = Product.version + 1
     db.session.commit()
+    return True
+
+
+# Search
+# SQLite deployments search in-memory tries, rebuilt on the next search after
+# a write and never more than ttl seconds stale across processes.
+search_cache = LocalCache(max_entries=8, ttl=60)
+# psycopg2 formats the statement itself, so pg_trgm's % operator is doubled.
+TRIGRAM_MATCH = '%%'
+
+
+def invalidate_search(kind: str) -> None:
+    search_cache.delete(kind)
+
+
+def has_trigram_search() -> bool:
+    def probe() -> bool:
+        if db.engine.dialect.name != 'postgresql':
+            return False
+        return db.session.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'").first() is not None
+    return search_cache.get_or_set('trigram', probe)
+
+
+def get_ingredient_trie() -> PrefixTrie:
+    def build() -> PrefixTrie:
+        trie = PrefixTrie()
+        for row in (db.session.query(Ingredient.ingredient_id, Ingredient.name, Ingredient.unit_id)
+                    .filter(Ingredient.product_id == None).order_by(Ingredient.ingredient_id)):
+            trie.insert(row.name, (row.ingredient_id, row.unit_id))
+        return trie
+    return search_cache.get_or_set('ingredients', build)
+
+
+def get_product_trie() -> PrefixTrie:
+    def build() -> PrefixTrie:
+        trie = PrefixTrie()
+        for row in (db.session.query(Product.product_id, Product.name, Product.user_id, Product.public)
+                    .order_by(Product.product_id)):
+            trie.insert(row.name, (row.product_id, row.user_id, bool(row.public)))
+        return trie
+    return search_cache.get_or_set('products', build)
+
+
+@event.listens_for(Product, 'after_insert')
+@event.listens_for(Product, 'after_delete')
+def invalidate_product_search(mapper, connection: Connection, product: Product) -> None:
+    invalidate_search('products')
+
+
+@event.listens_for(Product, 'after_update')
+def invalidate_renamed_product_search(mapper, connection: Connection, product: Product) -> None:
+    state = inspect(product)
+    if any(state.attrs[name].history.has_changes() for name in ('name', 'user_id', 'public')):
+        invalidate_search('products')
+
+
+def match_names(query: Query, column, text: str, limit: int, *order) -> List[Any]:
+    # Prefix matches in name order along the C-collation index, then, with
+    # pg_trgm, the closest fuzzy matches so that typos still find a name.
+    name = column.collate('C')
+    prefix = name.like(prefix_pattern(text), escape='\\')
+    rows = query.filter(prefix).order_by(name, *order).limit(limit).all()
+    if len(rows) < limit and len(text) >= MIN_FUZZY_LENGTH and has_trigram_search():
+        rows += (query.filter(column.op(TRIGRAM_MATCH)(text), ~prefix)
+                 .order_by(column.op('<->')(text)).limit(limit - len(rows)).all())
+    return rows
+
+
+def search_ingredients(text: str, limit: int = SEARCH_LIMIT) -> List[Dict[str, Union[int, str]]]:
+    text = normalize_query(text)
+    if not text:
+        return []
+    if db.engine.dialect.name == 'postgresql':
+        rows = [(row.ingredient_id, row.name, row.unit_id) for row in match_names(
+            db.session.query(Ingredient.ingredient_id, Ingredient.name, Ingredient.unit_id)
+            .filter(Ingredient.product_id == None),
+            Ingredient.name, text, limit, Ingredient.ingredient_id)]
+    else:
+        rows = [(ingredient_id, name, unit_id) for name, (ingredient_id, unit_id)
+                in islice(get_ingredient_trie().search(text), limit)]
+    return [{'ingredient_id': ingredient_id, 'name': name, 'unit': get_unit_name(unit_id)}
+            for ingredient_id, name, unit_id in rows]
+
+
+def search_products(text: str, user_id: Optional[int] = None,
+                    limit: int = SEARCH_LIMIT) -> List[Dict[str, Union[bool, int, str]]]:
+    # Public products plus the viewer's own.
+    text = normalize_query(text)
+    if not text:
+        return []
+    if db.engine.dialect.name == 'postgresql':
+        visible = Product.public == True
+        if user_id is not None:
+            visible = or_(visible, Product.user_id == user_id)
+        products = match_names(query_products().filter(visible), Product.name, text, limit,
+                               Product.product_id)
+    else:
+        product_ids = list(islice((product_id for _, (product_id, owner_id, public)
+                                   in get_product_trie().search(text)
+                                   if public or owner_id == user_id), limit))
+        found = {product.product_id: product for product in
+                 query_products().filter(Product.product_id.in_(product_ids))}
+        products = [found[product_id] for product_id in product_ids if product_id in found]
+    return [product_to_dict(product) for product in products]
 
 
 # Recipe
+class RecipeLinesError(ValueError):
+    def __init__(self, errors: List[Dict[str, Union[int, str]]]) -> None:
+        super().__init__(f'{len(errors)} recipe line(s) are invalid.')
+        self.errors = errors
+
+
 def add_recipe(product_id: int, ingredient: str, amount: int, unit_id: int) -> None:
-    ingredient_id = add_ingredient(ingredient, unit_id)
+    ingredient_id = add_ingredients([(ingredient, unit_id)])[(ingredient.lower(), unit_id)]
     recipe = Recipe(product_id=product_id, ingredient_id=ingredient_id, amount=amount)
     db.session.add(recipe)
+    stale_ids = invalidate_product_costs([product_id])
     db.session.commit()
+    cost_queue.enqueue(stale_ids)
+
+
+def resolve_recipe_line(line: Mapping[str, Any]) -> Tuple[str, int, int]:
+    name = line.get('ingredient')
+    if not isinstance(name, str) or not name.strip():
+        raise ValueError('Ingredient name is required.')
+    try:
+        amount = int(line.get('amount'))
+    except (TypeError, ValueError):
+        raise ValueError('Amount must be a whole number.')
+    if amount <= 0:
+        raise ValueError('Amount must be positive.')
+    unit = line.get('unit')
+    unit_record = resolve_unit(unit)
+    if unit_record is None:
+        raise ValueError(f'Unknown unit: {unit}.')
+    return name.strip().lower(), amount, unit_record.unit_id
+
+
+def add_recipes(product_id: int, lines: Iterable[Mapping[str, Any]]) -> List[int]:
+    # Validates every line before writing anything; raises RecipeLinesError
+    # listing each bad line (1-based) or inserts them all in one commit.
+    existing = {(row.name, row.unit_id) for row in
+                db.session.query(Ingredient.name, Ingredient.unit_id)
+                .join(Recipe, Recipe.ingredient_id == Ingredient.ingredient_id)
+                .filter(Recipe.product_id == product_id, Ingredient.product_id == None)}
+    errors = []
+    entries = {}
+    for number, line in enumerate(lines, start=1):
+        try:
+            name, amount, unit_id = resolve_recipe_line(line)
+        except (AttributeError, ValueError) as error:
+            message = str(error) if isinstance(error, ValueError) else 'Line must be an object.'
+            errors.append({'line': number, 'error': message})
+            continue
+        if (name, unit_id) in existing:
+            errors.append({'line': number, 'error': 'The given ingredient is already found in the recipe.'})
+        elif (name, unit_id) in entries:
+            errors.append({'line': number, 'error': 'The given ingredient is listed more than once.'})
+        else:
+            entries[(name, unit_id)] = amount
+    if errors:
+        raise RecipeLinesError(errors)
+    if not entries:
+        return []
+    ingredient_ids = add_ingredients(entries)
+    db.session.execute(Recipe.__table__.insert(),
+                       [{'product_id': product_id, 'ingredient_id': ingredient_ids[key], 'amount': amount}
+                        for key, amount in entries.items()])
+    apply_usage_deltas(usage_deltas((ingredient_ids[key], amount) for key, amount in entries.items()))
+    stale_ids = invalidate_product_costs([product_id])
+    db.session.commit()
+    cost_queue.enqueue(stale_ids)
+    return [ingredient_ids[key] for key in entries]
+
+
+def add_sub_recipe(product_id: int, sub_product_id: int, amount: int) -> None:
+    if creates_cycle(product_id, sub_product_id):
+        raise RecipeCycleError(f'Product {sub_product_id} already depends on product {product_id}.')
+    ingredient_id = add_product_ingredient(sub_product_id)
+    recipe = Recipe(product_id=product_id, ingredient_id=ingredient_id, amount=amount)
+    db.session.add(recipe)
+    stale_ids = invalidate_product_costs([product_id])
+    db.session.commit()
+    cost_queue.enqueue(stale_ids)
+
+
+def reachable_products(product_id: int):
+    reachable = (select([Product.product_id])
+                 .where(Product.product_id == product_id)
+                 .cte('reachable', recursive=True))
+    return reachable.union(
+        select([Ingredient.product_id])
+        .select_from(reachable
+                     .join(Recipe, Recipe.product_id == reachable.c.product_id)
+                     .join(Ingredient, Ingredient.ingredient_id == Recipe.ingredient_id))
+        .where(Ingredient.product_id != None))
+
+
+def get_sub_products(product_id: int) -> Set[int]:
+    reachable = reachable_products(product_id)
+    return {row.product_id for row in db.session.query(reachable.c.product_id)}
+
+
+def creates_cycle(product_id: int, sub_product_id: int) -> bool:
+    return product_id in get_sub_products(sub_product_id)
+
+
+def load_sub_recipe_graph(product_ids: Iterable[int]) -> Dict[int, Set[int]]:
+    # The sub-products of every product reachable from product_ids, in one
+    # query, so many new sub-recipe lines can be checked for cycles in memory.
+    edges = (select([Recipe.product_id, Ingredient.product_id.label('sub_product_id')])
+             .select_from(Recipe.__table__.join(Ingredient, Ingredient.ingredient_id == Recipe.ingredient_id))
+             .where(and_(Recipe.product_id.in_(list(product_ids)), Ingredient.product_id != None))
+             .cte('edges', recursive=True))
+    edges = edges.union(
+        select([Recipe.product_id, Ingredient.product_id.label('sub_product_id')])
+        .select_from(edges
+                     .join(Recipe, Recipe.product_id == edges.c.sub_product_id)
+                     .join(Ingredient, Ingredient.ingredient_id == Recipe.ingredient_id))
+        .where(Ingredient.product_id != None))
+    graph: Dict[int, Set[int]] = {}
+    for row in db.session.query(edges.c.product_id, edges.c.sub_product_id):
+        graph.setdefault(row.product_id, set()).add(row.sub_product_id)
+    return graph
+
+
+def graph_reaches(graph: Dict[int, Set[int]], source: int, target: int) -> bool:
+    seen = {source}
+    stack = [source]
+    while stack:
+        node = stack.pop()
+        if node == target:
+            return True
+        for child in graph.get(node, ()):
+            if child not in seen:
+                seen.add(child)
+                stack.append(child)
+    return False
 
 
 def get_recipe(product_id: int) -> List[Dict[str, Union[int, str]]]:
-    entries = Recipe.query.filter(Recipe.product_id == product_id).all()
+    entries = (Recipe.query
+               .options(joinedload(Recipe.ingredient))
+               .filter(Recipe.product_id == product_id).all())
     return [{'ingredient_id': entry.ingredient_id,
-             'ingredient': get_ingredient_name(entry.ingredient_id),
+             'ingredient': entry.ingredient.name,
              'amount': entry.amount,
-             'unit': get_ingredient_unit(entry.ingredient_id),
+             'unit': get_unit_name(entry.ingredient.unit_id),
+             'sub_product_id': entry.ingredient.product_id,
              } for entry in entries]
 
 
-def delete_recipe(product_id: int, ingredient_id: int) -> None:
-    recipe = Recipe.query.filter(and_(Recipe.product_id == product_id,
-                                         Recipe.ingredient_id == ingredient_id)).first()
-    db.session.delete(recipe)
+def delete_recipe(product_id: int, ingredient_id: int, user_id: Optional[int] = None) -> bool:
+    # Given a user_id, only lines of that user's products are deleted.
+    condition = and_(Recipe.product_id == product_id, Recipe.ingredient_id == ingredient_id)
+    if user_id is not None:
+        condition = and_(condition, Recipe.product_id.in_(
+            select([Product.product_id]).where(and_(Product.product_id == product_id,
+                                                    Product.user_id == user_id))))
+    statement = Recipe.__table__.delete().where(condition)
+    if db.engine.dialect.name == 'postgresql':
+        lines = db.session.execute(statement.returning(Recipe.ingredient_id, Recipe.amount)).fetchall()
+    elif db.engine.dialect.name == 'sqlite' and db.engine.dialect.dbapi.sqlite_version_info >= (3, 35):
+        # SQLAlchemy 1.3 will not compile RETURNING for SQLite, so the same
+        # statement is written out, as in add_ingredients.
+        sql = 'DELETE FROM recipes WHERE product_id = :product_id AND ingredient_id = :ingredient_id'
+        if user_id is not None:
+            sql += (' AND product_id IN (SELECT product_id FROM products'
+                    ' WHERE product_id = :product_id AND user_id = :user_id)')
+        lines = db.session.execute(sql + ' RETURNING ingredient_id, amount',
+                                   {'product_id': product_id, 'ingredient_id': ingredient_id,
+                                    'user_id': user_id}).fetchall()
+    else:
+        lines = db.session.query(Recipe.ingredient_id, Recipe.amount).filter(condition).all()
+        db.session.execute(statement)
+    if not lines:
+        db.session.rollback()
+        return False
+    apply_usage_deltas(usage_deltas(lines, sign=-1))
+    stale_ids = invalidate_product_costs([product_id])
+    db.session.commit()
+    cost_queue.enqueue(stale_ids)
+    return True
+
+
+# Cost
+# Line costs are rounded to the scale of Product.cost, so totals are exact
+# sums of stored-precision Decimals on every dialect.
+COST_PLACES = Decimal('0.0001')
+
+
+def set_ingredient_price(ingredient_id: int, price: Decimal, package_amount: int,
+                         unit_id: Optional[int] = None, density: Optional[float] = None,
+                         user_id: Optional[int] = None) -> None:
+    # A density of None keeps the one already saved with the price.
+    if user_id is None:
+        user_id = current_user.user_id
+    ingredient_price = IngredientPrice.query.get((user_id, ingredient_id))
+    if ingredient_price is None:
+        ingredient_price = IngredientPrice(user_id=user_id, ingredient_id=ingredient_id)
+        db.session.add(ingredient_price)
+    ingredient_price.price = price
+    ingredient_price.package_amount = package_amount
+    ingredient_price.unit_id = unit_id
+    if density is not None:
+        ingredient_price.density = density
+    stale_ids = invalidate_ingredient_costs(user_id, ingredient_id)
     db.session.commit()
+    cost_queue.enqueue(stale_ids)
+
+
+def load_cost_graph(product_id: int) -> CostGraph:
+    reachable = reachable_products(product_id)
+    rows = (db.session.query(Product.product_id, Product.amount.label('product_amount'),
+                             Recipe.ingredient_id, Ingredient.product_id.label('sub_product_id'),
+                             Ingredient.name, Ingredient.unit_id, Recipe.amount,
+                             func.coalesce(IngredientPrice.density, Ingredient.density).label('density'),
+                             IngredientPrice.price, IngredientPrice.package_amount,
+                             IngredientPrice.unit_id.label('price_unit_id'))
+            .select_from(reachable)
+            .join(Product, Product.product_id == reachable.c.product_id)
+            .outerjoin(Recipe, Recipe.product_id == Product.product_id)
+            .outerjoin(Ingredient, Ingredient.ingredient_id == Recipe.ingredient_id)
+            .outerjoin(IngredientPrice, and_(IngredientPrice.ingredient_id == Recipe.ingredient_id,
+                                             IngredientPrice.user_id == Product.user_id))
+            .all())
+    conversions = get_conversion_table()
+    yields = {}
+    lines = {}
+    for row in rows:
+        yields[row.product_id] = row.product_amount
+        if row.ingredient_id is None:
+            continue
+        cost = None
+        if row.price is not None:
+            factor = conversions.factor(row.unit_id, row.price_unit_id or row.unit_id, row.density)
+            if factor is not None:
+                cost = (Decimal(str(row.price)) * row.amount * Decimal(str(factor))
+                        / row.package_amount).quantize(COST_PLACES)
+        lines.setdefault(row.product_id, []).append(
+            Line(row.ingredient_id, row.sub_product_id, row.amount, cost, row.name))
+    return CostGraph(yields, lines)
+
+
+def compute_product_cost(product_id: int) -> Dict[str, Union[Decimal, List, bool]]:
+    graph = load_cost_graph(product_id)
+    if product_id not in graph.yields:
+        return {'total': Decimal(0), 'per_unit': Decimal(0), 'lines': [], 'complete': True}
+    total, complete = graph.cost(product_id)
+    lines = []
+    for line in graph.lines.get(product_id, ()):
+        cost, _ = graph.line_cost(line)
+        lines.append({'ingredient_id': line.ingredient_id,
+                      'ingredient': line.name,
+                      'sub_product_id': line.sub_product_id,
+                      'amount': line.amount,
+                      'cost': cost})
+    return {'total': total,
+            'per_unit': total / graph.yields[product_id],
+            'lines': lines,
+            'complete': complete}
+
+
+def compute_product_quantities(product_id: int) -> Dict[int, float]:
+    return load_cost_graph(product_id).quantities(product_id)
+
+
+def compute_raw_quantities(product_id: int) -> List[Dict[str, Union[float, str]]]:
+    quantities = compute_product_quantities(product_id)
+    ingredients = (db.session.query(Ingredient.ingredient_id, Ingredient.name, Ingredient.unit_id)
+                   .filter(Ingredient.ingredient_id.in_(list(quantities))).all())
+    conversions = get_conversion_table()
+    totals = {}
+    for ingredient in ingredients:
+        base_unit_id = conversions.base_unit(ingredient.unit_id)
+        amount = conversions.convert(quantities[ingredient.ingredient_id],
+                                     ingredient.unit_id, base_unit_id)
+        key = (ingredient.name, base_unit_id)
+        totals[key] = totals.get(key, 0) + amount
+    return [{'ingredient': name, 'amount': amount, 'unit': get_unit_name(unit_id)}
+            for (name, unit_id), amount in sorted(totals.items())]
+
+
+def load_recipe_matrix(product_ids: Iterable[int]) -> RecipeMatrix:
+    rows = {}
+    yields = {}
+    for product_id in product_ids:
+        graph = load_cost_graph(product_id)
+        if product_id not in graph.yields:
+            continue
+        costs = graph.raw_costs(product_id)
+        rows[product_id] = {ingredient_id: (quantity, None if costs[ingredient_id] is None
+                                            else float(costs[ingredient_id]))
+                            for ingredient_id, quantity in graph.quantities(product_id).items()}
+        yields[product_id] = graph.yields[product_id]
+    return RecipeMatrix.from_rows(rows, yields)
+
+
+def get_price_factor(ingredient_id: int, user_id: int, package_amount: Optional[int] = None,
+                     unit_id: Optional[int] = None) -> float:
+    # Multiplier from a package price to the price of one ingredient unit; the
+    # package defaults to the one saved with the user's price.
+    ingredient = Ingredient.query.get(ingredient_id)
+    if ingredient is None:
+        raise ValueError(f'Ingredient {ingredient_id} does not exist.')
+    saved = IngredientPrice.query.get((user_id, ingredient_id))
+    if package_amount is None:
+        if saved is None:
+            raise ValueError(f'Ingredient {ingredient_id} has no saved package; give package_amount.')
+        package_amount, unit_id = saved.package_amount, saved.unit_id
+    density = saved.density if saved is not None and saved.density else ingredient.density
+    factor = get_conversion_table().factor(ingredient.unit_id, unit_id or ingredient.unit_id, density)
+    if factor is None:
+        raise ValueError(f'The package unit cannot be converted to the unit of ingredient {ingredient_id}.')
+    return factor / package_amount
+
+
+def dependent_products(seed):
+    dependents = seed.cte('dependents', recursive=True)
+    return dependents.union(
+        select([Recipe.product_id])
+        .select_from(dependents
+                     .join(Ingredient, Ingredient.product_id == dependents.c.product_id)
+                     .join(Recipe, Recipe.ingredient_id == Ingredient.ingredient_id)))
+
+
+def mark_costs_stale(seed) -> List[int]:
+    # Runs inside the caller's transaction; the returned ids are handed to
+    # cost_queue once the caller has committed.
+    dependents = dependent_products(seed)
+    product_ids = [row.product_id for row in db.session.query(dependents.c.product_id)]
+    if product_ids:
+        (Product.query.filter(Product.product_id.in_(product_ids))
+         .update({Product.cost_stale: True, Product.version: Product.version + 1},
+                 synchronize_session=False))
+    return product_ids
+
+
+def invalidate_product_costs(product_ids: Iterable[int]) -> List[int]:
+    return mark_costs_stale(select([Product.product_id])
+                            .where(Product.product_id.in_(list(product_ids))))
+
+
+def invalidate_ingredient_costs(user_id: int, ingredient_id: int) -> List[int]:
+    return mark_costs_stale(select([Recipe.product_id])
+                            .select_from(Recipe.__table__.join(Product, Product.product_id == Recipe.product_id))
+                            .where(and_(Recipe.ingredient_id == ingredient_id, Product.user_id == user_id)))
+
+
+def refresh_product_costs(product_ids: Iterable[int]) -> None:
+    for product in Product.query.filter(Product.product_id.in_(list(product_ids))):
+        total, complete = load_cost_graph(product.product_id).cost(product.product_id)
+        product.cost = total
+        product.cost_complete = complete
+        product.cost_stale = False
+        product.version = Product.version + 1
+    db.session.commit()
+
+
+cost_queue = RecomputeQueue(app, refresh_product_costs)
+
+
+def requeue_stale_costs(sync: bool = False) -> List[int]:
+    # cost_queue lives in memory, so ids queued by a worker that died or
+    # restarted are lost; their products are still marked cost_stale. With
+    # sync the caller recomputes them itself instead of starting the
+    # background thread, as the gunicorn master must before it forks.
+    product_ids = [row.product_id for row in
+                   db.session.query(Product.product_id).filter(Product.cost_stale == True)]
+    if sync:
+        if product_ids:
+            refresh_product_costs(product_ids)
+    else:
+        cost_queue.enqueue(product_ids)
+    return product_ids
 
 
 # Unit
-def get_unit_name(unit_id: int) -> str:
-    unit = Unit.query.get(unit_id)
+def format_unit(unit: Union[Unit, UnitRecord]) -> str:
     if unit.symbol:
         return unit.symbol
     return f' {unit.name}'
 
 
+def resolve_unit(unit: Union[int, str, None]) -> Optional[UnitRecord]:
+    # Accepts a unit id or a name/symbol, as found in forms and imported files.
+    if isinstance(unit, str) and not unit.strip().isdigit():
+        return find_unit(unit.strip())
+    try:
+        return get_unit(int(unit))
+    except (TypeError, ValueError):
+        return None
+
+
+def get_unit_name(unit_id: int) -> str:
+    return format_unit(get_unit(unit_id))
+
+
 def get_unit_id(name_or_symbol: str) -> int:
-    unit = Unit.query.filter(or_(Unit.name == name_or_symbol.lower(),
-                                    Unit.symbol == name_or_symbol.lower())).first()
+    unit = find_unit(name_or_symbol)
     return unit.unit_id
 
 
 def get_all_units() -> List[str]:
-    units = Unit.query.all()
-    all_units = []
-    for unit in units:
-        if unit.symbol:
-            all_units.append(unit.symbol)
-        else:
-            all_units.append(unit.name)
-    return all_units
+    return [unit.symbol or unit.name for unit in get_unit_registry().units]
+
+
+def add_unit(name: str, symbol: Optional[str] = None, dimension: Optional[str] = None,
+             factor: float = 1) -> int:
+    unit = Unit(name=name.lower(), symbol=symbol and symbol.lower(),
+                dimension=dimension, factor=factor)
+    db.session.add(unit)
+    db.session.commit()
+    invalidate_unit_registry()
+    return unit.unit_id
 
 
 def reset_units(units) -> None:
-    cur_units = Unit.query.all()
-    if not cur_units:
-        for unit in units:
+    cur_units = {unit.name: unit for unit in Unit.query.all()}
+    for unit in units:
+        if unit['name'] in cur_units:
+            for key, value in unit.items():
+                setattr(cur_units[unit['name']], key, value)
+        else:
             db.session.add(Unit(**unit))
-        db.session.commit()
+    db.session.commit()
+    invalidate_unit_registry()
 
 
 # User
+password_hasher = PasswordHasher(app)
+
+
 def add_user(username: str, email: str, password: str,
              fullname: str, birthday: Optional[date] = None) -> int:
-    hashed_password = bcrypt.hashpw(password.encode(), bcrypt.gensalt())
+    hashed_password = password_hasher.hash(password)
     user = User(username=username, password_hash=hashed_password,
                 full_name=fullname.lower(), email=email.lower(),
                 date_of_birth=birthday)
@@ -165,47 +981,148 @@ def get_user(user_id: int) -> User:
     return user
 
 
+def get_user_by_username(username: str) -> Optional[User]:
+    return User.query.filter(func.lower(User.username) == username.lower()).first()
+
+
 def get_user_by_email(email: str) -> User:
     user = User.query.filter(User.email == email.lower()).first()
     return user
 
 
+def check_user_password(user: Optional[User], password: str) -> bool:
+    if user is None or not password_hasher.check(password, user.password_hash):
+        return False
+    if password_hasher.needs_rehash(user.password_hash):
+        # BCRYPT_ROUNDS changed since this hash was made; upgrade it while
+        # the plain password is at hand.
+        user.password_hash = password_hasher.hash(password)
+        db.session.commit()
+    return True
+
+
+class CredentialContext:
+    # Per-request memo of user rows and password checks, so a form validator
+    # and its view can both verify a password for one bcrypt call.
+    def __init__(self) -> None:
+        self._users: Dict[str, Optional[User]] = {}
+        self._checks: Dict[Tuple[str, bytes], bool] = {}
+
+    def user(self, email: str) -> Optional[User]:
+        email = email.lower()
+        if email not in self._users:
+            self._users[email] = get_user_by_email(email)
+        return self._users[email]
+
+    def verify(self, email: str, password: str) -> bool:
+        key = (email.lower(), hashlib.sha256(password.encode()).digest())
+        if key not in self._checks:
+            self._checks[key] = check_user_password(self.user(email), password)
+        return self._checks[key]
+
+    def forget(self, user_id: int) -> None:
+        emails = {email for email, user in self._users.items() if user and user.user_id == user_id}
+        for email in emails:
+            del self._users[email]
+        self._checks = {key: result for key, result in self._checks.items() if key[0] not in emails}
+
+
+def forget_credentials(user_id: int) -> None:
+    if has_request_context() and 'credentials' in g:
+        g.credentials.forget(user_id)
+
+
+def get_credential_context() -> CredentialContext:
+    if 'credentials' not in g:
+        g.credentials = CredentialContext()
+    return g.credentials
+
+
 def validate_password(email: str, password: str) -> bool:
-    password_hash = get_user_by_email(email).password_hash
-    return bcrypt.checkpw(password.encode(), password_hash)
+    if has_request_context():
+        return get_credential_context().verify(email, password)
+    return check_user_password(get_user_by_email(email), password)
+
+
+class UserSnapshot(UserMixin):
+    # Read-only copy of what requests need from the logged-in user; it is
+    # shared between requests, so it must not be an ORM instance.
+    __slots__ = ('user_id', 'username', 'email', 'full_name', 'date_of_birth')
+
+    def __init__(self, user: User) -> None:
+        for field in self.__slots__:
+            object.__setattr__(self, field, getattr(user, field))
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError('UserSnapshot is read-only.')
+
+    def get_id(self) -> int:
+        return self.user_id
+
+
+user_cache = LocalCache(max_entries=app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL'])
+
+
+def invalidate_user(user_id: int) -> None:
+    user_cache.delete(make_key('user', user_id))
+
+
+def invalidate_user_snapshot(mapper, connection, user: User) -> None:
+    # Catches ORM writes outside the change_* functions; those also
+    # invalidate after commit so a concurrent load cannot re-cache old data.
+    invalidate_user(user.user_id)
+
+
+event.listen(User, 'after_update', invalidate_user_snapshot)
+event.listen(User, 'after_delete', invalidate_user_snapshot)
 
 
 @login_manager.user_loader
-def load_user(user_id: int) -> User:
-    return User.query.get(user_id)
+def load_user(user_id: int) -> Optional[UserSnapshot]:
+    # Per-worker and short-lived: the change_* functions invalidate this
+    # worker's entry, other workers catch up within USER_CACHE_TTL seconds.
+    def load() -> Optional[UserSnapshot]:
+        user = User.query.get(user_id)
+        return UserSnapshot(user) if user else None
+    return user_cache.get_or_set(make_key('user', int(user_id)), load)
 
 
 def change_username(user_id: int, username: str) -> None:
     user = User.query.filter(User.user_id == user_id).first()
     user.username = username
+    # The username is part of every rendered product card.
+    (Product.query.filter(Product.user_id == user_id)
+     .update({Product.version: Product.version + 1}, synchronize_session=False))
     db.session.commit()
+    invalidate_user(user_id)
 
 
 def change_email(user_id: int, email: str) -> None:
     user = User.query.filter(User.user_id == user_id).first()
     user.email = email.lower()
     db.session.commit()
+    forget_credentials(user_id)
+    invalidate_user(user_id)
 
 
 def change_password(user_id: int, password: str) -> None:
-    hashed_password = bcrypt.hashpw(password.encode(), bcrypt.gensalt())
+    hashed_password = password_hasher.hash(password)
     user = User.query.filter(User.user_id == user_id).first()
     user.password_hash = hashed_password
     db.session.commit()
+    forget_credentials(user_id)
+    invalidate_user(user_id)
 
 
 def change_fullname(user_id: int, fullname: str) -> None:
     user = User.query.filter(User.user_id == user_id).first()
     user.full_name = fullname.lower()
     db.session.commit()
+    invalidate_user(user_id)
 
 
 def change_birthday(user_id: int, birthday: date) -> None:
     user = User.query.filter(User.user_id == user_id).first()
     user.date_of_birth = birthday
-    db.session.commit()
\ No newline at end of file
+    db.session.commit()
+    invalidate_user(user_id)
\ No newline at end of file
@@ -0,0 +1,47 @@
+import csv
+import io
+import json
+from decimal import Decimal
+from typing import Any, Dict, Iterable, Iterator
+
+# Same columns the importer reads, so an export can be imported again, into
+# this account or another; cost is informational and ignored on import.
+COLUMNS = ('product', 'product_amount', 'product_unit', 'public', 'ingredient', 'amount', 'unit',
+           'sub_product_id', 'cost')
+MIMETYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+# Rows are buffered into chunks of about this many characters per write.
+CHUNK_SIZE = 64 * 1024
+
+
+def encode(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def csv_chunks(rows: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=COLUMNS, extrasaction='ignore')
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def jsonl_chunks(rows: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write(json.dumps({column: row.get(column) for column in COLUMNS}, default=encode))
+        buffer.write('\n')
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+WRITERS = {'csv': csv_chunks, 'jsonl': jsonl_chunks}
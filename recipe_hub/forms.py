@@ -1,13 +1,26 @@
+from typing import Dict, List
+
 from flask_login import current_user
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileAllowed, FileField, FileRequired
 from sqlalchemy import and_
-from wtforms import BooleanField, PasswordField, SelectField, StringField, SubmitField
-from wtforms.fields.html5 import DateField, IntegerField
+from wtforms import (BooleanField, FloatField, PasswordField, SelectField, StringField, SubmitField,
+                     TextAreaField)
+from wtforms.fields.html5 import DateField, DecimalField, IntegerField
 from wtforms.fields.simple import HiddenField
-from wtforms.validators import DataRequired, Email, EqualTo, Length, Optional, ValidationError
+from wtforms.validators import (DataRequired, Email, EqualTo, InputRequired, Length, NumberRange,
+                                Optional, ValidationError)
+
+from recipe_hub.db_funcs import (creates_cycle, get_credential_context, get_product_id, get_user_by_username,
+                                 validate_password)
+from recipe_hub.mappings import Ingredient, IngredientPrice, Recipe, User
+from recipe_hub.units import get_conversion_table, get_unit_registry
+
 
-from recipe_hub.db_funcs import get_all_units, get_unit_id, validate_password
-from recipe_hub.mappings import Ingredient, Product, Recipe, User
+class UnitChoicesForm(FlaskForm):
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.unit.choices = get_unit_registry().choices
 
 
 class RegisterForm(FlaskForm):
@@ -20,8 +33,7 @@ class RegisterForm(FlaskForm):
     submit = SubmitField('Sign Up')
 
     def validate_username(self, username: str) -> None:
-        user = User.query.filter(User.username.ilike(username.data)).first()
-        if user:
+        if get_user_by_username(username.data):
             raise ValidationError('Chosen username is unavailable. Please choose a diffrent one')
 
     def validate_email(self, email: str) -> None:
@@ -38,35 +50,34 @@ class LoginForm(FlaskForm):
 
     def validate_email(self, email: str) -> None:
         if not self.email.errors:
-            user = User.query.filter(User.email == email.data.lower()).first()
+            user = get_credential_context().user(email.data)
             if not user:
                 raise ValidationError('No account exists for the provided email.')
 
 
-class ProductForm(FlaskForm):
+class ProductForm(UnitChoicesForm):
     name = StringField('Recipe Name', validators=[DataRequired()])
     amount = IntegerField('Final Amount', validators=[DataRequired()])
-    unit = SelectField('Final Unit', choices=get_all_units(), coerce=get_unit_id, validators=[DataRequired()])
+    unit = SelectField('Final Unit', coerce=int, validators=[DataRequired()])
     public = BooleanField('Publish Publically')
     submit = SubmitField('Add')
     
     def validate_name(self, name: str) -> None:
-        product = Product.query.filter(and_(Product.user_id == current_user.user_id,
-                                               Product.name == name.data.lower())).first()
-        if product:
+        if get_product_id(current_user.user_id, name.data):
             raise ValidationError('A product with the chosen name already exists on your profile. Please choose a different name.')
 
 
-class RecipeForm(FlaskForm):
+class RecipeForm(UnitChoicesForm):
     product_id = HiddenField()
     ingredient = StringField('Ingredient', validators=[DataRequired()])
     amount = IntegerField('Amount', validators=[DataRequired()])
-    unit = SelectField('Unit', choices=get_all_units(), coerce=get_unit_id, validators=[DataRequired()])
+    unit = SelectField('Unit', coerce=int, validators=[DataRequired()])
     submit = SubmitField('+')
     
     def validate_ingredient(self, ingredient: str) -> None:
         ingredient_object = Ingredient.query.filter(and_(Ingredient.name == ingredient.data.lower(),
-                                                     Ingredient.unit_id == self.unit.data)).first()
+                                                     Ingredient.unit_id == self.unit.data,
+                                                     Ingredient.product_id == None)).first()
         if ingredient_object is not None:
             recipe = Recipe.query.filter(and_(Recipe.product_id == self.product_id.data,
                                                 Recipe.ingredient_id == ingredient_object.ingredient_id)).first()
@@ -74,6 +85,68 @@ class RecipeForm(FlaskForm):
                 raise ValidationError('The given ingredient is already found in the recipe.')
 
 
+class BulkRecipeForm(FlaskForm):
+    # One "ingredient, amount, unit" entry per line.
+    lines = TextAreaField('Ingredients', validators=[DataRequired()])
+    submit = SubmitField('Add all')
+    
+    def parse_lines(self) -> List[Dict[str, str]]:
+        parsed = []
+        for text in self.lines.data.splitlines():
+            if not text.strip():
+                continue
+            fields = [field.strip() for field in text.rsplit(',', 2)]
+            parsed.append(dict(zip(('ingredient', 'amount', 'unit'), fields)))
+        return parsed
+
+
+class ImportForm(FlaskForm):
+    file = FileField('Recipe file', validators=[FileRequired(),
+                                                FileAllowed(['csv', 'jsonl', 'ndjson', 'json'],
+                                                            'Upload a CSV or JSON Lines file.')])
+    submit = SubmitField('Import')
+
+
+class SubRecipeForm(FlaskForm):
+    CYCLE_ERROR = 'The chosen product already uses this product.'
+    
+    sub_product = SelectField('Product', coerce=int, validators=[DataRequired()])
+    amount = IntegerField('Amount', validators=[DataRequired()])
+    submit = SubmitField('+')
+    
+    def __init__(self, product_id: int, *args, **kwargs) -> None:
+        # The product comes from the URL, never from the submitted form.
+        super().__init__(*args, **kwargs)
+        self.product_id = product_id
+    
+    def validate_sub_product(self, sub_product: int) -> None:
+        if creates_cycle(self.product_id, sub_product.data):
+            raise ValidationError(self.CYCLE_ERROR)
+        recipe = (Recipe.query.join(Ingredient, Ingredient.ingredient_id == Recipe.ingredient_id)
+                  .filter(and_(Recipe.product_id == self.product_id,
+                               Ingredient.product_id == sub_product.data)).first())
+        if recipe:
+            raise ValidationError('The chosen product is already found in the recipe.')
+
+
+class PriceForm(UnitChoicesForm):
+    ingredient_id = SelectField('Ingredient', coerce=int, validators=[DataRequired()])
+    price = DecimalField('Price', places=2, validators=[InputRequired(), NumberRange(min=0)])
+    package_amount = IntegerField('Package Amount', validators=[DataRequired(), NumberRange(min=1)])
+    unit = SelectField('Package Unit', coerce=int, validators=[DataRequired()])
+    density = FloatField('Density (g/ml)', validators=[Optional(), NumberRange(min=0.001)])
+    submit = SubmitField('Set Price')
+    
+    def validate_unit(self, unit: int) -> None:
+        ingredient = Ingredient.query.get(self.ingredient_id.data)
+        if ingredient is None:
+            raise ValidationError('The chosen ingredient does not exist.')
+        saved = IngredientPrice.query.get((current_user.user_id, ingredient.ingredient_id))
+        density = self.density.data or (saved and saved.density) or ingredient.density
+        if get_conversion_table().factor(ingredient.unit_id, unit.data, density) is None:
+            raise ValidationError('The package unit cannot be converted to the ingredient unit.')
+
+
 class UsernameForm(FlaskForm):
     username = StringField('New Username', validators=[DataRequired(), Length(min=2, max=20)])
     password = PasswordField('Password', validators=[DataRequired(), Length(min=8)])
@@ -82,9 +155,9 @@ class UsernameForm(FlaskForm):
     def validate_username(self, username: str) -> None:
         if username.data == current_user.username:
             raise ValidationError('Please choose a new username.')
-        user = User.query.filter(and_(User.username.ilike(username.data),
-                                         User.username != current_user.username)).first()
-        if user:
+        user = get_user_by_username(username.data)
+        # Changing the capitalization of one's own username is allowed.
+        if user and user.user_id != current_user.user_id:
             raise ValidationError('Chosen username is unavailable. Please choose a diffrent one')
 
 
@@ -108,7 +181,10 @@ class PasswordForm(FlaskForm):
     submit = SubmitField('Change Password')
     
     def validate_new_password(self, new_password: str) -> None:
-        if validate_password(current_user.email, new_password.data):
+        # Comparing with the current password reuses the check the view makes
+        # anyway instead of running bcrypt on the new password as well.
+        if (new_password.data == self.cur_password.data
+                and validate_password(current_user.email, self.cur_password.data)):
             raise ValidationError('Please choose a new password.')
 
 
@@ -0,0 +1,301 @@
+import csv
+import json
+import os
+from typing import IO, Any, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Set, Tuple
+
+from sqlalchemy import bindparam, select
+
+from recipe_hub import db
+from recipe_hub.db_funcs import (add_ingredients, add_product_ingredients, apply_usage_deltas, cost_queue,
+                                 graph_reaches, invalidate_search, load_sub_recipe_graph, mark_costs_stale,
+                                 resolve_recipe_line, resolve_unit, usage_deltas)
+from recipe_hub.mappings import Product, Recipe
+
+FORMATS = ('csv', 'jsonl')
+BATCH_SIZE = 5000
+MAX_REPORTED_ERRORS = 100
+# Caches are dropped once they grow past this, keeping memory flat on huge files.
+CACHE_LIMIT = 100000
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 'on'}
+
+# Each row is one recipe line: product, product_amount, product_unit, public,
+# ingredient, amount, unit. The product columns only need to be filled on the
+# first row of a new product; a row without an ingredient just declares it.
+# A row with a sub_product_id uses another product of the same user: the id
+# when it is one of theirs, otherwise the product named by the ingredient
+# column, as exports write it. Sub-products may appear later in the file;
+# such lines wait, keyed by name, until a batch defines that product.
+
+# (row number, product_id, sub_product_id, sub-product name, amount)
+SubLine = Tuple[int, int, str, str, int]
+
+
+def detect_format(filename: str) -> str:
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.jsonl', '.ndjson', '.json'):
+        return 'jsonl'
+    raise ValueError(f'Unsupported file type: {extension or filename}.')
+
+
+def read_rows(stream: IO[str], fmt: str) -> Iterator[Any]:
+    if fmt == 'csv':
+        for row in csv.DictReader(stream):
+            yield {(key or '').strip().lower(): value for key, value in row.items()}
+    else:
+        for text in stream:
+            if not text.strip():
+                continue
+            try:
+                yield json.loads(text)
+            except ValueError:
+                yield None
+
+
+class ImportStats:
+    def __init__(self) -> None:
+        self.rows = 0
+        self.products = 0
+        self.lines = 0
+        self.skipped = 0
+        self.errors: List[Dict[str, Any]] = []
+        self.error_count = 0
+
+    def add_error(self, row: int, error: str) -> None:
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': row, 'error': error})
+
+
+class RecipeImporter:
+    # Rows are handled in batches of batch_size: one lookup per table, one
+    # executemany per table and one commit per batch. After each commit the
+    # last row number is written to checkpoint_path so a rerun resumes there.
+    def __init__(self, user_id: int, batch_size: int = BATCH_SIZE,
+                 checkpoint_path: Optional[str] = None,
+                 progress: Optional[Callable[[ImportStats], None]] = None) -> None:
+        self.user_id = user_id
+        self.batch_size = batch_size
+        self.checkpoint_path = checkpoint_path
+        self.progress = progress
+        self.stats = ImportStats()
+        self._products: Dict[str, int] = {}
+        self._ingredients: Dict[Tuple[str, int], int] = {}
+        # Sub-recipe lines whose sub-product has not been imported yet, by name.
+        self._pending: Dict[str, List[SubLine]] = {}
+
+    def run(self, rows: Iterable[Any]) -> ImportStats:
+        resume_after = self._read_checkpoint()
+        batch = []
+        for number, row in enumerate(rows, start=1):
+            if number <= resume_after:
+                self.stats.skipped += 1
+                continue
+            batch.append((number, row))
+            if len(batch) >= self.batch_size:
+                self._write_batch(batch)
+                batch = []
+        if batch:
+            self._write_batch(batch)
+        for name, lines in self._pending.items():
+            for number, *_ in lines:
+                self.stats.add_error(number, f'Sub-product {name} was not found.')
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        return self.stats
+
+    def _write_batch(self, batch: List[Tuple[int, Any]]) -> None:
+        if len(self._products) > CACHE_LIMIT:
+            self._products.clear()
+        if len(self._ingredients) > CACHE_LIMIT:
+            self._ingredients.clear()
+        definitions: Dict[str, Dict[str, Any]] = {}
+        declarations = []
+        lines = []
+        sub_lines = []
+        for number, row in batch:
+            self.stats.rows += 1
+            if not isinstance(row, Mapping):
+                self.stats.add_error(number, 'Row must be an object.')
+                continue
+            product = str(row.get('product') or '').strip().lower()
+            if not product:
+                self.stats.add_error(number, 'Product name is required.')
+                continue
+            if product not in definitions and row.get('product_amount') not in (None, ''):
+                definition = self._parse_product(row)
+                if definition is None:
+                    self.stats.add_error(number, 'Product amount or unit is invalid.')
+                    continue
+                definitions[product] = definition
+            if str(row.get('ingredient') or '').strip():
+                try:
+                    line = (number, product) + resolve_recipe_line(row)
+                except ValueError as error:
+                    self.stats.add_error(number, str(error))
+                    continue
+                sub_product_id = str(row.get('sub_product_id') or '').strip()
+                if sub_product_id:
+                    sub_lines.append((number, product, sub_product_id, line[2], line[3]))
+                else:
+                    lines.append(line)
+            else:
+                declarations.append((number, product))
+        referenced = ({product for _, product in declarations} | {line[1] for line in lines}
+                      | {line[1] for line in sub_lines})
+        product_ids = self._resolve_products(definitions, referenced)
+        for number, product in declarations:
+            if product not in product_ids:
+                self.stats.add_error(number, f'Product {product} has no amount and unit.')
+        resolvable = []
+        for number, product, sub_product_id, name, amount in sub_lines:
+            if product not in product_ids:
+                self.stats.add_error(number, f'Product {product} has no amount and unit.')
+            else:
+                resolvable.append((number, product_ids[product], sub_product_id, name, amount))
+        for name in self._pending.keys() & product_ids.keys():
+            resolvable.extend(self._pending.pop(name))
+        entries: Dict[Tuple[int, Tuple[str, int]], int] = {}
+        for number, product, name, amount, unit_id in lines:
+            if product not in product_ids:
+                self.stats.add_error(number, f'Product {product} has no amount and unit.')
+            elif (product_ids[product], (name, unit_id)) in entries:
+                self.stats.skipped += 1
+            else:
+                entries[(product_ids[product], (name, unit_id))] = amount
+        ingredient_ids = self._resolve_ingredients({key for _, key in entries})
+        recipes = {(product_id, ingredient_ids[key]): amount for (product_id, key), amount in entries.items()}
+        if recipes:
+            existing = set(db.session.query(Recipe.product_id, Recipe.ingredient_id)
+                           .filter(Recipe.product_id.in_(bindparam('product_ids', expanding=True)))
+                           .params(product_ids=sorted({product_id for product_id, _ in recipes})))
+            existing &= recipes.keys()
+            self.stats.skipped += len(existing)
+            rows = [{'product_id': product_id, 'ingredient_id': ingredient_id, 'amount': amount}
+                    for (product_id, ingredient_id), amount in recipes.items()
+                    if (product_id, ingredient_id) not in existing]
+            if rows:
+                db.session.execute(Recipe.__table__.insert(), rows)
+                apply_usage_deltas(usage_deltas((row['ingredient_id'], row['amount']) for row in rows))
+                self.stats.lines += len(rows)
+        touched = {product_id for product_id, _ in recipes} | self._add_sub_lines(resolvable)
+        stale_ids = mark_costs_stale(select([Product.product_id])
+                                     .where(Product.product_id.in_(list(touched)))) if touched else []
+        db.session.commit()
+        cost_queue.enqueue(stale_ids)
+        self._write_checkpoint(batch[-1][0])
+        if self.progress:
+            self.progress(self.stats)
+
+    def _parse_product(self, row: Mapping[str, Any]) -> Optional[Dict[str, Any]]:
+        try:
+            amount = int(row.get('product_amount'))
+        except (TypeError, ValueError):
+            return None
+        unit = resolve_unit(row.get('product_unit'))
+        if amount <= 0 or unit is None:
+            return None
+        public = row.get('public')
+        if not isinstance(public, bool):
+            public = str(public or '').strip().lower() in TRUE_VALUES
+        return {'amount': amount, 'unit_id': unit.unit_id, 'public': public}
+
+    def _resolve_products(self, definitions: Dict[str, Dict[str, Any]],
+                          referenced: Set[str]) -> Dict[str, int]:
+        names = (set(definitions) | referenced) - self._products.keys()
+        if names:
+            self._products.update(self._select_products(names))
+            missing = [name for name in sorted(names - self._products.keys()) if name in definitions]
+            if missing:
+                db.session.execute(Product.__table__.insert(),
+                                   [dict(definitions[name], name=name, user_id=self.user_id)
+                                    for name in missing])
+                invalidate_search('products')
+                self.stats.products += len(missing)
+                self._products.update(self._select_products(missing))
+        return {name: self._products[name] for name in set(definitions) | referenced
+                if name in self._products}
+
+    def _select_products(self, names: Iterable[str]) -> Dict[str, int]:
+        rows = (db.session.query(Product.name, Product.product_id)
+                .filter(Product.user_id == self.user_id, Product.name.in_(bindparam('names', expanding=True)))
+                .params(names=sorted(names)))
+        return {row.name: row.product_id for row in rows}
+
+    def _resolve_sub_products(self, lines: List[SubLine]) -> List[Optional[int]]:
+        ids = {int(sub_product_id) for _, _, sub_product_id, _, _ in lines if sub_product_id.isdigit()}
+        owned = set()
+        if ids:
+            owned = {row.product_id for row in
+                     db.session.query(Product.product_id)
+                     .filter(Product.user_id == self.user_id,
+                             Product.product_id.in_(bindparam('ids', expanding=True)))
+                     .params(ids=sorted(ids))}
+        names = {name for _, _, sub_product_id, name, _ in lines
+                 if not (sub_product_id.isdigit() and int(sub_product_id) in owned)}
+        missing = names - self._products.keys()
+        if missing:
+            self._products.update(self._select_products(missing))
+        return [int(sub_product_id) if sub_product_id.isdigit() and int(sub_product_id) in owned
+                else self._products.get(name)
+                for _, _, sub_product_id, name, _ in lines]
+
+    def _add_sub_lines(self, lines: List[SubLine]) -> Set[int]:
+        # Inserts, in the batch's transaction, every line whose sub-product
+        # exists and keeps the rest pending. Lines already in the recipe are
+        # skipped, so a resumed batch is safe. Returns the products changed.
+        if not lines:
+            return set()
+        resolved = []
+        for line, sub_id in zip(lines, self._resolve_sub_products(lines)):
+            if sub_id is None:
+                self._pending.setdefault(line[3], []).append(line)
+            else:
+                resolved.append((line, sub_id))
+        if not resolved:
+            return set()
+        ingredient_ids = add_product_ingredients(sub_id for _, sub_id in resolved)
+        graph = load_sub_recipe_graph({sub_id for _, sub_id in resolved})
+        existing = set(db.session.query(Recipe.product_id, Recipe.ingredient_id)
+                       .filter(Recipe.product_id.in_(bindparam('product_ids', expanding=True)))
+                       .params(product_ids=sorted({line[1] for line, _ in resolved})))
+        rows = []
+        for (number, product_id, _, _, amount), sub_id in resolved:
+            key = (product_id, ingredient_ids[sub_id])
+            if key in existing:
+                self.stats.skipped += 1
+            elif graph_reaches(graph, sub_id, product_id):
+                self.stats.add_error(number, f'Product {sub_id} already depends on product {product_id}.')
+            else:
+                existing.add(key)
+                graph.setdefault(product_id, set()).add(sub_id)
+                rows.append({'product_id': product_id, 'ingredient_id': key[1], 'amount': amount})
+        if rows:
+            db.session.execute(Recipe.__table__.insert(), rows)
+            self.stats.lines += len(rows)
+        return {row['product_id'] for row in rows}
+
+    def _resolve_ingredients(self, keys: Set[Tuple[str, int]]) -> Dict[Tuple[str, int], int]:
+        missing = keys - self._ingredients.keys()
+        if missing:
+            self._ingredients.update(add_ingredients(missing))
+        return {key: self._ingredients[key] for key in keys}
+
+    def _read_checkpoint(self) -> int:
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return 0
+        with open(self.checkpoint_path) as checkpoint:
+            state = json.load(checkpoint)
+        for line in state.get('pending', []):
+            self._pending.setdefault(line[3], []).append(tuple(line))
+        return state['row']
+
+    def _write_checkpoint(self, row: int) -> None:
+        if not self.checkpoint_path:
+            return
+        temporary_path = f'{self.checkpoint_path}.tmp'
+        with open(temporary_path, 'w') as checkpoint:
+            json.dump({'row': row, 'pending': [line for lines in self._pending.values() for line in lines]},
+                      checkpoint)
+        os.replace(temporary_path, self.checkpoint_path)
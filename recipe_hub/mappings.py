@@ -1,3 +1,5 @@
+from random import random
+
 from flask_login import UserMixin
 
 from recipe_hub import db
@@ -17,16 +19,26 @@ class User(db.Model, UserMixin):
         return self.user_id
 
 
+# Usernames are compared case-insensitively.
+db.Index('ix_users_username_lower', db.func.lower(User.username))
+
+
 class Unit(db.Model):
     __tablename__ = 'units'
     
     unit_id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False, unique=True)
     symbol = db.Column(db.String, unique=True)
+    dimension = db.Column(db.String)
+    factor = db.Column(db.Float, nullable=False, default=1)
 
 
 class Product(db.Model):
     __tablename__ = 'products'
+    __table_args__ = (db.Index('ix_products_public_random_key', 'public', 'random_key'),
+                      db.Index('ix_products_user_id_name', 'user_id', 'name', 'product_id'),
+                      db.Index('ix_products_public_product_id', 'product_id',
+                               postgresql_where=db.text('public'), sqlite_where=db.text('public')))
     
     product_id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
@@ -34,19 +46,94 @@ class Product(db.Model):
     unit_id = db.Column(db.Integer, db.ForeignKey('units.unit_id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'), nullable=False)
     public = db.Column(db.Boolean)
+    random_key = db.Column(db.Float, nullable=False, default=random)
+    cost = db.Column(db.Numeric(14, 4), nullable=False, default=0)
+    cost_complete = db.Column(db.Boolean, nullable=False, default=True)
+    cost_stale = db.Column(db.Boolean, nullable=False, default=False)
+    # Bumped whenever anything served for the product changes (ETags, caches).
+    version = db.Column(db.Integer, nullable=False, default=1)
+    
+    unit = db.relationship('Unit')
+    user = db.relationship('User')
 
 
 class Ingredient(db.Model):
     __tablename__ = 'ingredients'
+    # Plain ingredients are unique per (name, unit); sub-product ingredients
+    # (product_id set) are looked up by their product instead.
+    __table_args__ = (db.Index('ux_ingredients_name_unit_id', 'name', 'unit_id', unique=True,
+                               postgresql_where=db.text('product_id IS NULL'),
+                               sqlite_where=db.text('product_id IS NULL')),
+                      db.Index('ix_ingredients_product_id', 'product_id',
+                               postgresql_where=db.text('product_id IS NOT NULL'),
+                               sqlite_where=db.text('product_id IS NOT NULL')))
     
     ingredient_id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
     unit_id = db.Column(db.Integer, db.ForeignKey('units.unit_id'), nullable=False)
+    # Deleting a product deletes its sub-product ingredient, and with it every
+    # recipe line and price that used it.
+    product_id = db.Column(db.Integer, db.ForeignKey('products.product_id', ondelete='CASCADE'))
+    density = db.Column(db.Float)
+    
+    unit = db.relationship('Unit')
+
+
+# Name search: a C-collation index answers LIKE 'prefix%' as a range scan and
+# returns the names already in order. SQLite searches an in-memory trie instead.
+# The trigram indexes need pg_trgm, so only migrations create them.
+db.event.listen(Ingredient.__table__, 'after_create', db.DDL(
+    'CREATE INDEX ix_ingredients_name_prefix ON ingredients (name COLLATE "C") '
+    'WHERE product_id IS NULL').execute_if(dialect='postgresql'))
+db.event.listen(Product.__table__, 'after_create', db.DDL(
+    'CREATE INDEX ix_products_name_prefix ON products (name COLLATE "C", product_id)'
+).execute_if(dialect='postgresql'))
 
 
 class Recipe(db.Model):
     __tablename__ = 'recipes'
+    # Reverse lookups (which products use an ingredient) walk this in product order.
+    __table_args__ = (db.Index('ix_recipes_ingredient_id_product_id', 'ingredient_id', 'product_id'),)
+    
+    product_id = db.Column(db.Integer, db.ForeignKey('products.product_id', ondelete='CASCADE'),
+                           primary_key=True)
+    ingredient_id = db.Column(db.Integer, db.ForeignKey('ingredients.ingredient_id', ondelete='CASCADE'),
+                              primary_key=True)
+    amount = db.Column(db.Integer, nullable=False)
+    
+    ingredient = db.relationship('Ingredient')
+
+
+class IngredientUsage(db.Model):
+    # Summary of the recipes rows per ingredient, kept in step by every recipe
+    # write (see db_funcs.apply_usage_deltas).
+    __tablename__ = 'ingredient_usage'
+    
+    ingredient_id = db.Column(db.Integer, db.ForeignKey('ingredients.ingredient_id', ondelete='CASCADE'),
+                              primary_key=True)
+    product_count = db.Column(db.Integer, nullable=False, default=0)
+    total_amount = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+class SchemaMigration(db.Model):
+    __tablename__ = 'schema_migrations'
+    
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String, nullable=False)
+    applied_at = db.Column(db.DateTime, nullable=False)
+
+
+class IngredientPrice(db.Model):
+    __tablename__ = 'ingredient_prices'
+    # Cascading ingredient deletes and the unused-ingredient sweep look prices up by ingredient.
+    __table_args__ = (db.Index('ix_ingredient_prices_ingredient_id', 'ingredient_id'),)
     
-    product_id = db.Column(db.Integer, db.ForeignKey('products.product_id'), primary_key=True)
-    ingredient_id = db.Column(db.Integer, db.ForeignKey('ingredients.ingredient_id'), primary_key=True)
-    amount = db.Column(db.Integer, nullable=False)
\ No newline at end of file
+    user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'), primary_key=True)
+    ingredient_id = db.Column(db.Integer, db.ForeignKey('ingredients.ingredient_id', ondelete='CASCADE'),
+                              primary_key=True)
+    price = db.Column(db.Numeric(10, 2), nullable=False)
+    package_amount = db.Column(db.Integer, nullable=False)
+    unit_id = db.Column(db.Integer, db.ForeignKey('units.unit_id'))
+    # Grams per milliliter as this user measures the ingredient; falls back to
+    # the shared Ingredient.density.
+    density = db.Column(db.Float)
\ No newline at end of file
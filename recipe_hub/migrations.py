@@ -0,0 +1,251 @@
+from datetime import datetime
+from typing import Callable, List, NamedTuple, Optional, Tuple, Union
+
+from sqlalchemy import inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+
+from recipe_hub import db
+from recipe_hub.mappings import SchemaMigration
+from recipe_hub.units import invalidate_unit_registry
+
+# Migrations are frozen DDL rather than derived from mappings.py, so that
+# later model changes never rewrite history. Every step must be safe to rerun:
+# create_all already builds the current indexes on a fresh database.
+
+Step = Union[str, Callable[[Connection], None]]
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    steps: Tuple[Step, ...]
+
+
+def merge_duplicate_ingredients(connection: Connection) -> None:
+    # Plain ingredients become unique per (name, unit_id); repoint recipes and
+    # prices at the oldest copy, dropping rows that would then collide.
+    groups = connection.execute(text(
+        'SELECT min(ingredient_id) AS keeper_id, name, unit_id FROM ingredients '
+        'WHERE product_id IS NULL GROUP BY name, unit_id HAVING count(*) > 1')).fetchall()
+    for keeper_id, name, unit_id in groups:
+        duplicate_ids = [row.ingredient_id for row in connection.execute(text(
+            'SELECT ingredient_id FROM ingredients WHERE product_id IS NULL AND name = :name '
+            'AND unit_id = :unit_id AND ingredient_id <> :keeper_id'),
+            name=name, unit_id=unit_id, keeper_id=keeper_id)]
+        for duplicate_id in duplicate_ids:
+            params = {'keeper_id': keeper_id, 'duplicate_id': duplicate_id}
+            connection.execute(text(
+                'DELETE FROM recipes WHERE ingredient_id = :duplicate_id AND product_id IN '
+                '(SELECT product_id FROM recipes WHERE ingredient_id = :keeper_id)'), **params)
+            connection.execute(text(
+                'UPDATE recipes SET ingredient_id = :keeper_id WHERE ingredient_id = :duplicate_id'),
+                **params)
+            connection.execute(text(
+                'DELETE FROM ingredient_prices WHERE ingredient_id = :duplicate_id AND user_id IN '
+                '(SELECT user_id FROM ingredient_prices WHERE ingredient_id = :keeper_id)'), **params)
+            connection.execute(text(
+                'UPDATE ingredient_prices SET ingredient_id = :keeper_id '
+                'WHERE ingredient_id = :duplicate_id'), **params)
+            connection.execute(text('DELETE FROM ingredients WHERE ingredient_id = :duplicate_id'),
+                               **params)
+
+
+def create_search_indexes(connection: Connection) -> None:
+    # SQLite searches names in memory. Fuzzy matching needs pg_trgm; without
+    # it search falls back to the prefix indexes alone.
+    if connection.dialect.name != 'postgresql':
+        return
+    connection.execute(text('CREATE INDEX IF NOT EXISTS ix_ingredients_name_prefix '
+                            'ON ingredients (name COLLATE "C") WHERE product_id IS NULL'))
+    connection.execute(text('CREATE INDEX IF NOT EXISTS ix_products_name_prefix '
+                            'ON products (name COLLATE "C", product_id)'))
+    if connection.execute(text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")).first() is None:
+        return
+    connection.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+    connection.execute(text('CREATE INDEX IF NOT EXISTS ix_ingredients_name_trgm '
+                            'ON ingredients USING gist (name gist_trgm_ops) WHERE product_id IS NULL'))
+    connection.execute(text('CREATE INDEX IF NOT EXISTS ix_products_name_trgm '
+                            'ON products USING gist (name gist_trgm_ops)'))
+
+
+def run_step(connection: Connection, step: Step) -> None:
+    if callable(step):
+        step(connection)
+    else:
+        connection.execute(text(step))
+
+
+def add_column(table: str, column: str, definition: str, *backfill: Step) -> Step:
+    # create_all already adds the column on a fresh database. The backfill
+    # steps only run when the column is actually added.
+    def step(connection: Connection) -> None:
+        if column in {existing['name'] for existing in inspect(connection).get_columns(table)}:
+            return
+        connection.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {definition}'))
+        for backfill_step in backfill:
+            run_step(connection, backfill_step)
+    return step
+
+
+def randomize_feed_keys(connection: Connection) -> None:
+    # SQLite's random() is a signed 64-bit integer rather than a float in [0, 1).
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text('UPDATE products SET random_key = random()'))
+    else:
+        connection.execute(text('UPDATE products SET random_key = (abs(random()) % 1000000000) / 1e9'))
+
+
+# Dimensions and factors of the units the original schema was seeded with.
+BASELINE_UNITS = (('grams', 'mass', 1), ('milliliter', 'volume', 1), ('whole', 'count', 1),
+                  ('kilograms', 'mass', 1000), ('liter', 'volume', 1000))
+
+
+def classify_units(connection: Connection) -> None:
+    for name, dimension, factor in BASELINE_UNITS:
+        connection.execute(text('UPDATE units SET dimension = :dimension, factor = :factor WHERE name = :name'),
+                           name=name, dimension=dimension, factor=factor)
+
+
+def cascades(connection: Connection, table: str, column: str) -> bool:
+    # SQLite only: whether the foreign key on table.column is ON DELETE CASCADE.
+    return any(row[3] == column and row[6] == 'CASCADE'
+               for row in connection.execute(text(f'PRAGMA foreign_key_list({table})')))
+
+
+def rebuild_sqlite_table(table: str, definition: str, columns: Tuple[str, ...],
+                         foreign_keys: Tuple[Tuple[str, str], ...], *indexes: str) -> Step:
+    # SQLite cannot alter constraints, so a table whose foreign keys do not
+    # cascade yet is recreated from definition: create, copy, drop, rename.
+    # Only tables nothing else references can be rebuilt this way, since
+    # dropping a referenced table would fire its children's cascades. Rows
+    # whose parent no longer exists are not copied; a cascade would already
+    # have removed them.
+    def step(connection: Connection) -> None:
+        if connection.dialect.name != 'sqlite':
+            return
+        if all(cascades(connection, table, column) for column, _ in foreign_keys):
+            return
+        names = ', '.join(columns)
+        orphans = ' AND '.join(f'{column} IN (SELECT {target})' for column, target in foreign_keys)
+        connection.execute(text(f'CREATE TABLE {table}_rebuilt ({definition})'))
+        connection.execute(text(f'INSERT INTO {table}_rebuilt ({names}) SELECT {names} FROM {table} '
+                                f'WHERE {orphans}'))
+        connection.execute(text(f'DROP TABLE {table}'))
+        connection.execute(text(f'ALTER TABLE {table}_rebuilt RENAME TO {table}'))
+        for index in indexes:
+            connection.execute(text(index))
+    return step
+
+
+def cascade_foreign_key(table: str, column: str, target: str) -> Step:
+    # Recreates the default-named foreign key with ON DELETE CASCADE. SQLite
+    # cannot alter constraints, so there the key must already cascade, either
+    # from create_all, from add_column or from rebuild_sqlite_table.
+    def step(connection: Connection) -> None:
+        if connection.dialect.name == 'sqlite':
+            if not cascades(connection, table, column):
+                raise RuntimeError(f'{table}.{column} does not cascade on delete; '
+                                   f'rebuild {table} before upgrading.')
+            return
+        if connection.dialect.name != 'postgresql':
+            return
+        constraint = f'{table}_{column}_fkey'
+        connection.execute(text(f'ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {constraint}, '
+                                f'ADD CONSTRAINT {constraint} FOREIGN KEY ({column}) '
+                                f'REFERENCES {target} ON DELETE CASCADE'))
+    return step
+
+
+MIGRATIONS: List[Migration] = [
+    # Columns added to the original tables, which create_all does not alter.
+    Migration(0, 'baseline columns', (
+        add_column('products', 'random_key', 'FLOAT NOT NULL DEFAULT 0', randomize_feed_keys),
+        add_column('products', 'cost', 'NUMERIC(14, 4) NOT NULL DEFAULT 0'),
+        add_column('products', 'cost_complete', 'BOOLEAN NOT NULL DEFAULT TRUE'),
+        # Stale costs are recomputed by requeue_stale_costs on start-up.
+        add_column('products', 'cost_stale', 'BOOLEAN NOT NULL DEFAULT FALSE',
+                   'UPDATE products SET cost_stale = TRUE'),
+        add_column('products', 'version', 'INTEGER NOT NULL DEFAULT 1'),
+        'CREATE INDEX IF NOT EXISTS ix_products_public_random_key ON products (public, random_key)',
+        add_column('units', 'dimension', 'VARCHAR'),
+        add_column('units', 'factor', 'FLOAT NOT NULL DEFAULT 1', classify_units),
+        add_column('ingredients', 'product_id',
+                   'INTEGER REFERENCES products (product_id) ON DELETE CASCADE'),
+        add_column('ingredients', 'density', 'FLOAT'),
+        add_column('ingredient_prices', 'unit_id', 'INTEGER REFERENCES units (unit_id)'),
+    )),
+    Migration(1, 'hot query indexes', (
+        merge_duplicate_ingredients,
+        'CREATE UNIQUE INDEX IF NOT EXISTS ux_ingredients_name_unit_id '
+        'ON ingredients (name, unit_id) WHERE product_id IS NULL',
+        # ux_ingredients_name_unit_id serves name lookups on its own.
+        'DROP INDEX IF EXISTS ix_ingredients_name',
+        'CREATE INDEX IF NOT EXISTS ix_ingredients_product_id '
+        'ON ingredients (product_id) WHERE product_id IS NOT NULL',
+        'CREATE INDEX IF NOT EXISTS ix_products_user_id_name ON products (user_id, name, product_id)',
+        'CREATE INDEX IF NOT EXISTS ix_products_public_product_id ON products (product_id) WHERE public',
+        'CREATE INDEX IF NOT EXISTS ix_users_username_lower ON users (lower(username))',
+    )),
+    Migration(2, 'ingredient usage summary', (
+        'CREATE TABLE IF NOT EXISTS ingredient_usage ('
+        'ingredient_id INTEGER PRIMARY KEY REFERENCES ingredients (ingredient_id) ON DELETE CASCADE, '
+        'product_count INTEGER NOT NULL, total_amount BIGINT NOT NULL)',
+        'DELETE FROM ingredient_usage',
+        'INSERT INTO ingredient_usage (ingredient_id, product_count, total_amount) '
+        'SELECT ingredient_id, count(*), sum(amount) FROM recipes GROUP BY ingredient_id',
+        'CREATE INDEX IF NOT EXISTS ix_recipes_ingredient_id_product_id ON recipes (ingredient_id, product_id)',
+        'DROP INDEX IF EXISTS ix_recipes_ingredient_id',
+    )),
+    Migration(3, 'name search indexes', (
+        create_search_indexes,
+    )),
+    Migration(4, 'cascading deletes', (
+        'CREATE INDEX IF NOT EXISTS ix_ingredient_prices_ingredient_id ON ingredient_prices (ingredient_id)',
+        # Recipes from the original schema; the other tables gained their
+        # cascading keys through add_column or create_all.
+        rebuild_sqlite_table(
+            'recipes',
+            'product_id INTEGER NOT NULL REFERENCES products (product_id) ON DELETE CASCADE, '
+            'ingredient_id INTEGER NOT NULL REFERENCES ingredients (ingredient_id) ON DELETE CASCADE, '
+            'amount INTEGER NOT NULL, PRIMARY KEY (product_id, ingredient_id)',
+            ('product_id', 'ingredient_id', 'amount'),
+            (('product_id', 'product_id FROM products'), ('ingredient_id', 'ingredient_id FROM ingredients')),
+            'CREATE INDEX IF NOT EXISTS ix_recipes_ingredient_id_product_id ON recipes (ingredient_id, product_id)'),
+        cascade_foreign_key('recipes', 'product_id', 'products (product_id)'),
+        cascade_foreign_key('recipes', 'ingredient_id', 'ingredients (ingredient_id)'),
+        cascade_foreign_key('ingredients', 'product_id', 'products (product_id)'),
+        cascade_foreign_key('ingredient_prices', 'ingredient_id', 'ingredients (ingredient_id)'),
+    )),
+    Migration(5, 'per-user densities', (
+        add_column('ingredient_prices', 'density', 'FLOAT'),
+    )),
+]
+
+
+def run_migration(connection: Connection, migration: Migration) -> None:
+    for step in migration.steps:
+        run_step(connection, step)
+
+
+def get_applied_versions(connection: Connection) -> List[int]:
+    return [row.version for row in connection.execute(
+        select([SchemaMigration.version]).order_by(SchemaMigration.version))]
+
+
+def upgrade(engine: Optional[Engine] = None) -> List[int]:
+    # Creates missing tables, then applies pending migrations in order, all in
+    # one transaction. Returns the versions applied.
+    applied = []
+    with (engine or db.engine).begin() as connection:
+        db.metadata.create_all(connection)
+        done = set(get_applied_versions(connection))
+        for migration in MIGRATIONS:
+            if migration.version in done:
+                continue
+            run_migration(connection, migration)
+            connection.execute(SchemaMigration.__table__.insert(), version=migration.version,
+                               name=migration.name, applied_at=datetime.utcnow())
+            applied.append(migration.version)
+    if applied:
+        invalidate_unit_registry()
+    return applied
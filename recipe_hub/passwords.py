@@ -0,0 +1,106 @@
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Mapping, Optional
+
+import bcrypt
+from flask import Flask, g, has_request_context
+
+from recipe_hub.profiling import record_hash
+
+DEFAULT_ROUNDS = 12
+
+
+class HasherBusyError(Exception):
+    pass
+
+
+def hash_password(password: bytes, rounds: int) -> bytes:
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def check_password(password: bytes, password_hash: bytes) -> bool:
+    return bcrypt.checkpw(password, password_hash)
+
+
+def get_rounds(password_hash: bytes) -> int:
+    # bcrypt hashes look like $2b$<rounds>$<salt and digest>.
+    return int(bytes(password_hash).split(b'$')[2])
+
+
+def hasher_config(environ: Mapping[str, str]) -> Dict[str, int]:
+    # Every gunicorn worker starts its own pool, so by default the CPUs are
+    # shared out between them (WEB_CONCURRENCY defaults as in gunicorn.conf.py)
+    # rather than each worker taking all of them. The queue limit is likewise
+    # per worker.
+    cpus = os.cpu_count() or 1
+    web_workers = int(environ.get('WEB_CONCURRENCY', cpus * 2 + 1))
+    workers = int(environ.get('PASSWORD_HASH_WORKERS', max(1, cpus // web_workers)))
+    return {'PASSWORD_HASH_WORKERS': workers,
+            'PASSWORD_HASH_QUEUE': int(environ.get('PASSWORD_HASH_QUEUE', max(workers, 1) * 4)),
+            'BCRYPT_ROUNDS': int(environ.get('BCRYPT_ROUNDS', DEFAULT_ROUNDS))}
+
+
+class PasswordHasher:
+    # Runs bcrypt in a process pool so hashing never competes with request
+    # threads, and admits at most PASSWORD_HASH_QUEUE calls at once; beyond
+    # that callers get HasherBusyError instead of waiting. Setting
+    # PASSWORD_HASH_WORKERS to 0 hashes inline.
+    def __init__(self, app: Flask) -> None:
+        self.app = app
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._slots: Optional[threading.BoundedSemaphore] = None
+        self._lock = threading.Lock()
+
+    @property
+    def workers(self) -> int:
+        workers = self.app.config.get('PASSWORD_HASH_WORKERS')
+        if workers is None:
+            return hasher_config(os.environ)['PASSWORD_HASH_WORKERS']
+        return workers
+
+    @property
+    def rounds(self) -> int:
+        return self.app.config.get('BCRYPT_ROUNDS', DEFAULT_ROUNDS)
+
+    def hash(self, password: str) -> bytes:
+        return self._run(hash_password, password.encode(), self.rounds)
+
+    def check(self, password: str, password_hash: bytes) -> bool:
+        return self._run(check_password, password.encode(), bytes(password_hash))
+
+    def needs_rehash(self, password_hash: bytes) -> bool:
+        return get_rounds(password_hash) != self.rounds
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+            self._executor = self._slots = None
+
+    def _run(self, function: Callable[..., Any], *args: Any) -> Any:
+        if has_request_context():
+            g.password_hashes = g.get('password_hashes', 0) + 1
+        start = time.perf_counter()
+        try:
+            if not self.workers:
+                return function(*args)
+            executor, slots = self._ensure_pool()
+            if not slots.acquire(blocking=False):
+                raise HasherBusyError('Too many password checks are queued.')
+            try:
+                return executor.submit(function, *args).result()
+            finally:
+                slots.release()
+        finally:
+            record_hash(time.perf_counter() - start)
+
+    def _ensure_pool(self):
+        with self._lock:
+            if self._executor is None:
+                workers = self.workers
+                self._executor = ProcessPoolExecutor(max_workers=workers)
+                self._slots = threading.BoundedSemaphore(
+                    self.app.config.get('PASSWORD_HASH_QUEUE', workers * 4))
+            return self._executor, self._slots
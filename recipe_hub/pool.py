@@ -0,0 +1,132 @@
+import os
+import threading
+import time
+from typing import Any, Dict, Mapping
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+POOL_SIZE = 5
+MAX_OVERFLOW = 10
+POOL_TIMEOUT = 30
+# Recycle before typical load balancer and server idle timeouts close the socket.
+POOL_RECYCLE = 1800
+
+
+class PoolMetrics:
+    def __init__(self) -> None:
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.peak_checked_out = 0
+        self._lock = threading.Lock()
+
+    def record(self, wait: float, checked_out: int, timed_out: bool = False) -> None:
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+                self.peak_checked_out = max(self.peak_checked_out, checked_out)
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+    def to_dict(self) -> Dict[str, Any]:
+        attempts = self.checkouts + self.timeouts
+        return {'checkouts': self.checkouts, 'timeouts': self.timeouts,
+                'wait_total_ms': round(self.wait_total * 1000, 3),
+                'wait_avg_ms': round(self.wait_total * 1000 / attempts, 3) if attempts else 0,
+                'wait_max_ms': round(self.wait_max * 1000, 3),
+                'peak_checked_out': self.peak_checked_out}
+
+
+class MeteredQueuePool(QueuePool):
+    # Times every checkout, including the wait for a free connection when
+    # pool_size + max_overflow are all in use.
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.record(time.perf_counter() - start, self.checkedout(), timed_out=True)
+            raise
+        self.metrics.record(time.perf_counter() - start, self.checkedout())
+        return connection
+
+    def recreate(self) -> 'MeteredQueuePool':
+        # engine.dispose() swaps in a fresh pool; keep counting across it.
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+    def status_dict(self) -> Dict[str, Any]:
+        return dict(self.metrics.to_dict(), size=self.size(), checked_out=self.checkedout(),
+                    checked_in=self.checkedin(), overflow=max(self.overflow(), 0),
+                    max_overflow=self._max_overflow)
+
+
+def get_bool(environ: Mapping[str, str], name: str, default: bool) -> bool:
+    value = environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def engine_options(uri: str, environ: Mapping[str, str]) -> Dict[str, Any]:
+    # SQLite keeps Flask-SQLAlchemy's own pool choice; pooling settings only
+    # apply to server databases.
+    if uri.startswith('sqlite'):
+        return {}
+    options: Dict[str, Any] = {
+        'poolclass': MeteredQueuePool,
+        'pool_size': int(environ.get('DB_POOL_SIZE', POOL_SIZE)),
+        'max_overflow': int(environ.get('DB_MAX_OVERFLOW', MAX_OVERFLOW)),
+        'pool_timeout': float(environ.get('DB_POOL_TIMEOUT', POOL_TIMEOUT)),
+        'pool_recycle': int(environ.get('DB_POOL_RECYCLE', POOL_RECYCLE)),
+        'pool_pre_ping': get_bool(environ, 'DB_POOL_PRE_PING', True),
+    }
+    if uri.startswith('postgres'):
+        # psycopg2 sends executemany() as multi-row VALUES pages instead of one
+        # statement per row, which is what bulk recipe writes and imports use.
+        options['executemany_mode'] = 'values'
+        statement_timeout = int(environ.get('DB_STATEMENT_TIMEOUT', 0))
+        if statement_timeout:
+            options['connect_args'] = {'options': f'-c statement_timeout={statement_timeout}'}
+    return options
+
+
+def connection_budget(workers: int, options: Mapping[str, Any]) -> int:
+    # The most connections a server of this many worker processes can open.
+    return workers * (options.get('pool_size', POOL_SIZE) + options.get('max_overflow', MAX_OVERFLOW))
+
+
+def install_fork_guard(engine: Engine) -> None:
+    # A connection inherited across fork() shares its socket with the parent;
+    # drop it without closing so only the owning process ever talks on it.
+    @event.listens_for(engine, 'connect')
+    def remember_pid(dbapi_connection, connection_record) -> None:
+        connection_record.info['pid'] = os.getpid()
+
+    @event.listens_for(engine, 'checkout')
+    def check_pid(dbapi_connection, connection_record, connection_proxy) -> None:
+        pid = os.getpid()
+        if connection_record.info.get('pid', pid) != pid:
+            connection_record.connection = connection_proxy.connection = None
+            raise exc.DisconnectionError(
+                f"Connection belongs to process {connection_record.info['pid']}, not {pid}.")
+
+
+def enable_sqlite_foreign_keys(engine: Engine) -> None:
+    # SQLite ignores foreign keys, ON DELETE CASCADE included, unless every
+    # connection switches them on.
+    @event.listens_for(engine, 'connect')
+    def foreign_keys_on(dbapi_connection, connection_record) -> None:
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys = ON')
+        cursor.close()
@@ -0,0 +1,170 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+from flask import Flask, abort, g, has_request_context, jsonify, request
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from werkzeug.wrappers import Response
+
+logger = logging.getLogger(__name__)
+
+QUERY_BUDGET = 50
+LATENCY_BUDGET_MS = 500
+SLOW_QUERY_MS = 100
+HISTORY = 200
+MAX_STATEMENT_LENGTH = 300
+LOCAL_ADDRESSES = ('127.0.0.1', '::1')
+
+
+class RequestProfile:
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.total = 0.0
+        self.queries = 0
+        self.db_time = 0.0
+        self.slowest_query = 0.0
+        self.slowest_statement: Optional[str] = None
+        self.hashes = 0
+        self.hash_time = 0.0
+        self.renders = 0
+        self.render_time = 0.0
+
+    def add_query(self, statement: str, elapsed: float) -> None:
+        self.queries += 1
+        self.db_time += elapsed
+        if elapsed > self.slowest_query:
+            self.slowest_query = elapsed
+            self.slowest_statement = ' '.join(statement.split())[:MAX_STATEMENT_LENGTH]
+
+    def finish(self) -> None:
+        self.total = time.perf_counter() - self.start
+
+    def server_timing(self) -> str:
+        return ', '.join([f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries"',
+                          f'bcrypt;dur={self.hash_time * 1000:.1f};desc="{self.hashes} hashes"',
+                          f'render;dur={self.render_time * 1000:.1f};desc="{self.renders} templates"',
+                          f'total;dur={self.total * 1000:.1f}'])
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'total_ms': round(self.total * 1000, 3),
+                'queries': self.queries,
+                'db_ms': round(self.db_time * 1000, 3),
+                'slowest_query_ms': round(self.slowest_query * 1000, 3),
+                'slowest_statement': self.slowest_statement,
+                'hashes': self.hashes,
+                'bcrypt_ms': round(self.hash_time * 1000, 3),
+                'renders': self.renders,
+                'render_ms': round(self.render_time * 1000, 3)}
+
+
+def get_profile() -> Optional[RequestProfile]:
+    # Work done outside a request, e.g. by the cost recompute worker, is not counted.
+    if not has_request_context():
+        return None
+    return g.get('profile')
+
+
+def record_hash(elapsed: float) -> None:
+    profile = get_profile()
+    if profile is not None:
+        profile.hashes += 1
+        profile.hash_time += elapsed
+
+
+class TimedTemplate(Template):
+    # Only top-level renders go through render(); included templates are
+    # counted as part of the template that includes them.
+    def render(self, *args: Any, **kwargs: Any) -> str:
+        start = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            profile = get_profile()
+            if profile is not None:
+                profile.renders += 1
+                profile.render_time += time.perf_counter() - start
+
+
+class Profiler:
+    # Times every request: SQL statements, bcrypt calls and template renders.
+    # Each response carries the totals in a Server-Timing header, requests
+    # over PROFILE_QUERY_BUDGET queries or PROFILE_LATENCY_BUDGET_MS are
+    # logged, and with PROFILE_ENDPOINT set /_debug/profile/ serves the
+    # recent requests and per-endpoint totals to local clients only.
+    def __init__(self, app: Flask, engine: Engine) -> None:
+        self.app = app
+        self.recent: deque = deque(maxlen=HISTORY)
+        self.endpoints: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        app.jinja_env.template_class = TimedTemplate
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        app.add_url_rule('/_debug/profile/', 'debug_profile', self.serve)
+        event.listen(engine, 'before_cursor_execute', self.before_query)
+        event.listen(engine, 'after_cursor_execute', self.after_query)
+        event.listen(engine, 'handle_error', self.query_failed)
+
+    def start_request(self) -> None:
+        g.profile = RequestProfile()
+
+    def before_query(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    def after_query(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        elapsed = time.perf_counter() - conn.info['query_start'].pop()
+        profile = get_profile()
+        if profile is not None:
+            profile.add_query(statement, elapsed)
+        if elapsed * 1000 > self.app.config.get('PROFILE_SLOW_QUERY_MS', SLOW_QUERY_MS):
+            logger.warning('Slow query (%.1f ms): %s', elapsed * 1000,
+                           ' '.join(statement.split())[:MAX_STATEMENT_LENGTH])
+
+    def query_failed(self, context) -> None:
+        if context.connection is not None and context.connection.info.get('query_start'):
+            context.connection.info['query_start'].pop()
+
+    def finish_request(self, response: Response) -> Response:
+        profile = g.get('profile')
+        if profile is None:
+            return response
+        profile.finish()
+        response.headers['Server-Timing'] = profile.server_timing()
+        entry = dict(profile.to_dict(), method=request.method, path=request.path,
+                     endpoint=request.endpoint, status=response.status_code)
+        self.record(entry)
+        if (profile.queries > self.app.config.get('PROFILE_QUERY_BUDGET', QUERY_BUDGET)
+                or profile.total * 1000 > self.app.config.get('PROFILE_LATENCY_BUDGET_MS', LATENCY_BUDGET_MS)):
+            logger.warning('Over budget: %s %s took %.1f ms with %d queries (%.1f ms in the database, '
+                           '%.1f ms hashing, %.1f ms rendering); slowest query %.1f ms: %s',
+                           request.method, request.path, entry['total_ms'], profile.queries, entry['db_ms'],
+                           entry['bcrypt_ms'], entry['render_ms'], entry['slowest_query_ms'],
+                           profile.slowest_statement)
+        return response
+
+    def record(self, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            self.recent.append(entry)
+            totals = self.endpoints.setdefault(entry['endpoint'] or entry['path'], {
+                'requests': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'queries': 0, 'max_queries': 0})
+            totals['requests'] += 1
+            totals['total_ms'] += entry['total_ms']
+            totals['max_ms'] = max(totals['max_ms'], entry['total_ms'])
+            totals['queries'] += entry['queries']
+            totals['max_queries'] = max(totals['max_queries'], entry['queries'])
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            recent: List[Dict[str, Any]] = list(self.recent)
+            endpoints = {endpoint: dict(totals, mean_ms=round(totals['total_ms'] / totals['requests'], 3),
+                                        mean_queries=round(totals['queries'] / totals['requests'], 2))
+                         for endpoint, totals in self.endpoints.items()}
+        return {'recent': recent, 'endpoints': endpoints}
+
+    def serve(self) -> Response:
+        if not self.app.config.get('PROFILE_ENDPOINT') or request.remote_addr not in LOCAL_ADDRESSES:
+            abort(404)
+        return jsonify(self.summary())
@@ -0,0 +1,91 @@
+import math
+from typing import Dict, List, Mapping, Optional, Sequence
+
+import numpy as np
+
+# Refuse grids bigger than this many cells (products x scales x price scenarios).
+MAX_GRID_CELLS = 2000000
+
+
+class ScenarioGrid:
+    def __init__(self, product_ids: List[int], scales: np.ndarray, ingredient_ids: List[int],
+                 prices: np.ndarray, per_batch: np.ndarray, totals: np.ndarray,
+                 per_unit: np.ndarray, complete: np.ndarray) -> None:
+        self.product_ids = product_ids
+        self.scales = scales
+        # Row k of prices holds the price of each of ingredient_ids in scenario k.
+        self.ingredient_ids = ingredient_ids
+        self.prices = prices
+        self.per_batch = per_batch
+        self.totals = totals
+        self.per_unit = per_unit
+        self.complete = complete
+
+    def product_dict(self, index: int = 0) -> Dict[str, object]:
+        return {'product_id': self.product_ids[index],
+                'scales': self.scales.tolist(),
+                'scenarios': [dict(zip(self.ingredient_ids, row)) for row in self.prices.tolist()],
+                'per_batch': np.round(self.per_batch[index], 4).tolist(),
+                'per_unit': np.round(self.per_unit[index], 4).tolist(),
+                'totals': np.round(self.totals[index], 4).tolist(),
+                'complete': bool(self.complete[index])}
+
+
+class RecipeMatrix:
+    # One row per product and one column per raw ingredient (sub-products
+    # flattened): quantities per batch in the ingredient's unit, and the cost
+    # of that quantity at saved prices (NaN when unpriced, 0 when unused).
+    def __init__(self, product_ids: List[int], yields: Sequence[int], ingredient_ids: List[int],
+                 quantities: np.ndarray, costs: np.ndarray) -> None:
+        self.product_ids = product_ids
+        self.yields = np.asarray(yields, dtype=float)
+        self.ingredient_ids = ingredient_ids
+        self.quantities = quantities
+        self.costs = costs
+        self._columns = {ingredient_id: column for column, ingredient_id in enumerate(ingredient_ids)}
+
+    @classmethod
+    def from_rows(cls, rows: Mapping[int, Mapping[int, Sequence[Optional[float]]]],
+                  yields: Mapping[int, int]) -> 'RecipeMatrix':
+        # rows maps product_id to {ingredient_id: (quantity, cost or None)}.
+        product_ids = list(rows)
+        ingredient_ids = sorted({ingredient_id for row in rows.values() for ingredient_id in row})
+        matrix = cls(product_ids, [yields[product_id] for product_id in product_ids], ingredient_ids,
+                     np.zeros((len(product_ids), len(ingredient_ids))),
+                     np.zeros((len(product_ids), len(ingredient_ids))))
+        for index, product_id in enumerate(product_ids):
+            for ingredient_id, (quantity, cost) in rows[product_id].items():
+                column = matrix._columns[ingredient_id]
+                matrix.quantities[index, column] = quantity
+                matrix.costs[index, column] = np.nan if cost is None else cost
+        return matrix
+
+    def price_grid(self, scales: Sequence[float], prices: Mapping[int, Sequence[float]],
+                   factors: Optional[Mapping[int, float]] = None) -> ScenarioGrid:
+        # Every combination of the given prices is one scenario; factors turn
+        # a price into the price of one ingredient unit (default 1). Costs are
+        # linear in both scale and price, so the whole grid is a single matrix
+        # product plus broadcasting.
+        factors = factors or {}
+        unknown = set(prices) - self._columns.keys()
+        if unknown:
+            raise ValueError(f"Ingredients not in the recipe: {', '.join(map(str, sorted(unknown)))}.")
+        scales = np.asarray(scales, dtype=float)
+        ingredient_ids = list(prices)
+        columns = [self._columns[ingredient_id] for ingredient_id in ingredient_ids]
+        axes = [np.asarray(values, dtype=float) for values in prices.values()]
+        if len(self.product_ids) * len(scales) * math.prod(len(axis) for axis in axes) > MAX_GRID_CELLS:
+            raise ValueError(f'The scenario grid may have at most {MAX_GRID_CELLS} cells.')
+        if axes:
+            grid = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, len(axes))
+        else:
+            grid = np.zeros((1, 0))
+        fixed = np.ones(len(self.ingredient_ids), dtype=bool)
+        fixed[columns] = False
+        fixed_costs = self.costs[:, fixed]
+        weights = self.quantities[:, columns] * np.array([factors.get(ingredient_id, 1)
+                                                          for ingredient_id in ingredient_ids])
+        per_batch = np.nansum(fixed_costs, axis=1)[:, None] + weights @ grid.T
+        totals = per_batch[:, None, :] * scales[None, :, None]
+        return ScenarioGrid(self.product_ids, scales, ingredient_ids, grid, per_batch, totals,
+                            per_batch / self.yields[:, None], ~np.isnan(fixed_costs).any(axis=1))
@@ -0,0 +1,77 @@
+from typing import Any, Dict, Iterator, List, Tuple
+
+MAX_QUERY_LENGTH = 100
+SEARCH_LIMIT = 10
+MAX_SEARCH_LIMIT = 50
+# Trigrams carry no signal below this length, so shorter queries match by prefix only.
+MIN_FUZZY_LENGTH = 3
+
+
+def normalize_query(query: str) -> str:
+    # Names are stored lowercased with single spaces.
+    return ' '.join(query.lower().split())[:MAX_QUERY_LENGTH]
+
+
+def prefix_pattern(prefix: str) -> str:
+    # A LIKE pattern matching strings that start with prefix; use with escape='\\'.
+    escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'{escaped}%'
+
+
+class TrieNode:
+    __slots__ = ('children', 'items')
+
+    def __init__(self) -> None:
+        self.children: Dict[str, 'TrieNode'] = {}
+        self.items: List[Any] = []
+
+
+class PrefixTrie:
+    # Maps words to items. search() walks only the subtree under the prefix,
+    # in word order, and stops as soon as the caller has enough matches.
+    def __init__(self) -> None:
+        self._root = TrieNode()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def insert(self, word: str, item: Any) -> None:
+        node = self._root
+        for char in word:
+            node = node.children.setdefault(char, TrieNode())
+        node.items.append(item)
+        self._size += 1
+
+    def remove(self, word: str, item: Any) -> None:
+        path: List[Tuple[TrieNode, str]] = []
+        node = self._root
+        for char in word:
+            child = node.children.get(char)
+            if child is None:
+                return
+            path.append((node, char))
+            node = child
+        if item not in node.items:
+            return
+        node.items.remove(item)
+        self._size -= 1
+        # Prune branches left without items.
+        for parent, char in reversed(path):
+            child = parent.children[char]
+            if child.items or child.children:
+                break
+            del parent.children[char]
+
+    def search(self, prefix: str) -> Iterator[Tuple[str, Any]]:
+        node = self._root
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return
+        stack = [(prefix, node)]
+        while stack:
+            word, node = stack.pop()
+            for item in node.items:
+                yield word, item
+            stack.extend((word + char, node.children[char]) for char in sorted(node.children, reverse=True))
@@ -0,0 +1,39 @@
+// Fills the <datalist> of every input with a data-autocomplete search URL.
+// Requests wait for a pause in typing and a newer request cancels the last.
+(function () {
+  var DELAY = 150;
+  document.querySelectorAll('input[data-autocomplete]').forEach(function (input) {
+    var list = document.getElementById(input.getAttribute('list'));
+    var timer = null;
+    var controller = null;
+    input.addEventListener('input', function () {
+      clearTimeout(timer);
+      var query = input.value.trim();
+      if (!query) {
+        list.innerHTML = '';
+        return;
+      }
+      timer = setTimeout(function () {
+        if (controller) {
+          controller.abort();
+        }
+        controller = new AbortController();
+        fetch(input.dataset.autocomplete + '&q=' + encodeURIComponent(query),
+              {signal: controller.signal, credentials: 'same-origin'})
+          .then(function (response) { return response.json(); })
+          .then(function (results) {
+            list.innerHTML = '';
+            (results.ingredients || results.products || []).forEach(function (item) {
+              var option = document.createElement('option');
+              option.value = item.name;
+              if (results.ingredients) {
+                option.label = item.name + ' (' + item.unit.trim() + ')';
+              }
+              list.appendChild(option);
+            });
+          })
+          .catch(function () {});
+      }, DELAY);
+    });
+  });
+})();
@@ -0,0 +1,57 @@
+import logging
+import queue
+import threading
+from typing import Callable, Iterable, Optional, Set
+
+from flask import Flask
+
+logger = logging.getLogger(__name__)
+
+
+class RecomputeQueue:
+    # Ids are coalesced while the worker is busy, so a burst of changes to
+    # the same products triggers a single recomputation.
+    def __init__(self, app: Flask, handler: Callable[[Set[int]], None]) -> None:
+        self.app = app
+        self.handler = handler
+        self._queue: 'queue.Queue[Set[int]]' = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def enqueue(self, ids: Iterable[int]) -> None:
+        ids = set(ids)
+        if not ids:
+            return
+        if self.app.config.get('COST_RECOMPUTE_SYNC'):
+            self.handler(ids)
+            return
+        self._ensure_worker()
+        self._queue.put(ids)
+
+    def join(self) -> None:
+        self._queue.join()
+
+    def _ensure_worker(self) -> None:
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='cost-recompute', daemon=True)
+                self._worker.start()
+
+    def _run(self) -> None:
+        while True:
+            ids = self._queue.get()
+            batches = 1
+            while True:
+                try:
+                    ids |= self._queue.get_nowait()
+                    batches += 1
+                except queue.Empty:
+                    break
+            try:
+                with self.app.app_context():
+                    self.handler(ids)
+            except Exception:
+                logger.exception('Recomputing %d products failed', len(ids))
+            finally:
+                for _ in range(batches):
+                    self._queue.task_done()
@@ -0,0 +1,147 @@
+import time
+from types import MappingProxyType
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+from sqlalchemy import event
+
+from recipe_hub.mappings import Unit
+
+MASS = 'mass'
+VOLUME = 'volume'
+COUNT = 'count'
+# A lookup miss reloads the units table, in case another process added the
+# unit, at most this often.
+MISS_RELOAD_INTERVAL = 60
+
+
+class UnitInfo(NamedTuple):
+    unit_id: int
+    dimension: Optional[str]
+    factor: float
+
+
+class ConversionTable:
+    # factors[(a, b)] converts an amount in unit a to unit b; only units of
+    # the same dimension are directly convertible, mass and volume are
+    # bridged through an ingredient's density (grams per milliliter).
+    def __init__(self, units: Iterable[UnitInfo]) -> None:
+        self.units = {unit.unit_id: unit for unit in units}
+        self.factors: Dict[Tuple[int, int], float] = {
+            (source.unit_id, target.unit_id): source.factor / target.factor
+            for source in self.units.values() for target in self.units.values()
+            if source.dimension is not None and source.dimension == target.dimension}
+        self.base_units = {unit.dimension: unit.unit_id
+                           for unit in sorted(self.units.values(), key=lambda unit: -unit.unit_id)
+                           if unit.dimension is not None and unit.factor == 1}
+
+    def factor(self, source_id: int, target_id: int,
+               density: Optional[float] = None) -> Optional[float]:
+        if source_id == target_id:
+            return 1.0
+        factor = self.factors.get((source_id, target_id))
+        if factor is not None or not density:
+            return factor
+        source, target = self.units.get(source_id), self.units.get(target_id)
+        if source is None or target is None:
+            return None
+        if source.dimension == MASS and target.dimension == VOLUME:
+            return source.factor / density / target.factor
+        if source.dimension == VOLUME and target.dimension == MASS:
+            return source.factor * density / target.factor
+        return None
+
+    def convert(self, amount: float, source_id: int, target_id: int,
+                density: Optional[float] = None) -> Optional[float]:
+        factor = self.factor(source_id, target_id, density)
+        if factor is None:
+            return None
+        return amount * factor
+
+    def base_unit(self, unit_id: int) -> int:
+        unit = self.units.get(unit_id)
+        if unit is None:
+            return unit_id
+        return self.base_units.get(unit.dimension, unit_id)
+
+
+class UnitRecord(NamedTuple):
+    unit_id: int
+    name: str
+    symbol: Optional[str]
+    dimension: Optional[str]
+    factor: float
+
+
+class UnitRegistry:
+    # An immutable snapshot of the units table, keyed by id, name and symbol.
+    def __init__(self, units: Iterable[UnitRecord]) -> None:
+        self.units = tuple(sorted(units))
+        self.by_id = MappingProxyType({unit.unit_id: unit for unit in self.units})
+        lookup = {unit.name: unit for unit in self.units}
+        lookup.update({unit.symbol: unit for unit in self.units if unit.symbol})
+        self.by_name = MappingProxyType(lookup)
+        self.choices = tuple((unit.unit_id, unit.symbol or unit.name) for unit in self.units)
+        self.conversions = ConversionTable(UnitInfo(unit.unit_id, unit.dimension, unit.factor)
+                                           for unit in self.units)
+
+    def get(self, unit_id: int) -> Optional[UnitRecord]:
+        return self.by_id.get(unit_id)
+
+    def find(self, name_or_symbol: str) -> Optional[UnitRecord]:
+        return self.by_name.get(name_or_symbol.lower())
+
+
+_registry: Optional[UnitRegistry] = None
+_loaded_at = 0.0
+
+
+def load_unit_registry() -> UnitRegistry:
+    global _registry, _loaded_at
+    _registry = UnitRegistry(UnitRecord(unit.unit_id, unit.name, unit.symbol,
+                                        unit.dimension, unit.factor)
+                             for unit in Unit.query.all())
+    _loaded_at = time.monotonic()
+    return _registry
+
+
+def get_unit_registry() -> UnitRegistry:
+    if _registry is None:
+        return load_unit_registry()
+    return _registry
+
+
+def reload_after_miss() -> Optional[UnitRegistry]:
+    # An unknown unit repeated on every line of an import must not query the
+    # table each time; writes in this process invalidate the registry anyway.
+    if time.monotonic() - _loaded_at < MISS_RELOAD_INTERVAL:
+        return None
+    return load_unit_registry()
+
+
+def get_unit(unit_id: int) -> Optional[UnitRecord]:
+    unit = get_unit_registry().get(unit_id)
+    if unit is None:
+        registry = reload_after_miss()
+        unit = registry and registry.get(unit_id)
+    return unit
+
+
+def find_unit(name_or_symbol: str) -> Optional[UnitRecord]:
+    unit = get_unit_registry().find(name_or_symbol)
+    if unit is None:
+        registry = reload_after_miss()
+        unit = registry and registry.find(name_or_symbol)
+    return unit
+
+
+def get_conversion_table() -> ConversionTable:
+    return get_unit_registry().conversions
+
+
+def invalidate_unit_registry(*args) -> None:
+    global _registry
+    _registry = None
+
+
+for _event in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Unit, _event, invalidate_unit_registry)
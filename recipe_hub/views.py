@@ -1,24 +1,111 @@
-from typing import Union
+import io
+from random import random
+from typing import Any, Dict, List, Optional, Tuple, Union
 
-from flask import flash, redirect, render_template, url_for
+from flask import (abort, flash, jsonify, redirect, render_template, request, session,
+                   stream_with_context, url_for)
 from flask_login import current_user, login_user, logout_user
 from flask_login.utils import login_required
 from werkzeug.wrappers import Response
 
 from recipe_hub import app, db_funcs
-from recipe_hub.forms import (BirthdayForm, EmailForm, LoginForm, NameForm,
-                              PasswordForm, ProductForm, RecipeForm,
-                              RegisterForm, UsernameForm)
+from recipe_hub.cache import make_key, make_render_cache
+from recipe_hub.cost_graph import RecipeCycleError
+from recipe_hub.exporter import MIMETYPES, WRITERS
+from recipe_hub.importer import RecipeImporter, detect_format, read_rows
+from recipe_hub.passwords import HasherBusyError
+from recipe_hub.forms import (BirthdayForm, BulkRecipeForm, EmailForm, ImportForm, LoginForm, NameForm,
+                              PasswordForm, PriceForm, ProductForm, RecipeForm,
+                              RegisterForm, SubRecipeForm, UsernameForm)
+
+
+PAGE_SIZE = 48
+MAX_PAGE_SIZE = 200
+# Flashed messages live in the session cookie, which browsers cap at ~4 KB.
+FLASHED_IMPORT_ERRORS = 5
+
+render_cache = make_render_cache(app.config)
 
 
 def flash_wrong_password():
     flash('Wrong password. Please try again.', 'danger')
 
 
+@app.errorhandler(HasherBusyError)
+def hasher_busy(error: HasherBusyError) -> Tuple[str, int, Dict[str, str]]:
+    return 'The server is busy. Please try again in a moment.', 503, {'Retry-After': '1'}
+
+
+def get_page_args() -> Tuple[Optional[int], int]:
+    after = request.args.get('after', type=int)
+    limit = request.args.get('limit', PAGE_SIZE, type=int)
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        limit = PAGE_SIZE
+    return after, limit
+
+
+def paginate(products: List[Dict[str, Union[int, str]]],
+             limit: int) -> Tuple[List[Dict[str, Union[int, str]]], Optional[str]]:
+    if len(products) <= limit:
+        return products, None
+    products = products[:limit]
+    # Keep filters such as q and fields on the next page.
+    args = {key: value for key, value in request.args.items() if key not in ('after', 'limit')}
+    next_url = url_for(request.endpoint, **request.view_args, **args,
+                       after=products[-1]['product_id'], limit=limit)
+    return products, next_url
+
+
+def get_price_choices(recipe: List[Dict[str, Union[int, str]]]) -> List[Tuple[int, str]]:
+    return [(line['ingredient_id'], f"{line['ingredient'].title()} ({line['unit'].strip()})")
+            for line in recipe]
+
+
+def render_product_fragments(product_id: int, is_owner: bool) -> Dict[str, Any]:
+    # Everything on the product page that depends only on the product version
+    # and the viewer's role; forms and flashed messages are rendered per request.
+    product = db_funcs.get_product(product_id)
+    recipe = db_funcs.get_recipe(product_id)
+    fragments = {'card': render_template('product_card.j2', product=product),
+                 'rows': render_template('product_recipe_rows.j2', product=product,
+                                         recipes=recipe, is_owner=is_owner),
+                 'cost': '',
+                 'price_choices': []}
+    if is_owner:
+        fragments['cost'] = render_template('product_cost.j2', product=product,
+                                            cost=db_funcs.compute_product_cost(product_id))
+        fragments['price_choices'] = get_price_choices(recipe)
+    return fragments
+
+
+def get_owned_product(product_id: int) -> Dict[str, Union[bool, int, str]]:
+    # Aborts unless the product exists and belongs to the logged-in user.
+    try:
+        product = db_funcs.get_product(product_id)
+    except AttributeError:
+        abort(404)
+    if product['user_id'] != current_user.user_id:
+        abort(403)
+    return product
+
+
+def get_sub_product_choices(product_id: int) -> List[Tuple[int, str]]:
+    return [(product['product_id'], product['name'].title())
+            for product in db_funcs.get_all_products(current_user.user_id)
+            if product['product_id'] != product_id]
+
+
 @app.route('/')
 def home() -> str:
-    products = db_funcs.get_all_public_products()
-    return render_template('home.j2', products=products)
+    after, limit = get_page_args()
+    seed = session.setdefault('feed_seed', random())
+    products = db_funcs.get_random_public_products(seed, after=after, limit=limit + 1)
+    products, next_url = paginate(products, limit)
+    tiles = [render_cache.get_or_set(make_key('tile', product['product_id'], product['random_key'],
+                                              product['version']),
+                                     lambda product=product: render_template('product_tile.j2', product=product))
+             for product in products]
+    return render_template('home.j2', tiles=tiles, next_url=next_url)
 
 
 # Product
@@ -37,51 +124,177 @@ def add_product() -> Union[Response, str]:
 
 @app.route('/product/<int:product_id>/', methods=['GET', 'POST'])
 def view_product(product_id: int) -> Union[Response, str]:
-    try:
-        product = db_funcs.get_product(product_id)
-    except AttributeError:
+    state = db_funcs.get_product_version(product_id)
+    if state is None:
+        return redirect(url_for('home'))
+    is_owner = current_user.is_authenticated and state.user_id == current_user.user_id
+    if not (state.public or is_owner):
         return redirect(url_for('home'))
     form = RecipeForm(product_id=product_id)
-    if form.validate_on_submit():
+    if is_owner and form.validate_on_submit():
         db_funcs.add_recipe(product_id=product_id,
                             ingredient=form.ingredient.data,
                             amount=form.amount.data,
                             unit_id=form.unit.data)
-    recipe = db_funcs.get_recipe(product_id)
-    try:
-        if product['public'] or product['user_id'] == current_user.user_id:
-            return render_template('view_product.j2', product=product, recipes=recipe, form=form)
-        return redirect(url_for('home'))
-    except AttributeError:
+        state = db_funcs.get_product_version(product_id)
+    fragments = render_cache.get_or_set(
+        make_key('product', product_id, state.random_key, state.version, 'owner' if is_owner else 'viewer'),
+        lambda: render_product_fragments(product_id, is_owner))
+    price_form = sub_form = bulk_form = None
+    if is_owner:
+        price_form = PriceForm(formdata=None)
+        price_form.ingredient_id.choices = fragments['price_choices']
+        sub_form = SubRecipeForm(formdata=None, product_id=product_id)
+        sub_form.sub_product.choices = get_sub_product_choices(product_id)
+        bulk_form = BulkRecipeForm(formdata=None)
+    return render_template('view_product.j2', product=state._asdict(), fragments=fragments,
+                           is_owner=is_owner, form=form, price_form=price_form,
+                           sub_form=sub_form, bulk_form=bulk_form)
+
+
+@app.route('/ingredient/<int:ingredient_id>/usage/')
+def ingredient_usage(ingredient_id: int) -> Union[Response, str]:
+    usage = db_funcs.get_ingredient_usage(ingredient_id)
+    if usage is None:
         return redirect(url_for('home'))
+    after, limit = get_page_args()
+    user_id = current_user.user_id if current_user.is_authenticated else None
+    products = db_funcs.get_ingredient_products(ingredient_id, user_id, after=after, limit=limit + 1)
+    products, next_url = paginate(products, limit)
+    return render_template('ingredient_usage.j2', usage=usage, products=products, next_url=next_url)
+
+
+@app.route('/product/<int:product_id>/recipe/bulk/', methods=['POST'])
+@login_required
+def add_recipes(product_id: int) -> Response:
+    # Accepts {"lines": [{"ingredient", "amount", "unit"}, ...]} as JSON, or
+    # the textarea form on the product page.
+    get_owned_product(product_id)
+    if request.is_json:
+        lines = (request.get_json(silent=True) or {}).get('lines')
+        if not isinstance(lines, list):
+            return jsonify(errors=[{'line': 0, 'error': 'Expected a list of lines.'}]), 400
+        try:
+            ingredient_ids = db_funcs.add_recipes(product_id, lines)
+        except db_funcs.RecipeLinesError as error:
+            return jsonify(errors=error.errors), 400
+        return jsonify(ingredient_ids=ingredient_ids), 201
+    form = BulkRecipeForm()
+    if form.validate_on_submit():
+        try:
+            ingredient_ids = db_funcs.add_recipes(product_id, form.parse_lines())
+            flash(f'Added {len(ingredient_ids)} ingredients.', 'success')
+        except db_funcs.RecipeLinesError as error:
+            for line_error in error.errors:
+                flash(f"Line {line_error['line']}: {line_error['error']}", 'danger')
+    return redirect(url_for('view_product', product_id=product_id))
+
+
+@app.route('/product/<int:product_id>/sub/', methods=['POST'])
+@login_required
+def add_sub_recipe(product_id: int) -> Response:
+    get_owned_product(product_id)
+    form = SubRecipeForm(product_id)
+    form.sub_product.choices = get_sub_product_choices(product_id)
+    if form.validate_on_submit():
+        try:
+            db_funcs.add_sub_recipe(product_id=product_id,
+                                    sub_product_id=form.sub_product.data,
+                                    amount=form.amount.data)
+            return redirect(url_for('view_product', product_id=product_id))
+        except RecipeCycleError:
+            # Another request added the reverse link after validation.
+            form.sub_product.errors.append(form.CYCLE_ERROR)
+    for errors in form.errors.values():
+        for error in errors:
+            flash(error, 'danger')
+    return redirect(url_for('view_product', product_id=product_id))
+
+
+@app.route('/product/<int:product_id>/price/', methods=['POST'])
+@login_required
+def set_price(product_id: int) -> Response:
+    get_owned_product(product_id)
+    form = PriceForm()
+    form.ingredient_id.choices = get_price_choices(db_funcs.get_recipe(product_id))
+    if form.validate_on_submit():
+        db_funcs.set_ingredient_price(ingredient_id=form.ingredient_id.data,
+                                      price=form.price.data,
+                                      package_amount=form.package_amount.data,
+                                      unit_id=form.unit.data,
+                                      density=form.density.data)
+        flash('Price saved.', 'success')
+    else:
+        for errors in form.errors.values():
+            for error in errors:
+                flash(error, 'danger')
+    return redirect(url_for('view_product', product_id=product_id))
 
 
 @app.route('/products/')
 @login_required
 def products() -> str:
-    products = db_funcs.get_all_products(current_user.user_id)
+    after, limit = get_page_args()
+    query = request.args.get('q', '').strip()
+    products = db_funcs.get_all_products(current_user.user_id,
+                                         after=after, limit=limit + 1, prefix=query)
+    products, next_url = paginate(products, limit)
     username = current_user.username
-    return render_template('products.j2', username=username, products=products)
+    return render_template('products.j2', username=username, products=products,
+                           next_url=next_url, query=query)
+
+
+@app.route('/products/import/', methods=['GET', 'POST'])
+@login_required
+def import_products() -> Union[Response, str]:
+    form = ImportForm()
+    if form.validate_on_submit():
+        upload = form.file.data
+        stream = io.TextIOWrapper(upload.stream, encoding='utf-8', newline='')
+        stats = RecipeImporter(current_user.user_id).run(read_rows(stream, detect_format(upload.filename)))
+        for error in stats.errors[:FLASHED_IMPORT_ERRORS]:
+            flash(f"Line {error['line']}: {error['error']}", 'danger')
+        if stats.error_count > FLASHED_IMPORT_ERRORS:
+            flash(f'{stats.error_count - FLASHED_IMPORT_ERRORS} more lines could not be imported.', 'danger')
+        flash(f'Imported {stats.products} products and {stats.lines} recipe lines.', 'success')
+        return redirect(url_for('products'))
+    return render_template('import_products.j2', form=form)
+
+
+@app.route('/products/export.<any(csv, jsonl):fmt>')
+@login_required
+def export_products(fmt: str) -> Response:
+    rows = db_funcs.iter_product_lines(current_user.user_id)
+    response = Response(stream_with_context(WRITERS[fmt](rows)), mimetype=MIMETYPES[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename=products.{fmt}'
+    return response
 
 
 @app.route('/product/<int:product_id>/share/')
 @login_required
 def share(product_id: int) -> Response:
-    db_funcs.share_product(product_id)
+    if not db_funcs.share_product(product_id, current_user.user_id):
+        abort(403)
     return redirect(url_for('view_product', product_id=product_id))
 
 
 @app.route('/product/<int:product_id>/delete/<int:ingredient_id>/')
 @login_required
 def delete_recipe(product_id: int, ingredient_id: int) -> Response:
-    db_funcs.delete_recipe(product_id, ingredient_id)
+    db_funcs.delete_recipe(product_id, ingredient_id, current_user.user_id)
     return redirect(url_for('view_product', product_id=product_id))
 
 
 @app.route('/product/<int:product_id>/delete/all/')
 @login_required
 def delete_product(product_id: int) -> Response:
-    db_funcs.delete_product(product_id)
+    state = db_funcs.get_product_version(product_id)
+    if db_funcs.delete_product(product_id, current_user.user_id):
+        # A reused id draws a new random_key and so never reaches these
+        # entries; drop them now instead of waiting for the TTL.
+        render_cache.delete(make_key('tile', product_id, state.random_key, state.version))
+        for role in ('owner', 'viewer'):
+            render_cache.delete(make_key('product', product_id, state.random_key, state.version, role))
     return redirect(url_for('products'))
 
 
@@ -104,7 +317,7 @@ def login() -> Union[Response, str]:
     if form.validate_on_submit():
         email = form.email.data
         if db_funcs.validate_password(email, form.password.data):
-            login_user(db_funcs.get_user_by_email(email), remember=form.remember.data)
+            login_user(db_funcs.get_credential_context().user(email), remember=form.remember.data)
             flash('You have been logged in.', 'success')
             return redirect(url_for('home'))
         flash('Login failed. Please try again.', 'danger')
@@ -123,8 +336,12 @@ def profile(user_id: int) -> Union[Response, str]:
     user = db_funcs.get_user(user_id)
     if user is None:
         return redirect(url_for('home'))
-    products = db_funcs.get_all_products(user_id, public_only=True)
-    return render_template('profile.j2', user=user, products=products)
+    after, limit = get_page_args()
+    products = db_funcs.get_all_products(user_id, public_only=True,
+                                         after=after, limit=limit + 1)
+    products, next_url = paginate(products, limit)
+    return render_template('profile.j2', user=user, products=products,
+                           next_url=next_url)
 
 
 @app.route('/profile/username/', methods=['GET', 'POST'])
@@ -1,17 +1,27 @@
 import datetime
 import os
 import tempfile
+from contextlib import contextmanager
 
 import bcrypt
 import pytest
+from sqlalchemy import event
 
 from recipe_hub import app, db
 from recipe_hub.mappings import Ingredient, Product, Unit, User
 
+app.config['COST_RECOMPUTE_SYNC'] = True
+
 HTTP_CODES = {
     'ok': 200,
     'found': 302,
+    'not_modified': 304,
+    'created': 201,
+    'bad_request': 400,
     'unauthorized': 401,
+    'forbidden': 403,
+    'not_found': 404,
+    'service_unavailable': 503,
 }
 
 ROUTES = {
@@ -20,8 +30,15 @@ ROUTES = {
     'register': '/register/',
     'products': '/products/',
     'view_product': '/product/',
+    'ingredient_usage': '/ingredient/',
     'new_product': '/product/add/',
     'share': '/share/',
+    'price': '/price/',
+    'sub_recipe': '/sub/',
+    'bulk_recipe': '/recipe/bulk/',
+    'import': '/products/import/',
+    'export': '/products/export.',
+    'api': '/api/v1/',
     'delete_ingredient': '/delete/',
     'delete_product': '/delete/all/',
     'edit_username': '/profile/username/',
@@ -45,6 +62,9 @@ MESSAGES = {
     'login_successfull': b'You have been logged in.',
     'existing_product': b'A product with the chosen name already exists on your profile. Please choose a different name.',
     'existing_ingredient': b'The given ingredient is already found in the recipe.',
+    'price_success': b'Price saved.',
+    'import_success': b'Imported 1 products and 1 recipe lines.',
+    'recipe_cycle': b'The chosen product already uses this product.',
     'edit': b'Change',
     'wrong_password': b'Wrong password. Please try again.',
     'username_success': b'Username changed to ',
@@ -81,6 +101,20 @@ def logout(client):
     client.get(ROUTES['login'])
 
 
+@contextmanager
+def count_queries():
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+
 def get_unit_name(unit_id):
     unit = Unit.query.get(unit_id)
     if unit.symbol:
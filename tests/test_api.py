@@ -0,0 +1,140 @@
+import pytest
+
+from recipe_hub import app, db, db_funcs
+from recipe_hub.mappings import Ingredient, Product
+from recipe_hub.pool import MeteredQueuePool
+from tests import conftest
+
+
+def test_api_product_etag(client, user, product, ingredient):
+    product_id = product.product_id
+    details = {'name': product.name, 'unit': 'g', 'version': product.version}
+    ingredient_id, ingredient_name, unit_id = ingredient.ingredient_id, ingredient.name, ingredient.unit_id
+    route = f"{conftest.ROUTES['api']}products/{product_id}/"
+    conftest.login(client, user)
+    response = client.get(f'{route}?fields=name,unit,version')
+    assert response.status_code == conftest.HTTP_CODES['ok']
+    assert response.get_json() == details
+    etag = response.headers['ETag']
+    with conftest.count_queries() as statements:
+        response = client.get(f'{route}?fields=name,unit,version', headers={'If-None-Match': etag})
+    assert response.status_code == conftest.HTTP_CODES['not_modified']
+    assert len([statement for statement in statements if 'FROM products' in statement]) == 1
+    db_funcs.add_recipe(product_id, ingredient_name, 500, unit_id)
+    response = client.get(f'{route}?fields=name,unit,version', headers={'If-None-Match': etag})
+    assert response.status_code == conftest.HTTP_CODES['ok']
+    recipe = client.get(f'{route}recipe/?fields=ingredient,amount').get_json()
+    assert recipe == {'data': [{'ingredient': ingredient_name, 'amount': 500}]}
+    assert client.get(f'{route}cost/').get_json()['complete'] is False
+    db_funcs.delete_recipe(product_id, ingredient_id)
+    conftest.logout(client)
+
+
+def test_api_visibility_and_errors(client, user, product):
+    product_id = product.product_id
+    route = f"{conftest.ROUTES['api']}products/{product_id}/"
+    public = product.public
+    product.public = False
+    db.session.commit()
+    assert client.get(route).status_code == conftest.HTTP_CODES['not_found']
+    assert client.get(f'{route}cost/').status_code == conftest.HTTP_CODES['unauthorized']
+    conftest.login(client, user)
+    response = client.get(f'{route}?fields=name,password_hash')
+    assert response.status_code == conftest.HTTP_CODES['bad_request']
+    assert 'password_hash' in response.get_json()['error']
+    conftest.logout(client)
+    product.public = public
+    db.session.commit()
+
+
+def test_api_scenarios(client, user, product, ingredient):
+    product_id, ingredient_id = product.product_id, ingredient.ingredient_id
+    route = f"{conftest.ROUTES['api']}products/{product_id}/scenarios/"
+    body = {'scales': [1, 10], 'prices': [{'ingredient_id': ingredient_id, 'prices': ['8.00', 16],
+                                           'package_amount': 2, 'unit': 'kg'}]}
+    assert client.post(route, json=body).status_code == conftest.HTTP_CODES['unauthorized']
+    db_funcs.add_recipe(product_id, ingredient.name, 250, ingredient.unit_id)
+    conftest.login(client, user)
+    grid = client.post(route, json=body).get_json()
+    assert grid['per_batch'] == [1.0, 2.0]
+    assert grid['totals'] == [[1.0, 2.0], [10.0, 20.0]]
+    assert grid['scenarios'] == [{str(ingredient_id): 8.0}, {str(ingredient_id): 16.0}]
+    assert grid['complete'] is True
+    assert client.post(route, json={'scales': [1]}).get_json()['complete'] is False
+    for invalid in ({'scales': [0]}, {'scales': 'big'},
+                    {'prices': [{'ingredient_id': ingredient_id, 'prices': [1]}]},
+                    {'prices': [{'ingredient_id': 0, 'prices': [1], 'package_amount': 1}]}):
+        response = client.post(route, json=invalid)
+        assert response.status_code == conftest.HTTP_CODES['bad_request']
+        assert response.get_json()['error']
+    db_funcs.delete_recipe(product_id, ingredient_id)
+    conftest.logout(client)
+
+
+def test_api_products_pagination(client, user):
+    products = [Product(name=f'api product {i}', amount=1, unit_id=1,
+                        user_id=user.user_id, public=True) for i in range(3)]
+    db.session.add_all(products)
+    db.session.commit()
+    product_ids = sorted((product.product_id for product in products), reverse=True)
+    page = client.get(f"{conftest.ROUTES['api']}products/?limit=2&fields=product_id").get_json()
+    assert [item['product_id'] for item in page['data']] == product_ids[:2]
+    page = client.get(page['next'] + '&fields=product_id').get_json()
+    assert page['data'][0]['product_id'] == product_ids[2]
+    for product in products:
+        db.session.delete(product)
+    db.session.commit()
+
+
+def test_api_units(client):
+    response = client.get(f"{conftest.ROUTES['api']}units/?fields=name,symbol")
+    assert {'name': 'grams', 'symbol': 'g'} in response.get_json()['data']
+    assert (client.get(f"{conftest.ROUTES['api']}units/?fields=name,symbol",
+                       headers={'If-None-Match': response.headers['ETag']}).status_code
+            == conftest.HTTP_CODES['not_modified'])
+
+
+def test_api_stats_are_gated(client, user):
+    route = f"{conftest.ROUTES['api']}cache/"
+    assert client.get(route).status_code == conftest.HTTP_CODES['unauthorized']
+    conftest.login(client, user)
+    assert client.get(route).status_code == conftest.HTTP_CODES['not_found']
+    app.config['STATS_ENDPOINTS'] = True
+    stats = client.get(route).get_json()
+    app.config['STATS_ENDPOINTS'] = False
+    assert stats.keys() == {'hits', 'misses', 'evictions'}
+    client.get(conftest.ROUTES['logout'])
+
+
+@pytest.mark.skipif(not isinstance(db.engine.pool, MeteredQueuePool), reason='pool metrics need a server database')
+def test_api_pool_stats(client, user):
+    conftest.login(client, user)
+    app.config['STATS_ENDPOINTS'] = True
+    stats = client.get(f"{conftest.ROUTES['api']}pool/").get_json()
+    app.config['STATS_ENDPOINTS'] = False
+    client.get(conftest.ROUTES['logout'])
+    assert stats['checkouts'] > 0
+    assert stats['size'] == db.engine.pool.size()
+    assert {'checked_out', 'overflow', 'wait_avg_ms', 'wait_max_ms', 'timeouts'} <= stats.keys()
+
+
+def test_api_search(client, user, product):
+    db_funcs.add_ingredients([('api search flour', 1)])
+    db.session.commit()
+    route = f"{conftest.ROUTES['api']}search/"
+    response = client.get(f'{route}?q=API+Search&type=ingredients')
+    assert [item['name'] for item in response.get_json()['ingredients']] == ['api search flour']
+    assert 'products' not in response.get_json()
+    assert 'max-age' in response.headers['Cache-Control']
+    product_id, name = product.product_id, product.name
+    private = not product.public
+    conftest.login(client, user)
+    results = client.get(f'{route}?q={name}&fields=product_id').get_json()
+    assert {'product_id': product_id} in results['products']
+    client.get(conftest.ROUTES['logout'])
+    results = client.get(f'{route}?q={name}&fields=product_id').get_json()
+    assert ({'product_id': product_id} in results['products']) != private
+    assert client.get(f'{route}?q=x&type=users').status_code == conftest.HTTP_CODES['bad_request']
+    assert client.get(f'{route}?q=x&limit=0').status_code == conftest.HTTP_CODES['bad_request']
+    assert client.get(f'{route}?q=').get_json() == {'ingredients': [], 'products': []}
+    conftest.delete(Ingredient.query.filter(Ingredient.name == 'api search flour').first())
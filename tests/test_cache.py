@@ -0,0 +1,67 @@
+from recipe_hub.cache import (USER_CACHE_SIZE, DictStore, LocalCache, StoreCache, cache_config, make_key,
+                              make_render_cache)
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_make_key():
+    assert make_key('product', 1, 2, 'owner') == 'product:1:2:owner'
+
+
+def test_local_cache_hits_and_misses():
+    cache = LocalCache()
+    assert cache.get_or_set('a', lambda: 'first') == 'first'
+    assert cache.get_or_set('a', lambda: 'second') == 'first'
+    assert cache.stats.to_dict() == {'hits': 1, 'misses': 1, 'evictions': 0}
+
+
+def test_local_cache_evicts_least_recently_used():
+    cache = LocalCache(max_entries=2)
+    cache.get_or_set('a', lambda: 1)
+    cache.get_or_set('b', lambda: 2)
+    cache.get_or_set('a', lambda: 1)
+    cache.get_or_set('c', lambda: 3)
+    assert len(cache) == 2
+    assert cache.get_or_set('a', lambda: None) == 1
+    assert cache.get_or_set('b', lambda: 'rebuilt') == 'rebuilt'
+    assert cache.stats.evictions == 2
+
+
+def test_local_cache_expires():
+    clock = Clock()
+    cache = LocalCache(ttl=10, clock=clock)
+    cache.get_or_set('a', lambda: 'old')
+    clock.now = 11
+    assert cache.get_or_set('a', lambda: 'new') == 'new'
+    assert cache.stats.misses == 2
+
+
+def test_store_cache_round_trips_through_the_store():
+    clock = Clock()
+    store = DictStore(clock=clock)
+    cache = StoreCache(store, ttl=10)
+    fragments = {'card': '<a></a>', 'price_choices': [[1, 'Flour (g)']]}
+    assert cache.get_or_set('product:1:1:owner', lambda: fragments) == fragments
+    other_worker = StoreCache(store, ttl=10)
+    assert other_worker.get_or_set('product:1:1:owner', lambda: None) == fragments
+    assert other_worker.stats.hits == 1
+    clock.now = 11
+    assert other_worker.get_or_set('product:1:1:owner', lambda: 'rebuilt') == 'rebuilt'
+
+
+def test_cache_config_from_environment():
+    assert cache_config({})['USER_CACHE_SIZE'] == USER_CACHE_SIZE
+    config = cache_config({'USER_CACHE_SIZE': '10', 'USER_CACHE_TTL': '5'})
+    assert (config['USER_CACHE_SIZE'], config['USER_CACHE_TTL']) == (10, 5)
+
+
+def test_render_cache_config_from_environment():
+    cache = make_render_cache(cache_config({'RENDER_CACHE_SIZE': '3', 'RENDER_CACHE_TTL': '7'}))
+    assert isinstance(cache, LocalCache)
+    assert (cache.max_entries, cache.ttl) == (3, 7)
@@ -0,0 +1,167 @@
+from decimal import Decimal
+
+from recipe_hub import app, db, db_funcs
+from recipe_hub.mappings import Ingredient, IngredientPrice, Product, Recipe
+from tests import conftest
+
+
+def test_set_ingredient_price(user, ingredient):
+    key = (user.user_id, ingredient.ingredient_id)
+    assert IngredientPrice.query.get(key) is None
+    db_funcs.set_ingredient_price(ingredient.ingredient_id, Decimal('2.50'), 1000,
+                                  user_id=user.user_id)
+    assert IngredientPrice.query.get(key).price == Decimal('2.50')
+    db_funcs.set_ingredient_price(ingredient.ingredient_id, Decimal('3.00'), 500,
+                                  user_id=user.user_id)
+    ingredient_price = IngredientPrice.query.get(key)
+    assert ingredient_price.price == Decimal('3.00')
+    assert ingredient_price.package_amount == 500
+    conftest.delete(ingredient_price)
+
+
+def test_compute_product_cost(user, product, ingredient):
+    product_id = product.product_id
+    unpriced = Ingredient(name='unpriced ingredient', unit_id=1)
+    db.session.add(unpriced)
+    db.session.commit()
+    recipes = [Recipe(product_id=product_id, ingredient_id=ingredient.ingredient_id, amount=250),
+               Recipe(product_id=product_id, ingredient_id=unpriced.ingredient_id, amount=10)]
+    db.session.add_all(recipes)
+    db.session.commit()
+    db_funcs.set_ingredient_price(ingredient.ingredient_id, Decimal('4.00'), 1000,
+                                  user_id=user.user_id)
+    with conftest.count_queries() as statements:
+        cost = db_funcs.compute_product_cost(product_id)
+    assert len(statements) == 1
+    assert cost['total'] == Decimal('1.00')
+    assert cost['per_unit'] == Decimal('1.00') / product.amount
+    assert not cost['complete']
+    lines = {line['ingredient_id']: line['cost'] for line in cost['lines']}
+    assert lines[ingredient.ingredient_id] == Decimal('1.00')
+    assert lines[unpriced.ingredient_id] is None
+    for recipe in recipes:
+        db.session.delete(recipe)
+    db.session.delete(IngredientPrice.query.get((user.user_id, ingredient.ingredient_id)))
+    db.session.delete(unpriced)
+    db.session.commit()
+
+
+def test_compute_product_cost_without_recipe(product):
+    cost = db_funcs.compute_product_cost(product.product_id)
+    assert cost == {'total': Decimal(0), 'per_unit': Decimal(0), 'lines': [],
+                    'complete': True}
+
+
+def test_ingredient_price_change_refreshes_dependent_costs(user, product, ingredient):
+    product_id = product.product_id
+    dough = Product(name='stored cost dough', amount=100, unit_id=1,
+                    user_id=user.user_id, public=False)
+    db.session.add(dough)
+    db.session.commit()
+    dough_id = dough.product_id
+    db_funcs.add_recipe(dough_id, ingredient.name, 100, ingredient.unit_id)
+    db_funcs.add_sub_recipe(product_id, dough_id, 50)
+    db_funcs.set_ingredient_price(ingredient.ingredient_id, Decimal('2.00'), 100,
+                                  user_id=user.user_id)
+    assert Product.query.get(dough_id).cost == Decimal('2.00')
+    assert Product.query.get(product_id).cost == Decimal('1.00')
+    assert not Product.query.get(product_id).cost_stale
+    db_funcs.set_ingredient_price(ingredient.ingredient_id, Decimal('4.00'), 100,
+                                  user_id=user.user_id)
+    assert Product.query.get(product_id).cost == Decimal('2.00')
+    for recipe in Recipe.query.filter(Recipe.product_id.in_([product_id, dough_id])):
+        db.session.delete(recipe)
+    db.session.delete(IngredientPrice.query.get((user.user_id, ingredient.ingredient_id)))
+    db.session.delete(Ingredient.query.filter(Ingredient.product_id == dough_id).first())
+    db.session.commit()
+    conftest.delete(dough)
+    db_funcs.refresh_product_costs([product_id])
+
+
+def test_recompute_queue_runs_in_background(user, product, ingredient):
+    product_id = product.product_id
+    app.config['COST_RECOMPUTE_SYNC'] = False
+    db_funcs.set_ingredient_price(ingredient.ingredient_id, Decimal('1.00'), 1,
+                                  user_id=user.user_id)
+    db_funcs.add_recipe(product_id, ingredient.name, 3, ingredient.unit_id)
+    db_funcs.cost_queue.join()
+    app.config['COST_RECOMPUTE_SYNC'] = True
+    db.session.expire_all()
+    stored = Product.query.get(product_id)
+    assert not stored.cost_stale
+    assert stored.cost == Decimal('3.00')
+    db_funcs.delete_recipe(product_id, ingredient.ingredient_id)
+    conftest.delete(IngredientPrice.query.get((user.user_id, ingredient.ingredient_id)))
+    assert Product.query.get(product_id).cost == 0
+
+
+def test_compute_product_cost_converts_units(user, product, ingredient):
+    product_id = product.product_id
+    kilograms = db_funcs.get_unit_id('kg')
+    db_funcs.add_recipe(product_id, ingredient.name, 250, ingredient.unit_id)
+    db_funcs.add_recipe(product_id, ingredient.name, 1, kilograms)
+    db_funcs.set_ingredient_price(ingredient.ingredient_id, Decimal('8.00'), 2,
+                                  unit_id=kilograms, user_id=user.user_id)
+    cost = db_funcs.compute_product_cost(product_id)
+    assert cost['total'] == Decimal('1.00')
+    assert not cost['complete']
+    assert db_funcs.compute_raw_quantities(product_id) == [
+        {'ingredient': ingredient.name, 'amount': 1250, 'unit': 'g'}]
+    kilogram_ingredient_id = db_funcs.get_ingredient_id(ingredient.name, kilograms)
+    db_funcs.delete_recipe(product_id, ingredient.ingredient_id)
+    db_funcs.delete_recipe(product_id, kilogram_ingredient_id)
+    conftest.delete(IngredientPrice.query.get((user.user_id, ingredient.ingredient_id)))
+    conftest.delete(Ingredient.query.get(kilogram_ingredient_id))
+
+
+def test_load_recipe_matrix_matches_cost(user, product, ingredient):
+    product_id, ingredient_id = product.product_id, ingredient.ingredient_id
+    kilograms = db_funcs.get_unit_id('kg')
+    db_funcs.add_recipe(product_id, ingredient.name, 250, ingredient.unit_id)
+    db_funcs.set_ingredient_price(ingredient_id, Decimal('8.00'), 2, unit_id=kilograms, user_id=user.user_id)
+    matrix = db_funcs.load_recipe_matrix([product_id])
+    grid = matrix.price_grid([1], {})
+    assert grid.per_batch[0, 0] == float(db_funcs.compute_product_cost(product_id)['total'])
+    factor = db_funcs.get_price_factor(ingredient_id, user.user_id)
+    assert factor == db_funcs.get_price_factor(ingredient_id, user.user_id, 2, kilograms)
+    grid = matrix.price_grid([1], {ingredient_id: [8, 16]}, {ingredient_id: factor})
+    assert grid.per_batch[0].tolist() == [1.0, 2.0]
+    db_funcs.delete_recipe(product_id, ingredient_id)
+    conftest.delete(IngredientPrice.query.get((user.user_id, ingredient_id)))
+
+
+def test_compute_product_cost_is_exact(user, product, ingredient):
+    product_id = product.product_id
+    db_funcs.add_recipe(product_id, ingredient.name, 1, ingredient.unit_id)
+    db_funcs.set_ingredient_price(ingredient.ingredient_id, Decimal('1.00'), 3, user_id=user.user_id)
+    cost = db_funcs.compute_product_cost(product_id)
+    assert cost['total'] == Decimal('0.3333')
+    assert cost['total'] == sum(line['cost'] for line in cost['lines'])
+    db_funcs.delete_recipe(product_id, ingredient.ingredient_id)
+    conftest.delete(IngredientPrice.query.get((user.user_id, ingredient.ingredient_id)))
+
+
+def test_requeue_stale_costs(user, product, ingredient):
+    product_id = product.product_id
+    db_funcs.set_ingredient_price(ingredient.ingredient_id, Decimal('1.00'), 1, user_id=user.user_id)
+    db_funcs.add_recipe(product_id, ingredient.name, 3, ingredient.unit_id)
+    # As left behind by a worker that exited before draining its queue.
+    stored = Product.query.get(product_id)
+    stored.cost, stored.cost_stale = 0, True
+    db.session.commit()
+    assert product_id in db_funcs.requeue_stale_costs()
+    stored = Product.query.get(product_id)
+    assert not stored.cost_stale
+    assert stored.cost == Decimal('3.00')
+    stored.cost, stored.cost_stale = 0, True
+    db.session.commit()
+    app.config['COST_RECOMPUTE_SYNC'] = False
+    try:
+        assert product_id in db_funcs.requeue_stale_costs(sync=True)
+    finally:
+        app.config['COST_RECOMPUTE_SYNC'] = True
+    stored = Product.query.get(product_id)
+    assert not stored.cost_stale
+    assert stored.cost == Decimal('3.00')
+    db_funcs.delete_recipe(product_id, ingredient.ingredient_id)
+    conftest.delete(IngredientPrice.query.get((user.user_id, ingredient.ingredient_id)))
@@ -0,0 +1,49 @@
+from decimal import Decimal
+
+import pytest
+
+from recipe_hub.cost_graph import CostGraph, Line, RecipeCycleError
+
+
+def diamond_graph():
+    # 1 uses 2 and 3, both of which use the shared sub-product 4.
+    yields = {1: 1, 2: 100, 3: 100, 4: 10}
+    lines = {1: [Line(20, 2, 50, None), Line(30, 3, 100, None)],
+             2: [Line(40, 4, 10, None), Line(1, None, 90, Decimal('0.90'))],
+             3: [Line(40, 4, 5, None), Line(2, None, 100, Decimal('2.00'))],
+             4: [Line(3, None, 10, Decimal('5.00'))]}
+    return CostGraph(yields, lines)
+
+
+def test_cost():
+    graph = diamond_graph()
+    assert graph.cost(4) == (Decimal('5.00'), True)
+    assert graph.cost(2) == (Decimal('5.90'), True)
+    assert graph.cost(3) == (Decimal('4.50'), True)
+    assert graph.cost(1) == (Decimal('2.95') + Decimal('4.50'), True)
+
+
+def test_cost_is_incomplete_without_prices():
+    graph = CostGraph({1: 1, 2: 1}, {1: [Line(10, 2, 1, None)],
+                                     2: [Line(20, None, 1, None)]})
+    assert graph.cost(1) == (Decimal(0), False)
+
+
+def test_quantities():
+    assert diamond_graph().quantities(1) == {1: 45, 2: 100, 3: 10}
+
+
+def test_raw_costs():
+    graph = diamond_graph()
+    assert graph.raw_costs(1) == {1: Decimal('0.45'), 2: Decimal('2.00'), 3: Decimal('5.00')}
+    assert sum(graph.raw_costs(1).values()) == graph.cost(1)[0]
+    unpriced = CostGraph({1: 1, 2: 2}, {1: [Line(10, 2, 1, None), Line(20, None, 1, Decimal(1))],
+                                        2: [Line(20, None, 1, None)]})
+    assert unpriced.raw_costs(1) == {20: None}
+
+
+def test_cycle_is_detected():
+    graph = CostGraph({1: 1, 2: 1}, {1: [Line(10, 2, 1, None)],
+                                     2: [Line(20, 1, 1, None)]})
+    with pytest.raises(RecipeCycleError):
+        graph.cost(1)
@@ -0,0 +1,116 @@
+import io
+import json
+
+from recipe_hub import app, db, db_funcs
+from recipe_hub.exporter import csv_chunks
+from recipe_hub.importer import RecipeImporter, read_rows
+from recipe_hub.mappings import Ingredient, Product, Recipe
+
+CSV_FILE = '''product,product_amount,product_unit,public,ingredient,amount,unit
+import bread,1000,g,yes,import flour,600,g
+import bread,,,,import water,400,ml
+import bread,,,,import salt,10,grams
+import jam,500,g,no,,,
+import cake,,,,import flour,100,g
+import jam,,,,import sugar,250,kg
+'''
+
+
+def remove_imported(user_id):
+    products = Product.query.filter(Product.user_id == user_id, Product.name.like('import %')).all()
+    product_ids = [product.product_id for product in products]
+    Recipe.query.filter(Recipe.product_id.in_(product_ids)).delete(synchronize_session=False)
+    for product in products:
+        db.session.delete(product)
+    Ingredient.query.filter(Ingredient.name.like('import %')).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def test_import_csv(user):
+    stats = RecipeImporter(user.user_id, batch_size=2).run(read_rows(io.StringIO(CSV_FILE), 'csv'))
+    assert (stats.rows, stats.products, stats.lines) == (6, 2, 4)
+    assert stats.errors == [{'line': 5, 'error': 'Product import cake has no amount and unit.'}]
+    bread = Product.query.filter(Product.user_id == user.user_id, Product.name == 'import bread').first()
+    assert bread.public and bread.amount == 1000
+    assert Recipe.query.filter(Recipe.product_id == bread.product_id).count() == 3
+    stats = RecipeImporter(user.user_id).run(read_rows(io.StringIO(CSV_FILE), 'csv'))
+    assert (stats.products, stats.lines, stats.skipped) == (0, 0, 4)
+    remove_imported(user.user_id)
+
+
+def test_import_jsonl_reports_bad_rows(user):
+    rows = [{'product': 'import soup', 'product_amount': 2, 'product_unit': 'liter',
+             'ingredient': 'import stock', 'amount': 2, 'unit': 'l'},
+            {'product': 'import soup', 'ingredient': 'import leek', 'amount': 'two', 'unit': 'whole'},
+            {'product': 'import soup', 'ingredient': 'import leek', 'amount': 2, 'unit': 'whole'},
+            {'product': 'import soup', 'ingredient': 'import leek', 'amount': 3, 'unit': 'whole'}]
+    text = '\n'.join(json.dumps(row) for row in rows) + '\nnot json\n'
+    stats = RecipeImporter(user.user_id).run(read_rows(io.StringIO(text), 'jsonl'))
+    assert (stats.lines, stats.skipped) == (2, 1)
+    assert [error['line'] for error in stats.errors] == [2, 5]
+    remove_imported(user.user_id)
+
+
+def test_import_resumes_from_checkpoint(user, tmp_path):
+    checkpoint = tmp_path / 'recipes.checkpoint'
+    checkpoint.write_text(json.dumps({'row': 3}))
+    stats = RecipeImporter(user.user_id, checkpoint_path=str(checkpoint)).run(
+        read_rows(io.StringIO(CSV_FILE), 'csv'))
+    assert stats.skipped == 3
+    assert stats.lines == 1
+    assert not checkpoint.exists()
+    remove_imported(user.user_id)
+
+
+def test_export_round_trip_keeps_sub_recipes(user, user2):
+    bread_id = db_funcs.add_product('import bread', 1000, 1, False, user_id=user.user_id)
+    dough_id = db_funcs.add_product('import dough', 800, 1, False, user_id=user.user_id)
+    db_funcs.add_recipe(dough_id, 'import flour', 500, 1)
+    db_funcs.add_sub_recipe(bread_id, dough_id, 800)
+    text = ''.join(csv_chunks(db_funcs.iter_product_lines(user.user_id)))
+    # Bread sorts before dough, so its sub-recipe line waits for the next batch.
+    stats = RecipeImporter(user2.user_id, batch_size=1).run(read_rows(io.StringIO(text), 'csv'))
+    assert stats.errors == []
+    assert (stats.products, stats.lines) == (2, 2)
+    bread, dough = [db_funcs.get_product_id(user2.user_id, name) for name in ('import bread', 'import dough')]
+    assert db_funcs.get_sub_products(bread) == {bread, dough}
+    stats = RecipeImporter(user.user_id).run(read_rows(io.StringIO(text), 'csv'))
+    assert (stats.products, stats.lines, stats.skipped) == (0, 0, 2)
+    remove_imported(user.user_id)
+    remove_imported(user2.user_id)
+
+
+def test_import_resolves_sub_lines_by_name(user, tmp_path):
+    checkpoint = tmp_path / 'recipes.checkpoint'
+    rows = [{'product': 'import bread', 'product_amount': 1000, 'product_unit': 'g',
+             'ingredient': 'import dough', 'amount': 500, 'unit': 'g', 'sub_product_id': '0'},
+            {'product': 'import jam', 'product_amount': 500, 'product_unit': 'g'},
+            {'product': 'import dough', 'product_amount': 800, 'product_unit': 'g',
+             'ingredient': 'import flour', 'amount': 500, 'unit': 'g'},
+            {'product': 'import dough', 'ingredient': 'import bread', 'amount': 100, 'unit': 'g',
+             'sub_product_id': '0'}]
+    pending = []
+
+    def progress(stats):
+        pending.append(len(json.loads(checkpoint.read_text())['pending']))
+
+    stats = RecipeImporter(user.user_id, batch_size=1, checkpoint_path=str(checkpoint),
+                           progress=progress).run(rows)
+    assert pending == [1, 1, 0, 0]
+    assert stats.lines == 2
+    assert [error['line'] for error in stats.errors] == [4]
+    bread, dough = [db_funcs.get_product_id(user.user_id, name) for name in ('import bread', 'import dough')]
+    assert db_funcs.get_sub_products(bread) == {bread, dough}
+    remove_imported(user.user_id)
+
+
+def test_import_command(user, tmp_path):
+    user_id, email = user.user_id, user.email
+    path = tmp_path / 'recipes.csv'
+    path.write_text(CSV_FILE)
+    result = app.test_cli_runner().invoke(args=['import-recipes', str(path), '--user', email])
+    assert result.exit_code == 0
+    assert 'Imported 2 products and 4 recipe lines.' in result.output
+    result = app.test_cli_runner().invoke(args=['import-recipes', str(path), '--user', 'nobody@example.com'])
+    assert result.exit_code != 0
+    remove_imported(user_id)
@@ -1,10 +1,32 @@
+import threading
+
 from sqlalchemy import and_
 
-from recipe_hub import db_funcs
-from recipe_hub.mappings import Ingredient
+from recipe_hub import app, db, db_funcs
+from recipe_hub.mappings import Ingredient, IngredientPrice
 from tests import conftest
 
 
+def test_collect_unused_ingredients(user):
+    # Sweeps every unused ingredient, so it runs before this module's
+    # ingredient fixture exists.
+    product_id = db_funcs.add_product('gc product', 1, 1, False, user_id=user.user_id)
+    db_funcs.add_recipe(product_id, 'gc used', 1, 1)
+    ingredient_ids = db_funcs.add_ingredients([(f'gc unused {i}', 1) for i in range(5)] + [('gc priced', 1)])
+    db.session.commit()
+    priced_id = ingredient_ids[('gc priced', 1)]
+    db_funcs.set_ingredient_price(priced_id, 1, 1, user_id=user.user_id)
+    assert db_funcs.collect_unused_ingredients(batch_size=2) >= 5
+    assert Ingredient.query.filter(Ingredient.name.like('gc unused %')).count() == 0
+    assert db_funcs.get_ingredient_id('gc used', 1) is not None
+    assert Ingredient.query.get(priced_id) is not None
+    db_funcs.delete_product(product_id)
+    db.session.delete(IngredientPrice.query.get((user.user_id, priced_id)))
+    db.session.commit()
+    assert db_funcs.collect_unused_ingredients() >= 2
+    assert Ingredient.query.filter(Ingredient.name.like('gc %')).count() == 0
+
+
 def test_add_ingredient():
     ingredient_name = 'aaa_ingredient_test_name_aaa'
     unit_id = 1
@@ -20,16 +42,40 @@ def test_add_ingredient():
     conftest.delete(ingredient)
 
 
-def test_get_ingredient_id(ingredient):
-    assert db_funcs.get_ingredient_id(
-        ingredient.name, ingredient.unit_id) == ingredient.ingredient_id
+def test_add_ingredients_is_one_statement(ingredient):
+    keys = [(ingredient.name, ingredient.unit_id), ('upserted ingredient', 1), ('Upserted Ingredient', 1)]
+    with conftest.count_queries() as statements:
+        ingredient_ids = db_funcs.add_ingredients(keys)
+    db.session.commit()
+    assert len(statements) == 1
+    assert set(ingredient_ids) == {(ingredient.name, ingredient.unit_id), ('upserted ingredient', 1)}
+    assert ingredient_ids[(ingredient.name, ingredient.unit_id)] == ingredient.ingredient_id
+    upserted_id = ingredient_ids[('upserted ingredient', 1)]
+    assert db_funcs.add_ingredients(keys[1:]) == {('upserted ingredient', 1): upserted_id}
+    conftest.delete(Ingredient.query.get(upserted_id))
 
 
-def test_get_ingredient_name(ingredient):
-    assert db_funcs.get_ingredient_name(
-        ingredient.ingredient_id) == ingredient.name
+def test_add_ingredient_concurrently():
+    barrier = threading.Barrier(4)
+    ingredient_ids = []
 
+    def add():
+        with app.app_context():
+            barrier.wait()
+            ingredient_ids.append(db_funcs.add_ingredient('raced ingredient', 1))
+            db.session.remove()
 
-def test_get_ingredient_unit(ingredient):
-    name = conftest.get_unit_name(ingredient.unit_id)
-    assert db_funcs.get_ingredient_unit(ingredient.ingredient_id) == name
+    threads = [threading.Thread(target=add) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(ingredient_ids) == 4
+    assert len(set(ingredient_ids)) == 1
+    assert Ingredient.query.filter(Ingredient.name == 'raced ingredient').count() == 1
+    conftest.delete(Ingredient.query.get(ingredient_ids[0]))
+
+
+def test_get_ingredient_id(ingredient):
+    assert db_funcs.get_ingredient_id(
+        ingredient.name, ingredient.unit_id) == ingredient.ingredient_id
@@ -1,5 +1,10 @@
+from unittest import mock
+
 import pytest
 
+from recipe_hub import db_funcs
+from recipe_hub.passwords import HasherBusyError
+
 from tests import conftest
 
 # Parameters
@@ -61,4 +66,13 @@ def test_login_logout(client, user):
             in client.post(conftest.ROUTES['login'], data=data,
                            follow_redirects=True).data)
     assert (client.get(conftest.ROUTES['logout']).status_code
-            == conftest.HTTP_CODES['found'])
\ No newline at end of file
+            == conftest.HTTP_CODES['found'])
+
+
+def test_login_busy_returns_service_unavailable(client, user):
+    data = {'email': 'admin@admin.com',
+            'password': 'admin123'}
+    with mock.patch.object(db_funcs.password_hasher, 'check', side_effect=HasherBusyError):
+        response = client.post(conftest.ROUTES['login'], data=data)
+    assert response.status_code == conftest.HTTP_CODES['service_unavailable']
+    assert response.headers['Retry-After'] == '1'
@@ -0,0 +1,204 @@
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import create_engine, event
+
+from recipe_hub import db, db_funcs
+from recipe_hub.mappings import Ingredient, IngredientPrice, Product, Recipe, User
+from recipe_hub.migrations import MIGRATIONS, get_applied_versions, run_migration, upgrade
+from recipe_hub.pool import enable_sqlite_foreign_keys
+from recipe_hub.units import invalidate_unit_registry
+
+SEED_USERS = 2000
+SEED_PRODUCTS_PER_USER = 10
+INDEXED_TABLES = ('users', 'products', 'ingredients', 'recipes')
+# The tables as they were before any migration existed.
+BASELINE_SCHEMA = (
+    'CREATE TABLE users (user_id INTEGER PRIMARY KEY, username VARCHAR NOT NULL UNIQUE, '
+    'password_hash BLOB NOT NULL, full_name VARCHAR NOT NULL, email VARCHAR NOT NULL UNIQUE, '
+    'date_of_birth DATETIME)',
+    'CREATE TABLE units (unit_id INTEGER PRIMARY KEY, name VARCHAR NOT NULL UNIQUE, symbol VARCHAR UNIQUE)',
+    'CREATE TABLE products (product_id INTEGER PRIMARY KEY, name VARCHAR NOT NULL, amount INTEGER NOT NULL, '
+    'unit_id INTEGER NOT NULL REFERENCES units (unit_id), user_id INTEGER NOT NULL REFERENCES users (user_id), '
+    'public BOOLEAN)',
+    'CREATE TABLE ingredients (ingredient_id INTEGER PRIMARY KEY, name VARCHAR NOT NULL, '
+    'unit_id INTEGER NOT NULL REFERENCES units (unit_id))',
+    'CREATE TABLE recipes (product_id INTEGER NOT NULL REFERENCES products (product_id), '
+    'ingredient_id INTEGER NOT NULL REFERENCES ingredients (ingredient_id), amount INTEGER NOT NULL, '
+    'PRIMARY KEY (product_id, ingredient_id))',
+)
+
+
+@contextmanager
+def session_bound_to(engine):
+    # Points db.session, and so the db_funcs, at another database. The unit
+    # registry loaded from it is dropped again afterwards.
+    options = dict(db.session.session_factory.kw)
+    db.session.remove()
+    db.session.configure(bind=engine, binds={})
+    try:
+        yield
+    finally:
+        db.session.remove()
+        db.session.session_factory.kw.clear()
+        db.session.session_factory.kw.update(options)
+        invalidate_unit_registry()
+
+
+def create_baseline_database(path):
+    engine = create_engine(f'sqlite:///{path}')
+    with engine.begin() as connection:
+        for statement in BASELINE_SCHEMA:
+            connection.execute(statement)
+        connection.execute("INSERT INTO units VALUES (1, 'grams', 'g'), (2, 'kilograms', 'kg')")
+        connection.execute("INSERT INTO users VALUES (1, 'baker', x'2d', 'baker', 'baker@bakery.com', NULL)")
+        connection.execute("INSERT INTO products VALUES (1, 'bread', 1000, 1, 1, 1)")
+        connection.execute("INSERT INTO ingredients VALUES (1, 'flour', 1), (2, 'flour', 1), (3, 'salt', 2)")
+        connection.execute('INSERT INTO recipes VALUES (1, 2, 600), (1, 3, 1)')
+    return engine
+
+
+@contextmanager
+def record_queries():
+    queries = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        queries.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield queries
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+
+def explain(statement, parameters):
+    cursor = db.session.connection().connection.cursor()
+    cursor.execute(f'EXPLAIN {statement}', parameters)
+    return '\n'.join(row[0] for row in cursor.fetchall())
+
+
+@pytest.fixture(scope='module')
+def seeded():
+    # Enough rows that the planner prefers an index whenever one applies.
+    db.session.execute(User.__table__.insert(), [
+        {'username': f'seed user {i}', 'email': f'seed{i}@seed.com', 'full_name': 'seed',
+         'password_hash': b'-'} for i in range(SEED_USERS)])
+    user_ids = [user.user_id for user in User.query.filter(User.username.like('seed user %'))]
+    db.session.execute(Product.__table__.insert(), [
+        {'name': f'seed product {i}', 'amount': 1, 'unit_id': 1, 'user_id': user_id,
+         'public': i % 10 == 0, 'random_key': i / SEED_PRODUCTS_PER_USER}
+        for user_id in user_ids for i in range(SEED_PRODUCTS_PER_USER)])
+    db.session.execute(Ingredient.__table__.insert(), [
+        {'name': f'seed ingredient {i}', 'unit_id': 1} for i in range(SEED_USERS * SEED_PRODUCTS_PER_USER)])
+    product_ids = [row.product_id for row in
+                   db.session.query(Product.product_id).filter(Product.user_id.in_(user_ids))]
+    ingredient_ids = [row.ingredient_id for row in
+                      db.session.query(Ingredient.ingredient_id).filter(Ingredient.name.like('seed ingredient %'))]
+    db.session.execute(Recipe.__table__.insert(), [
+        {'product_id': product_id, 'ingredient_id': ingredient_ids[(i + offset) % len(ingredient_ids)],
+         'amount': 1} for i, product_id in enumerate(product_ids) for offset in (0, 1)])
+    db.session.commit()
+    db.session.execute('ANALYZE')
+    yield user_ids, product_ids
+    Recipe.query.filter(Recipe.product_id.in_(product_ids)).delete(synchronize_session=False)
+    Product.query.filter(Product.user_id.in_(user_ids)).delete(synchronize_session=False)
+    Ingredient.query.filter(Ingredient.ingredient_id.in_(ingredient_ids)).delete(synchronize_session=False)
+    User.query.filter(User.user_id.in_(user_ids)).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def test_upgrade_applies_each_migration_once():
+    upgrade()
+    assert upgrade() == []
+    with db.engine.connect() as connection:
+        assert get_applied_versions(connection) == [migration.version for migration in MIGRATIONS]
+
+
+def test_upgrade_baseline_database(tmp_path):
+    engine = create_baseline_database(tmp_path / 'baseline.db')
+    assert upgrade(engine) == [migration.version for migration in MIGRATIONS]
+    assert upgrade(engine) == []
+    with engine.connect() as connection:
+        product = connection.execute('SELECT * FROM products').first()
+        assert 0 <= product.random_key < 1
+        assert (product.version, product.cost_stale) == (1, True)
+        assert [tuple(unit) for unit in connection.execute(
+            'SELECT name, dimension, factor FROM units ORDER BY unit_id')] == [
+            ('grams', 'mass', 1), ('kilograms', 'mass', 1000)]
+        assert [tuple(row) for row in connection.execute(
+            'SELECT ingredient_id, product_id, density FROM ingredients ORDER BY ingredient_id')] == [
+            (1, None, None), (3, None, None)]
+        assert [tuple(row) for row in connection.execute(
+            'SELECT ingredient_id, amount FROM recipes ORDER BY ingredient_id')] == [(1, 600), (3, 1)]
+        assert [tuple(row) for row in connection.execute(
+            'SELECT ingredient_id, product_count FROM ingredient_usage ORDER BY ingredient_id')] == [
+            (1, 1), (3, 1)]
+    engine.dispose()
+
+
+def test_upgraded_baseline_database_cascades_deletes(tmp_path):
+    engine = create_baseline_database(tmp_path / 'baseline.db')
+    enable_sqlite_foreign_keys(engine)
+    upgrade(engine)
+    with engine.begin() as connection:
+        connection.execute("INSERT INTO products (product_id, name, amount, unit_id, user_id, public) "
+                           "VALUES (2, 'dough', 800, 1, 1, 0)")
+        connection.execute("INSERT INTO ingredients (ingredient_id, name, unit_id, product_id) "
+                           "VALUES (4, 'dough', 1, 2)")
+        connection.execute('INSERT INTO recipes VALUES (2, 1, 500), (1, 4, 800)')
+    with session_bound_to(engine):
+        assert db_funcs.delete_product(2, 1)
+        assert db_funcs.delete_product(1, 1)
+    with engine.connect() as connection:
+        assert connection.execute('SELECT count(*) FROM recipes').scalar() == 0
+        assert connection.execute('SELECT count(*) FROM ingredients WHERE product_id IS NOT NULL').scalar() == 0
+    engine.dispose()
+
+
+def test_merge_duplicate_ingredients(user, product):
+    product_id, user_id = product.product_id, user.user_id
+    db.session.execute('DROP INDEX ux_ingredients_name_unit_id')
+    duplicates = [Ingredient(name='duplicate ingredient', unit_id=1) for _ in range(3)]
+    db.session.add_all(duplicates)
+    db.session.flush()
+    keeper_id = duplicates[0].ingredient_id
+    db.session.add_all([Recipe(product_id=product_id, ingredient_id=duplicates[1].ingredient_id, amount=5),
+                        Recipe(product_id=product_id, ingredient_id=duplicates[2].ingredient_id, amount=7),
+                        IngredientPrice(user_id=user_id, ingredient_id=duplicates[2].ingredient_id,
+                                        price=1, package_amount=1)])
+    db.session.commit()
+    run_migration(db.session.connection(), MIGRATIONS[1])
+    db.session.commit()
+    db.session.expire_all()
+    assert [ingredient.ingredient_id for ingredient in
+            Ingredient.query.filter(Ingredient.name == 'duplicate ingredient')] == [keeper_id]
+    assert [recipe.ingredient_id for recipe in
+            Recipe.query.filter(Recipe.product_id == product_id)] == [keeper_id]
+    assert IngredientPrice.query.get((user_id, keeper_id)) is not None
+    entries = [IngredientPrice.query.get((user_id, keeper_id)),
+               Recipe.query.get((product_id, keeper_id)), Ingredient.query.get(keeper_id)]
+    for entry in entries:
+        db.session.delete(entry)
+    db.session.commit()
+
+
+@pytest.mark.skipif(db.engine.dialect.name != 'postgresql', reason='checks PostgreSQL plans')
+def test_hot_queries_use_indexes(seeded):
+    user_ids, product_ids = seeded
+    with record_queries() as queries:
+        db_funcs.get_ingredient_id('seed ingredient 7', 1)
+        db_funcs.add_ingredients([('seed ingredient 7', 1)])
+        db_funcs.get_product_id(user_ids[3], 'seed product 7')
+        db_funcs.get_all_products(user_ids[3], limit=10)
+        db_funcs.get_all_products(user_ids[3], after=product_ids[3 * SEED_PRODUCTS_PER_USER + 5], limit=10)
+        db_funcs.get_all_public_products(limit=10)
+        db_funcs.get_recipe(product_ids[11])
+        db_funcs.get_ingredient_products(1, user_ids[3], limit=10)
+        db_funcs.get_user_by_username('Seed User 7')
+        db_funcs.search_ingredients('seed ingredient 12')
+        db_funcs.search_products('seed product', user_ids[3])
+    for statement, parameters in queries:
+        plan = explain(statement, parameters)
+        for table in INDEXED_TABLES:
+            assert f'Seq Scan on {table}' not in plan, plan
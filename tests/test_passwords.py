@@ -0,0 +1,56 @@
+import pytest
+from flask import Flask
+
+from recipe_hub.passwords import DEFAULT_ROUNDS, HasherBusyError, PasswordHasher, get_rounds, hasher_config
+
+
+def make_hasher(**config) -> PasswordHasher:
+    app = Flask(__name__)
+    app.config.update(BCRYPT_ROUNDS=4, **config)
+    return PasswordHasher(app)
+
+
+def test_hash_and_check_inline():
+    hasher = make_hasher(PASSWORD_HASH_WORKERS=0)
+    password_hash = hasher.hash('secret password')
+    assert get_rounds(password_hash) == 4
+    assert hasher.check('secret password', password_hash)
+    assert not hasher.check('wrong password', password_hash)
+
+
+def test_hash_and_check_in_pool():
+    hasher = make_hasher(PASSWORD_HASH_WORKERS=1)
+    try:
+        assert hasher.check('secret password', hasher.hash('secret password'))
+    finally:
+        hasher.shutdown()
+
+
+def test_pool_rejects_when_saturated():
+    hasher = make_hasher(PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_QUEUE=1)
+    try:
+        _, slots = hasher._ensure_pool()
+        slots.acquire()
+        with pytest.raises(HasherBusyError):
+            hasher.hash('secret password')
+        slots.release()
+        assert hasher.hash('secret password')
+    finally:
+        hasher.shutdown()
+
+
+def test_needs_rehash():
+    hasher = make_hasher(PASSWORD_HASH_WORKERS=0)
+    password_hash = hasher.hash('secret password')
+    assert not hasher.needs_rehash(password_hash)
+    hasher.app.config['BCRYPT_ROUNDS'] = 5
+    assert hasher.needs_rehash(password_hash)
+
+
+def test_hasher_config_shares_cpus_between_workers(monkeypatch):
+    monkeypatch.setattr('os.cpu_count', lambda: 8)
+    assert hasher_config({}) == {'PASSWORD_HASH_WORKERS': 1, 'PASSWORD_HASH_QUEUE': 4,
+                                 'BCRYPT_ROUNDS': DEFAULT_ROUNDS}
+    assert hasher_config({'WEB_CONCURRENCY': '2'})['PASSWORD_HASH_WORKERS'] == 4
+    config = hasher_config({'PASSWORD_HASH_WORKERS': '0', 'PASSWORD_HASH_QUEUE': '2', 'BCRYPT_ROUNDS': '10'})
+    assert config == {'PASSWORD_HASH_WORKERS': 0, 'PASSWORD_HASH_QUEUE': 2, 'BCRYPT_ROUNDS': 10}
@@ -0,0 +1,62 @@
+from unittest import mock
+
+import pytest
+from sqlalchemy import create_engine, exc
+
+from recipe_hub import db
+from recipe_hub.pool import (MAX_OVERFLOW, POOL_SIZE, MeteredQueuePool, connection_budget, engine_options,
+                             install_fork_guard)
+
+
+def test_engine_options_defaults():
+    options = engine_options('postgresql://localhost/recipes', {})
+    assert options['poolclass'] is MeteredQueuePool
+    assert (options['pool_size'], options['max_overflow']) == (POOL_SIZE, MAX_OVERFLOW)
+    assert options['pool_pre_ping'] is True
+    assert options['executemany_mode'] == 'values'
+    assert 'connect_args' not in options
+    assert engine_options('sqlite:///recipes.db', {}) == {}
+
+
+def test_engine_options_from_environment():
+    options = engine_options('postgresql://localhost/recipes',
+                             {'DB_POOL_SIZE': '2', 'DB_MAX_OVERFLOW': '0', 'DB_POOL_PRE_PING': 'off',
+                              'DB_POOL_RECYCLE': '60', 'DB_STATEMENT_TIMEOUT': '5000'})
+    assert (options['pool_size'], options['max_overflow'], options['pool_recycle']) == (2, 0, 60)
+    assert options['pool_pre_ping'] is False
+    assert options['connect_args'] == {'options': '-c statement_timeout=5000'}
+    assert connection_budget(3, options) == 6
+
+
+def test_metered_pool_counts_waits_and_timeouts():
+    engine = create_engine('sqlite://', poolclass=MeteredQueuePool, pool_size=1, max_overflow=0,
+                           pool_timeout=0.05)
+    connection = engine.connect()
+    with pytest.raises(exc.TimeoutError):
+        engine.connect()
+    status = engine.pool.status_dict()
+    assert (status['checkouts'], status['timeouts'], status['checked_out']) == (1, 1, 1)
+    assert status['wait_max_ms'] >= 50
+    connection.close()
+    engine.dispose()
+    assert engine.pool.status_dict()['checkouts'] == 1
+
+
+def test_fork_guard_replaces_inherited_connections():
+    engine = create_engine('sqlite://', poolclass=MeteredQueuePool, pool_size=1, max_overflow=0)
+    install_fork_guard(engine)
+    with engine.connect() as connection:
+        parent_connection = connection.connection.connection
+    with mock.patch('recipe_hub.pool.os.getpid', return_value=-1):
+        with engine.connect() as connection:
+            assert connection.connection.connection is not parent_connection
+            assert connection.connection._connection_record.info['pid'] == -1
+
+
+@pytest.mark.skipif(db.engine.dialect.name != 'postgresql', reason='uses PostgreSQL settings')
+def test_statement_timeout():
+    engine = create_engine(db.engine.url, **engine_options('postgresql://', {'DB_STATEMENT_TIMEOUT': '50'}))
+    with engine.connect() as connection:
+        with pytest.raises(exc.OperationalError):
+            connection.execute('SELECT pg_sleep(1)')
+    engine.dispose()
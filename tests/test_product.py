@@ -1,6 +1,12 @@
+import io
+
 from sqlalchemy import and_
 
-from recipe_hub.mappings import Product, Recipe, Unit
+from recipe_hub import db, db_funcs
+from recipe_hub.cache import make_key
+from recipe_hub.importer import read_rows
+from recipe_hub.mappings import Ingredient, IngredientPrice, Product, Recipe
+from recipe_hub.views import FLASHED_IMPORT_ERRORS, render_cache
 from tests import conftest
 
 
@@ -16,6 +22,38 @@ def test_products_page_returns_ok(client, user):
     conftest.logout(client)
 
 
+def test_products_page_paginates(client, user):
+    products = [Product(name=f'paged product {i}', amount=1, unit_id=1,
+                        user_id=user.user_id, public=True) for i in range(3)]
+    db.session.add_all(products)
+    db.session.commit()
+    conftest.login(client, user)
+    first_page = client.get(f"{conftest.ROUTES['products']}?limit=2").data
+    assert b'Paged Product 0' in first_page
+    assert b'Paged Product 2' not in first_page
+    assert b'after=' in first_page
+    conftest.logout(client)
+    for product in products:
+        db.session.delete(product)
+    db.session.commit()
+
+
+def test_products_page_searches(client, user):
+    products = [Product(name=name, amount=1, unit_id=1, user_id=user.user_id, public=True)
+                for name in ('searched pie', 'searched pudding', 'searched pasta', 'other pie')]
+    db.session.add_all(products)
+    db.session.commit()
+    conftest.login(client, user)
+    page = client.get(f"{conftest.ROUTES['products']}?q=Searched+P&limit=2").data
+    assert b'Searched Pasta' in page and b'Searched Pie' in page
+    assert b'Other Pie' not in page and b'Searched Pudding' not in page
+    assert b'q=Searched' in page
+    conftest.logout(client)
+    for product in products:
+        db.session.delete(product)
+    db.session.commit()
+
+
 def test_nonexistant_product_redirects(client):
     invalid_id = 0
     assert (client.get(f"{conftest.ROUTES['view_product']}{invalid_id}/",
@@ -27,7 +65,7 @@ def test_product_add_success(client, user):
     conftest.login(client, user)
     data = {'name': 'test_product',
             'amount': 500,
-            'unit': 'g',
+            'unit': 1,
             'public': True}
     assert (client.post(conftest.ROUTES['new_product'], data=data,
                         follow_redirects=True).status_code
@@ -47,14 +85,9 @@ def test_add_remove_recipe(client, user, product, ingredient):
     assert Recipe.query.filter(
         and_(Recipe.product_id == product_id,
              Recipe.ingredient_id == ingredient_id)).first() is None
-    unit = Unit.query.get(ingredient.unit_id)
-    if unit.symbol:
-        name = unit.symbol
-    else:
-        name = unit.name
     data = {'ingredient': ingredient.name,
             'amount': 500,
-            'unit': name}
+            'unit': ingredient.unit_id}
     client.post(f"{conftest.ROUTES['view_product']}{product_id}/",
                 data=data)
     assert Recipe.query.filter(
@@ -71,11 +104,242 @@ def test_add_remove_recipe(client, user, product, ingredient):
     conftest.logout(client)
 
 
+def test_view_product_render_cache(client, user, product, ingredient):
+    product_id = product.product_id
+    ingredient_name, unit_id = ingredient.name, ingredient.unit_id
+    route = f"{conftest.ROUTES['view_product']}{product_id}/"
+    stats = render_cache.stats
+    conftest.login(client, user)
+    client.get(route)
+    before = stats.to_dict()
+    client.get(route)
+    after = stats.to_dict()
+    assert after['hits'] == before['hits'] + 1
+    assert after['misses'] == before['misses']
+    client.post(route, data={'ingredient': ingredient_name, 'amount': 500, 'unit': unit_id})
+    assert stats.misses == after['misses'] + 1
+    client.get(conftest.ROUTES['logout'])
+    public = db_funcs.get_product(product_id)['public']
+    if not public:
+        db_funcs.share_product(product_id)
+    page = client.get(route).data
+    assert ingredient_name.title().encode() in page
+    assert b'Delete Product' not in page
+    assert stats.misses == after['misses'] + 2
+    if not public:
+        db_funcs.share_product(product_id)
+    db_funcs.delete_recipe(product_id, ingredient.ingredient_id)
+
+
+def test_render_cache_ignores_deleted_product(client, user):
+    conftest.login(client, user)
+    old_id = db_funcs.add_product('reused product', 1, 1, False, user_id=user.user_id)
+    db_funcs.add_recipe(old_id, 'secret ingredient', 1, 1)
+    client.get(f"{conftest.ROUTES['view_product']}{old_id}/")
+    db_funcs.delete_product(old_id)
+    # SQLite hands the deleted id out again and the new product starts at version 1.
+    new_id = db_funcs.add_product('reused product', 1, 1, False, user_id=user.user_id)
+    db_funcs.add_recipe(new_id, 'water', 1, 1)
+    page = client.get(f"{conftest.ROUTES['view_product']}{new_id}/").data
+    assert b'Water' in page
+    assert b'Secret Ingredient' not in page
+    conftest.logout(client)
+    db_funcs.delete_product(new_id)
+    Ingredient.query.filter(Ingredient.name.in_(['secret ingredient', 'water'])).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def test_delete_product_evicts_render_cache(client, user):
+    conftest.login(client, user)
+    product_id = db_funcs.add_product('evicted product', 1, 1, False, user_id=user.user_id)
+    client.get(f"{conftest.ROUTES['view_product']}{product_id}/")
+    state = db_funcs.get_product_version(product_id)
+    key = make_key('product', product_id, state.random_key, state.version, 'owner')
+    assert render_cache._get(key) is not None
+    client.get(f"{conftest.ROUTES['view_product']}{product_id}/delete/all/")
+    assert Product.query.get(product_id) is None
+    assert render_cache._get(key) is None
+    conftest.logout(client)
+
+
+def test_set_price(client, user, product, ingredient):
+    product_id = product.product_id
+    ingredient_id = ingredient.ingredient_id
+    recipe = Recipe(product_id=product_id, ingredient_id=ingredient_id, amount=500)
+    db.session.add(recipe)
+    db.session.commit()
+    conftest.login(client, user)
+    data = {'ingredient_id': ingredient_id, 'price': '2.00', 'package_amount': 1000,
+            'unit': 1}
+    page = client.post(f"{conftest.ROUTES['view_product']}{product_id}"
+                       f"{conftest.ROUTES['price']}", data=data,
+                       follow_redirects=True).data
+    assert conftest.MESSAGES['price_success'] in page
+    assert b'1.00' in page
+    ingredient_price = IngredientPrice.query.get((user.user_id, ingredient_id))
+    assert ingredient_price is not None
+    conftest.delete(ingredient_price)
+    conftest.delete(recipe)
+    conftest.logout(client)
+
+
+def test_set_price_requires_owner(client, user, user2, product, ingredient):
+    product_id, ingredient_id = product.product_id, ingredient.ingredient_id
+    db_funcs.add_recipe(product_id, ingredient.name, 500, ingredient.unit_id)
+    route = f"{conftest.ROUTES['view_product']}{product_id}{conftest.ROUTES['price']}"
+    data = {'ingredient_id': ingredient_id, 'price': '2.00', 'package_amount': 1,
+            'unit': db_funcs.get_unit_id('ml'), 'density': 2}
+    client.post(conftest.ROUTES['login'], data={'email': 'admin2@admin.com', 'password': 'admin123'})
+    assert client.post(route, data=data).status_code == conftest.HTTP_CODES['forbidden']
+    assert IngredientPrice.query.get((user2.user_id, ingredient_id)) is None
+    conftest.login(client, user)
+    assert client.post(route, data=data).status_code == conftest.HTTP_CODES['found']
+    assert IngredientPrice.query.get((user.user_id, ingredient_id)).density == 2
+    assert Ingredient.query.get(ingredient_id).density is None
+    page = client.post(route, data=dict(data, ingredient_id=999999), follow_redirects=True).data
+    assert b'The chosen ingredient does not exist.' in page
+    conftest.logout(client)
+    db_funcs.delete_recipe(product_id, ingredient_id)
+    conftest.delete(IngredientPrice.query.get((user.user_id, ingredient_id)))
+
+
+def test_add_sub_recipe(client, user, product):
+    product_id = product.product_id
+    sauce = Product(name='test sauce', amount=100, unit_id=1,
+                    user_id=user.user_id, public=False)
+    db.session.add(sauce)
+    db.session.commit()
+    sauce_id = sauce.product_id
+    conftest.login(client, user)
+    data = {'product_id': product_id, 'sub_product': sauce_id, 'amount': 50}
+    client.post(f"{conftest.ROUTES['view_product']}{product_id}"
+                f"{conftest.ROUTES['sub_recipe']}", data=data)
+    ingredient = Ingredient.query.filter(Ingredient.product_id == sauce_id).first()
+    recipe = Recipe.query.filter(and_(Recipe.product_id == product_id,
+                                      Recipe.ingredient_id == ingredient.ingredient_id)).first()
+    assert recipe is not None
+    data = {'product_id': sauce_id, 'sub_product': product_id, 'amount': 50}
+    assert (conftest.MESSAGES['recipe_cycle']
+            in client.post(f"{conftest.ROUTES['view_product']}{sauce_id}"
+                           f"{conftest.ROUTES['sub_recipe']}", data=data,
+                           follow_redirects=True).data)
+    conftest.delete(recipe)
+    conftest.delete(ingredient)
+    conftest.delete(sauce)
+    conftest.logout(client)
+
+
+def test_add_sub_recipe_requires_owner(client, user, user2, product):
+    product_id = product.product_id
+    sauce = Product(name='foreign sauce', amount=100, unit_id=1,
+                    user_id=user2.user_id, public=False)
+    db.session.add(sauce)
+    db.session.commit()
+    sauce_id = sauce.product_id
+    client.post(conftest.ROUTES['login'], data={'email': 'admin2@admin.com', 'password': 'admin123'})
+    data = {'product_id': sauce_id, 'sub_product': sauce_id, 'amount': 50}
+    assert (client.post(f"{conftest.ROUTES['view_product']}{product_id}"
+                        f"{conftest.ROUTES['sub_recipe']}", data=data).status_code
+            == conftest.HTTP_CODES['forbidden'])
+    assert Recipe.query.filter(Recipe.product_id == product_id).first() is None
+    conftest.logout(client)
+    conftest.delete(sauce)
+
+
+def test_add_recipes_bulk(client, user, product, ingredient):
+    product_id = product.product_id
+    ingredient_id = ingredient.ingredient_id
+    route = f"{conftest.ROUTES['view_product']}{product_id}{conftest.ROUTES['bulk_recipe']}"
+    lines = [{'ingredient': ingredient.name, 'amount': 500, 'unit': ingredient.unit_id},
+             {'ingredient': 'bulk water', 'amount': 'lots', 'unit': 'ml'}]
+    assert client.post(route, json={'lines': lines}).status_code == conftest.HTTP_CODES['unauthorized']
+    conftest.login(client, user)
+    response = client.post(route, json={'lines': lines})
+    assert response.status_code == conftest.HTTP_CODES['bad_request']
+    assert response.get_json()['errors'][0]['line'] == 2
+    assert Recipe.query.filter(Recipe.product_id == product_id).first() is None
+    response = client.post(route, json={'lines': lines[:1]})
+    assert response.status_code == conftest.HTTP_CODES['created']
+    assert response.get_json()['ingredient_ids'] == [ingredient_id]
+    page = client.post(route, data={'lines': f'{ingredient.name}, 1, g'},
+                       follow_redirects=True).data
+    assert conftest.MESSAGES['existing_ingredient'] in page
+    conftest.delete(Recipe.query.get((product_id, ingredient_id)))
+    conftest.logout(client)
+
+
+def test_import_products(client, user):
+    conftest.login(client, user)
+    upload = (io.BytesIO(b'product,product_amount,product_unit,ingredient,amount,unit\n'
+                         b'uploaded bread,1000,g,uploaded flour,600,g\n'), 'bread.csv')
+    page = client.post(conftest.ROUTES['import'], data={'file': upload},
+                       content_type='multipart/form-data', follow_redirects=True).data
+    assert conftest.MESSAGES['import_success'] in page
+    product = Product.query.filter(and_(Product.user_id == user.user_id,
+                                        Product.name == 'uploaded bread')).first()
+    recipe = Recipe.query.filter(Recipe.product_id == product.product_id).first()
+    ingredient = Ingredient.query.get(recipe.ingredient_id)
+    conftest.delete(recipe)
+    conftest.delete(ingredient)
+    conftest.delete(product)
+    conftest.logout(client)
+
+
+def test_import_products_limits_flashed_errors(client, user):
+    conftest.login(client, user)
+    text = 'product,product_amount,product_unit\n' + 'uploaded bread,-1,g\n' * 50
+    upload = (io.BytesIO(text.encode()), 'bread.csv')
+    client.post(conftest.ROUTES['import'], data={'file': upload}, content_type='multipart/form-data')
+    with client.session_transaction() as session:
+        messages = [message for category, message in session['_flashes'] if category == 'danger']
+    assert len(messages) == FLASHED_IMPORT_ERRORS + 1
+    assert f'{50 - FLASHED_IMPORT_ERRORS} more lines could not be imported.' in messages
+    conftest.logout(client)
+
+
+def test_export_products(client, user, product, ingredient):
+    recipe = Recipe(product_id=product.product_id, ingredient_id=ingredient.ingredient_id, amount=500)
+    db.session.add(recipe)
+    db.session.commit()
+    assert client.get(f"{conftest.ROUTES['export']}csv").status_code == conftest.HTTP_CODES['unauthorized']
+    conftest.login(client, user)
+    for fmt in ('csv', 'jsonl'):
+        response = client.get(f"{conftest.ROUTES['export']}{fmt}")
+        assert response.is_streamed
+        rows = list(read_rows(io.StringIO(response.get_data(as_text=True), newline=''), fmt))
+        assert [(row['product'], row['ingredient'], int(row['amount'])) for row in rows] == [
+            (product.name, ingredient.name, 500)]
+    conftest.delete(recipe)
+    conftest.logout(client)
+
+
+def test_ingredient_usage_page(client, user, user2, product, ingredient):
+    product_id, ingredient_id = product.product_id, ingredient.ingredient_id
+    hidden = Product(name='hidden usage product', amount=1, unit_id=1, user_id=user2.user_id, public=False)
+    db.session.add(hidden)
+    db.session.commit()
+    hidden_id = hidden.product_id
+    db_funcs.add_recipe(product_id, ingredient.name, 40, ingredient.unit_id)
+    db_funcs.add_recipe(hidden_id, ingredient.name, 2, ingredient.unit_id)
+    route = f"{conftest.ROUTES['ingredient_usage']}{ingredient_id}/usage/"
+    conftest.login(client, user)
+    page = client.get(route).data
+    assert b'Used in 2 recipes' in page
+    assert product.name.title().encode() in page
+    assert b'Hidden Usage Product' not in page
+    assert (client.get(f"{conftest.ROUTES['ingredient_usage']}0/usage/").status_code
+            == conftest.HTTP_CODES['found'])
+    conftest.logout(client)
+    db_funcs.delete_recipe(product_id, ingredient_id)
+    db_funcs.delete_recipe(hidden_id, ingredient_id)
+    db_funcs.delete_product(hidden_id)
+
+
 def test_product_add_fail(client, user):
     conftest.login(client, user)
     data = {'name': 'test product',
             'amount': 500,
-            'unit': 'g',
+            'unit': 1,
             'public': True}
     assert (conftest.MESSAGES['existing_product']
             in client.post(conftest.ROUTES['new_product'], data=data).data)
@@ -95,10 +359,19 @@ def test_share_product(client, user, product):
     conftest.logout(client)
 
 
+def test_share_product_requires_owner(client, user, user2, product):
+    product_id, public = product.product_id, product.public
+    client.post(conftest.ROUTES['login'], data={'email': 'admin2@admin.com', 'password': 'admin123'})
+    response = client.get(f"{conftest.ROUTES['view_product']}{product_id}{conftest.ROUTES['share']}")
+    assert response.status_code == conftest.HTTP_CODES['forbidden']
+    assert Product.query.get(product_id).public == public
+    conftest.logout(client)
+
+
 def test_delete_product(client, user, product):
     product_id = product.product_id
     conftest.login(client, user)
     client.get(f"{conftest.ROUTES['view_product']}"
                f"{product_id}{conftest.ROUTES['delete_product']}")
     assert Product.query.get(product_id) is None
-    conftest.logout(client)
\ No newline at end of file
+    conftest.logout(client)
@@ -1,7 +1,9 @@
+from decimal import Decimal
+
 from sqlalchemy import and_
 
-from recipe_hub import db_funcs
-from recipe_hub.mappings import Product, User
+from recipe_hub import db, db_funcs
+from recipe_hub.mappings import Ingredient, Product, Recipe, User
 from tests import conftest
 
 
@@ -13,7 +15,11 @@ def test_get_product(product):
                         'unit': conftest.get_unit_name(product.unit_id),
                         'user_id': product.user_id,
                         'username': username,
-                        'public': product.public == 1}
+                        'public': product.public == 1,
+                        'cost': product.cost,
+                        'cost_complete': product.cost_complete,
+                        'random_key': product.random_key,
+                        'version': product.version}
     assert db_funcs.get_product(product.product_id) == product_details
 
 
@@ -36,8 +42,112 @@ def test_get_all_products(product):
     assert len(db_funcs.get_all_products(product.user_id, True)) == 0
 
 
-def test_share_product(product):
+def test_get_all_products_pagination(user):
+    user_id = user.user_id
+    products = [Product(name=f'page product {i}', amount=1, unit_id=1,
+                        user_id=user_id, public=True) for i in range(5)]
+    db.session.add_all(products)
+    db.session.commit()
+    names = sorted(product.name for product in products)
+    first_page = db_funcs.get_all_products(user_id, after=None, limit=2)
+    assert [product['name'] for product in first_page] == names[:2]
+    second_page = db_funcs.get_all_products(
+        user_id, after=first_page[-1]['product_id'], limit=2)
+    assert [product['name'] for product in second_page] == names[2:4]
+    public_ids = sorted((product.product_id for product in products), reverse=True)
+    public_page = db_funcs.get_all_public_products(after=public_ids[0], limit=3)
+    assert [product['product_id'] for product in public_page] == public_ids[1:4]
+    for product in products:
+        db.session.delete(product)
+    db.session.commit()
+
+
+def test_get_random_public_products(user):
+    user_id = user.user_id
+    products = [Product(name=f'random product {i}', amount=1, unit_id=1,
+                        user_id=user_id, public=True, random_key=i / 5)
+                for i in range(5)]
+    db.session.add_all(products)
+    db.session.commit()
+    product_ids = {product.product_id for product in products}
+    seen = []
+    after = None
+    while True:
+        page = db_funcs.get_random_public_products(0.5, after=after, limit=2)
+        if not page:
+            break
+        seen += [product['product_id'] for product in page]
+        after = page[-1]['product_id']
+    seen = [product_id for product_id in seen if product_id in product_ids]
+    keys = [Product.query.get(product_id).random_key for product_id in seen]
+    assert keys == [0.6, 0.8, 0.0, 0.2, 0.4]
+    for product in products:
+        db.session.delete(product)
+    db.session.commit()
+
+
+def test_get_all_products_query_count(user):
+    user_id = user.user_id
+    products = [Product(name=f'query count product {i}', amount=1, unit_id=1,
+                        user_id=user_id, public=True) for i in range(5)]
+    db.session.add_all(products)
+    db.session.commit()
+    with conftest.count_queries() as statements:
+        assert len(db_funcs.get_all_products(user_id)) >= len(products)
+        assert len(db_funcs.get_all_public_products()) >= len(products)
+    assert len(statements) == 2
+    for product in products:
+        db.session.delete(product)
+    db.session.commit()
+
+
+def test_iter_product_lines(user, product, ingredient):
+    user_id = user.user_id
+    product_id = product.product_id
+    recipe = Recipe(product_id=product_id, ingredient_id=ingredient.ingredient_id, amount=500)
+    empty = Product(name='export empty product', amount=1, unit_id=3,
+                    user_id=user_id, public=False)
+    db.session.add_all([recipe, empty])
+    db.session.commit()
+    with conftest.count_queries() as statements:
+        lines = list(db_funcs.iter_product_lines(user_id, batch_size=1))
+    assert len(statements) == 1
+    lines = {line['product']: line for line in lines}
+    assert lines[product.name]['ingredient'] == ingredient.name
+    assert lines[product.name]['amount'] == 500
+    assert lines[product.name]['unit'] == 'g'
+    assert lines['export empty product']['ingredient'] is None
+    assert lines['export empty product']['product_unit'] == 'whole'
+    conftest.delete(recipe)
+    conftest.delete(empty)
+
+
+def test_delete_product_cascades(user, user2, ingredient):
+    user_id, ingredient_id = user.user_id, ingredient.ingredient_id
+    dough_id = db_funcs.add_product('cascade dough', 1000, 1, False, user_id=user_id)
+    bread_id = db_funcs.add_product('cascade bread', 1000, 1, False, user_id=user_id)
+    db_funcs.add_recipe(dough_id, ingredient.name, 500, ingredient.unit_id)
+    db_funcs.add_sub_recipe(bread_id, dough_id, 250)
+    dough_ingredient_id = db_funcs.add_product_ingredient(dough_id)
+    db_funcs.set_ingredient_price(dough_ingredient_id, Decimal('2.00'), 1000, user_id=user_id)
+    usage = db_funcs.get_ingredient_usage(ingredient_id)
+    assert not db_funcs.delete_product(dough_id, user2.user_id)
+    assert Product.query.get(dough_id) is not None
+    with conftest.count_queries() as statements:
+        assert db_funcs.delete_product(dough_id, user_id)
+    assert len([statement for statement in statements if statement.startswith('DELETE')]) == 1
+    assert Product.query.get(dough_id) is None
+    assert Recipe.query.filter(Recipe.product_id.in_([dough_id, bread_id])).count() == 0
+    assert Ingredient.query.get(dough_ingredient_id) is None
+    assert db_funcs.get_ingredient_usage(ingredient_id)['product_count'] == usage['product_count'] - 1
+    assert Product.query.get(bread_id).cost_stale is False
+    assert db_funcs.delete_product(bread_id)
+
+
+def test_share_product(product, user2):
     public = product.public
+    assert not db_funcs.share_product(product.product_id, user2.user_id)
+    assert product.public == public
     db_funcs.share_product(product.product_id)
     assert product.public != public
     db_funcs.share_product(product.product_id)
@@ -0,0 +1,68 @@
+import logging
+import re
+
+from recipe_hub import app, db_funcs
+from recipe_hub.mappings import Ingredient
+from tests import conftest
+
+PROFILE_ROUTE = '/_debug/profile/'
+TIMING = re.compile(r'(\w+);dur=([\d.]+)(?:;desc="(\d+))?')
+
+
+def get_timing(response):
+    # {'db': (milliseconds, queries), ...}; total has no count.
+    return {name: (float(duration), int(count) if count else None)
+            for name, duration, count in TIMING.findall(response.headers['Server-Timing'])}
+
+
+def test_product_page_queries_do_not_grow_with_recipe(client, user, product):
+    product_id = product.product_id
+    route = f"{conftest.ROUTES['view_product']}{product_id}/"
+    conftest.login(client, user)
+    # The first request also fills the logged-in user's cache entry.
+    client.get(route)
+    counts = []
+    for i in range(4):
+        db_funcs.add_recipe(product_id, f'profiled ingredient {i}', 10, 1)
+        if i in (0, 3):
+            counts.append(get_timing(client.get(route))['db'][1])
+    assert counts[0] == counts[1]
+    for i in range(4):
+        ingredient_id = db_funcs.get_ingredient_id(f'profiled ingredient {i}', 1)
+        db_funcs.delete_recipe(product_id, ingredient_id)
+        conftest.delete(Ingredient.query.get(ingredient_id))
+    conftest.logout(client)
+
+
+def test_server_timing_header(client, user):
+    timing = get_timing(client.get('/'))
+    assert timing.keys() == {'db', 'bcrypt', 'render', 'total'}
+    assert timing['db'][1] > 0
+    assert timing['render'][1] == 1
+    assert timing['bcrypt'][1] == 0
+    response = client.post(conftest.ROUTES['login'],
+                           data={'email': 'admin@admin.com', 'password': 'admin123'})
+    assert get_timing(response)['bcrypt'][1] == 1
+    client.get(conftest.ROUTES['logout'])
+
+
+def test_profile_endpoint_is_opt_in(client):
+    assert client.get(PROFILE_ROUTE).status_code == conftest.HTTP_CODES['not_found']
+    app.config['PROFILE_ENDPOINT'] = True
+    client.get('/')
+    summary = client.get(PROFILE_ROUTE).get_json()
+    remote = client.get(PROFILE_ROUTE, environ_base={'REMOTE_ADDR': '10.0.0.1'}).status_code
+    app.config['PROFILE_ENDPOINT'] = False
+    assert remote == conftest.HTTP_CODES['not_found']
+    assert summary['recent'][-1]['endpoint'] == 'home'
+    assert summary['recent'][-1]['queries'] > 0
+    assert summary['endpoints']['home']['requests'] >= 1
+
+
+def test_over_budget_requests_are_logged(client, caplog):
+    budget = app.config['PROFILE_QUERY_BUDGET']
+    app.config['PROFILE_QUERY_BUDGET'] = 0
+    with caplog.at_level(logging.WARNING, logger='recipe_hub.profiling'):
+        client.get('/')
+    app.config['PROFILE_QUERY_BUDGET'] = budget
+    assert any('Over budget: GET /' in record.getMessage() for record in caplog.records)
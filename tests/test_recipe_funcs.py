@@ -1,7 +1,13 @@
+import threading
+from decimal import Decimal
+from unittest import mock
+
+import pytest
 from sqlalchemy import and_
 
-from recipe_hub import db, db_funcs
-from recipe_hub.mappings import Recipe
+from recipe_hub import app, db, db_funcs
+from recipe_hub.cost_graph import RecipeCycleError
+from recipe_hub.mappings import Ingredient, IngredientPrice, Product, Recipe
 from tests import conftest
 
 
@@ -28,6 +34,32 @@ def test_get_recipe(product, ingredient):
     conftest.delete(recipe)
 
 
+def test_get_recipe_query_count_is_constant(product):
+    product_id = product.product_id
+    ingredients = [Ingredient(name=f'query count ingredient {i}', unit_id=1)
+                   for i in range(10)]
+    db.session.add_all(ingredients)
+    db.session.commit()
+    query_counts = []
+    for size in (1, len(ingredients)):
+        recipes = [Recipe(product_id=product_id,
+                          ingredient_id=ingredient.ingredient_id, amount=500)
+                   for ingredient in ingredients[:size]]
+        db.session.add_all(recipes)
+        db.session.commit()
+        db.session.expire_all()
+        with conftest.count_queries() as statements:
+            assert len(db_funcs.get_recipe(product_id)) == size
+        query_counts.append(len(statements))
+        for recipe in recipes:
+            db.session.delete(recipe)
+        db.session.commit()
+    assert query_counts[0] == query_counts[1] == 1
+    for ingredient in ingredients:
+        db.session.delete(ingredient)
+    db.session.commit()
+
+
 def test_delete_recipe(product, ingredient):
     recipe = Recipe(product_id=product.product_id,
                     ingredient_id=ingredient.ingredient_id, amount=500)
@@ -40,4 +72,124 @@ def test_delete_recipe(product, ingredient):
     recipe = Recipe.query.filter(and_(
         Recipe.product_id == product.product_id,
         Recipe.ingredient_id == ingredient.ingredient_id)).first()
-    assert recipe is None
\ No newline at end of file
+    assert recipe is None
+
+
+def test_delete_recipe_is_set_based(user2, product, ingredient):
+    product_id, ingredient_id = product.product_id, ingredient.ingredient_id
+    db_funcs.add_recipe(product_id, ingredient.name, 500, ingredient.unit_id)
+    usage = db_funcs.get_ingredient_usage(ingredient_id)
+    assert not db_funcs.delete_recipe(product_id, ingredient_id, user2.user_id)
+    with conftest.count_queries() as statements:
+        assert db_funcs.delete_recipe(product_id, ingredient_id, product.user_id)
+    assert not [statement for statement in statements
+                if statement.startswith('SELECT') and 'FROM recipes' in statement]
+    assert Recipe.query.get((product_id, ingredient_id)) is None
+    assert db_funcs.get_ingredient_usage(ingredient_id)['total_amount'] == usage['total_amount'] - 500
+    assert not db_funcs.delete_recipe(product_id, ingredient_id)
+
+
+def test_add_sub_recipe(user, product, ingredient):
+    product_id = product.product_id
+    dough = Product(name='test dough', amount=1000, unit_id=1,
+                    user_id=user.user_id, public=False)
+    db.session.add(dough)
+    db.session.commit()
+    dough_id = dough.product_id
+    db_funcs.add_recipe(dough_id, ingredient.name, 500, ingredient.unit_id)
+    db_funcs.set_ingredient_price(ingredient.ingredient_id, Decimal('4.00'), 1000,
+                                  user_id=user.user_id)
+    db_funcs.add_sub_recipe(product_id, dough_id, 250)
+    assert db_funcs.get_sub_products(product_id) == {product_id, dough_id}
+    assert db_funcs.creates_cycle(dough_id, product_id)
+    with pytest.raises(RecipeCycleError):
+        db_funcs.add_sub_recipe(dough_id, product_id, 1)
+    cost = db_funcs.compute_product_cost(product_id)
+    assert cost['total'] == Decimal('0.50')
+    assert cost['lines'][0]['sub_product_id'] == dough_id
+    assert db_funcs.compute_product_quantities(product_id) == {ingredient.ingredient_id: 125}
+    dough_ingredient = Ingredient.query.filter(Ingredient.product_id == dough_id).first()
+    for recipe in Recipe.query.filter(Recipe.product_id.in_([product_id, dough_id])):
+        db.session.delete(recipe)
+    db.session.delete(IngredientPrice.query.get((user.user_id, ingredient.ingredient_id)))
+    db.session.delete(dough_ingredient)
+    db.session.commit()
+    conftest.delete(dough)
+
+
+def test_add_recipes(product, ingredient):
+    product_id = product.product_id
+    lines = [{'ingredient': ingredient.name, 'amount': 500, 'unit': ingredient.unit_id},
+             {'ingredient': 'Bulk Sugar', 'amount': '200', 'unit': 'g'},
+             {'ingredient': 'bulk milk', 'amount': 1, 'unit': 'liter'}]
+    with mock.patch.object(db.session, 'commit', wraps=db.session.commit) as commit, \
+            mock.patch.object(db_funcs.cost_queue, 'enqueue') as enqueue:
+        ingredient_ids = db_funcs.add_recipes(product_id, lines)
+    assert commit.call_count == 1
+    enqueue.assert_called_once_with([product_id])
+    assert ingredient_ids[0] == ingredient.ingredient_id
+    recipe = {entry['ingredient']: entry['amount'] for entry in db_funcs.get_recipe(product_id)}
+    assert recipe == {ingredient.name: 500, 'bulk sugar': 200, 'bulk milk': 1}
+    for recipe in Recipe.query.filter(Recipe.product_id == product_id):
+        db.session.delete(recipe)
+    db.session.commit()
+    for ingredient_id in ingredient_ids[1:]:
+        conftest.delete(Ingredient.query.get(ingredient_id))
+
+
+def test_ingredient_usage_follows_recipe_writes(user, product):
+    product_id = product.product_id
+    others = [Product(name=f'usage product {i}', amount=100, unit_id=1,
+                      user_id=user.user_id, public=True) for i in range(4)]
+    db.session.add_all(others)
+    db.session.commit()
+    other_ids = [other.product_id for other in others]
+    db_funcs.add_recipe(product_id, 'usage flour', 300, 1)
+    ingredient_id = db_funcs.get_ingredient_id('usage flour', 1)
+    db_funcs.add_recipes(other_ids[0], [{'ingredient': 'usage flour', 'amount': 200, 'unit': 'g'}])
+    usage = db_funcs.get_ingredient_usage(ingredient_id)
+    assert (usage['product_count'], usage['total_amount']) == (2, 500)
+    db_funcs.delete_recipe(product_id, ingredient_id)
+    usage = db_funcs.get_ingredient_usage(ingredient_id)
+    assert (usage['product_count'], usage['total_amount']) == (1, 200)
+    Recipe.query.get((other_ids[0], ingredient_id)).amount = 250
+    db.session.commit()
+    assert db_funcs.get_ingredient_usage(ingredient_id)['total_amount'] == 250
+
+    def add(other_id):
+        with app.app_context():
+            db_funcs.add_recipe(other_id, 'usage flour', 10, 1)
+            db.session.remove()
+
+    threads = [threading.Thread(target=add, args=(other_id,)) for other_id in other_ids[1:]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    usage = db_funcs.get_ingredient_usage(ingredient_id)
+    assert (usage['product_count'], usage['total_amount']) == (4, 280)
+    assert [entry['product_id'] for entry in db_funcs.get_ingredient_products(ingredient_id)] == other_ids
+    db_funcs.rebuild_ingredient_usage()
+    assert db_funcs.get_ingredient_usage(ingredient_id) == usage
+    for other_id in other_ids:
+        db_funcs.delete_recipe(other_id, ingredient_id)
+        db_funcs.delete_product(other_id)
+    assert db_funcs.get_ingredient_usage(ingredient_id)['product_count'] == 0
+    conftest.delete(Ingredient.query.get(ingredient_id))
+
+
+def test_add_recipes_reports_every_bad_line(product, ingredient):
+    product_id = product.product_id
+    db_funcs.add_recipe(product_id, ingredient.name, 500, ingredient.unit_id)
+    lines = [{'ingredient': 'bulk flour', 'amount': 100, 'unit': 'g'},
+             {'ingredient': '', 'amount': 100, 'unit': 'g'},
+             {'ingredient': 'bulk flour', 'amount': 50, 'unit': 'grams'},
+             {'ingredient': 'bulk salt', 'amount': -1, 'unit': 'g'},
+             {'ingredient': 'bulk salt', 'amount': 1, 'unit': 'furlong'},
+             {'ingredient': ingredient.name, 'amount': 1, 'unit': ingredient.unit_id}]
+    with pytest.raises(db_funcs.RecipeLinesError) as error:
+        db_funcs.add_recipes(product_id, lines)
+    assert [line['line'] for line in error.value.errors] == [2, 3, 4, 5, 6]
+    assert len(db_funcs.get_recipe(product_id)) == 1
+    assert db_funcs.get_ingredient_id('bulk flour', 1) is None
+    db_funcs.delete_recipe(product_id, ingredient.ingredient_id)
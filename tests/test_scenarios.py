@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from recipe_hub import scenarios
+from recipe_hub.scenarios import RecipeMatrix
+
+
+def bread_and_sauce():
+    # Product 1 uses ingredient 10 (priced) and 20 (unpriced); product 2 only 10.
+    return RecipeMatrix.from_rows({1: {10: (500, 1.0), 20: (200, None)}, 2: {10: (100, 0.2)}},
+                                  {1: 1000, 2: 100})
+
+
+def test_price_grid():
+    grid = bread_and_sauce().price_grid([1, 10], {20: [0.01, 0.02]})
+    assert grid.prices.tolist() == [[0.01], [0.02]]
+    assert np.allclose(grid.per_batch, [[3, 5], [0.2, 0.2]])
+    assert np.allclose(grid.totals[0], [[3, 5], [30, 50]])
+    assert np.allclose(grid.per_unit[0], [0.003, 0.005])
+    assert grid.complete.tolist() == [True, True]
+
+
+def test_price_grid_combines_every_price():
+    grid = bread_and_sauce().price_grid([1], {10: [0.002, 0.004], 20: [0.01, 0.02, 0.03]},
+                                        factors={10: 1, 20: 1})
+    assert grid.prices.shape == (6, 2)
+    assert np.allclose(grid.per_batch[0], [500 * a + 200 * b for a in (0.002, 0.004)
+                                           for b in (0.01, 0.02, 0.03)])
+
+
+def test_price_grid_factors_and_saved_prices():
+    matrix = bread_and_sauce()
+    grid = matrix.price_grid([2], {}, {})
+    assert grid.prices.shape == (1, 0)
+    assert np.allclose(grid.totals[:, 0, 0], [2, 0.4])
+    assert grid.complete.tolist() == [False, True]
+    # A price of 8 per 1000-unit package is 0.008 per unit.
+    grid = matrix.price_grid([1], {20: [8]}, {20: 1 / 1000})
+    assert np.allclose(grid.per_batch[0], [1 + 200 * 0.008])
+    assert grid.product_dict(0)['scenarios'] == [{20: 8.0}]
+
+
+def test_price_grid_rejects_bad_requests(monkeypatch):
+    matrix = bread_and_sauce()
+    with pytest.raises(ValueError):
+        matrix.price_grid([1], {30: [1]})
+    monkeypatch.setattr(scenarios, 'MAX_GRID_CELLS', 10)
+    with pytest.raises(ValueError):
+        matrix.price_grid(range(1, 4), {20: [1, 2]})
@@ -0,0 +1,74 @@
+import pytest
+
+from recipe_hub import db, db_funcs
+from recipe_hub.mappings import Ingredient, Product
+from recipe_hub.search import PrefixTrie, normalize_query, prefix_pattern
+from tests import conftest
+
+
+def test_prefix_trie():
+    trie = PrefixTrie()
+    for word, item in [('sugar', 1), ('salt', 2), ('sugar', 3), ('sugar cane', 4), ('flour', 5)]:
+        trie.insert(word, item)
+    assert list(trie.search('s')) == [('salt', 2), ('sugar', 1), ('sugar', 3), ('sugar cane', 4)]
+    assert list(trie.search('sugar ')) == [('sugar cane', 4)]
+    assert list(trie.search('x')) == []
+    trie.remove('sugar', 1)
+    trie.remove('sugar cane', 4)
+    trie.remove('pepper', 6)
+    assert list(trie.search('su')) == [('sugar', 3)]
+    assert len(trie) == 3
+
+
+def test_query_helpers():
+    assert normalize_query('  Brown   SUGAR ') == 'brown sugar'
+    assert normalize_query('a' * 500) == 'a' * 100
+    assert prefix_pattern('50%_off\\') == '50\\%\\_off\\\\%'
+
+
+def test_search_ingredients():
+    names = ['search sugar', 'search salt', 'search sugar cane', 'search 50% sugar']
+    db_funcs.add_ingredients([(name, 1) for name in names])
+    db.session.commit()
+    assert [row['name'] for row in db_funcs.search_ingredients('Search S')] == [
+        'search salt', 'search sugar', 'search sugar cane']
+    assert [row['name'] for row in db_funcs.search_ingredients('search su', limit=1)] == ['search sugar']
+    assert [row['name'] for row in db_funcs.search_ingredients('search 50%')] == ['search 50% sugar']
+    assert db_funcs.search_ingredients('search 5_') == []
+    assert db_funcs.search_ingredients('   ') == []
+    assert db_funcs.search_ingredients('search salt')[0]['unit'].strip() == 'g'
+    Ingredient.query.filter(Ingredient.name.in_(names)).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def test_search_products_visibility(user, user2):
+    products = [Product(name='search cake', amount=1, unit_id=1, user_id=user.user_id, public=False),
+                Product(name='search cookie', amount=1, unit_id=1, user_id=user2.user_id, public=True),
+                Product(name='search crumble', amount=1, unit_id=1, user_id=user2.user_id, public=False)]
+    db.session.add_all(products)
+    db.session.commit()
+    user_id = user.user_id
+    assert [product['name'] for product in db_funcs.search_products('search c', user_id)] == [
+        'search cake', 'search cookie']
+    assert [product['name'] for product in db_funcs.search_products('search c')] == ['search cookie']
+    for product in products:
+        db.session.delete(product)
+    db.session.commit()
+
+
+def test_product_trie_follows_writes(user):
+    product_id = db_funcs.add_product('trie tart', 1, 1, True, user_id=user.user_id)
+    assert [item for _, item in db_funcs.get_product_trie().search('trie ')] == [
+        (product_id, user.user_id, True)]
+    db_funcs.share_product(product_id)
+    assert [item for _, item in db_funcs.get_product_trie().search('trie ')] == [
+        (product_id, user.user_id, False)]
+    db_funcs.delete_product(product_id)
+    assert list(db_funcs.get_product_trie().search('trie ')) == []
+
+
+@pytest.mark.skipif(not db_funcs.has_trigram_search(), reason='needs pg_trgm')
+def test_search_ingredients_fuzzy():
+    db_funcs.add_ingredient('search cinnamon', 1)
+    assert [row['name'] for row in db_funcs.search_ingredients('search cinamon')] == ['search cinnamon']
+    conftest.delete(Ingredient.query.filter(Ingredient.name == 'search cinnamon').first())
@@ -2,6 +2,7 @@ import pytest
 
 from recipe_hub import db, db_funcs
 from recipe_hub.mappings import Unit
+from recipe_hub.units import load_unit_registry
 from tests import conftest
 
 UNITS = [
@@ -36,4 +37,30 @@ def test_get_all_units():
     units = db_funcs.get_all_units()
     assert len(units) == amount + 1
     assert all(map(lambda x: isinstance(x, str), units))
-    conftest.delete(unit)
\ No newline at end of file
+    conftest.delete(unit)
+
+def test_unit_lookups_use_registry():
+    db_funcs.get_all_units()
+    with conftest.count_queries() as statements:
+        assert db_funcs.get_unit_name(db_funcs.get_unit_id('g')) == 'g'
+        assert db_funcs.get_unit_id('grams') == db_funcs.get_unit_id('g')
+        db_funcs.get_all_units()
+    assert statements == []
+
+
+def test_unknown_units_do_not_reload_registry():
+    load_unit_registry()
+    with conftest.count_queries() as statements:
+        for _ in range(20):
+            assert db_funcs.resolve_unit('zz') is None
+            assert db_funcs.resolve_unit(-1) is None
+    assert statements == []
+
+
+def test_add_unit_invalidates_registry():
+    amount = len(db_funcs.get_all_units())
+    unit_id = db_funcs.add_unit('test', 'T', 'mass', 10)
+    assert len(db_funcs.get_all_units()) == amount + 1
+    assert db_funcs.get_unit_id('t') == unit_id
+    conftest.delete(Unit.query.get(unit_id))
+    assert len(db_funcs.get_all_units()) == amount
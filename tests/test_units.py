@@ -0,0 +1,35 @@
+import pytest
+
+from recipe_hub.units import COUNT, MASS, VOLUME, ConversionTable, UnitInfo
+
+GRAMS, MILLILITER, WHOLE, KILOGRAMS, LITER = range(1, 6)
+TABLE = ConversionTable([UnitInfo(GRAMS, MASS, 1),
+                         UnitInfo(MILLILITER, VOLUME, 1),
+                         UnitInfo(WHOLE, COUNT, 1),
+                         UnitInfo(KILOGRAMS, MASS, 1000),
+                         UnitInfo(LITER, VOLUME, 1000)])
+CONVERSIONS = [
+    (2, KILOGRAMS, GRAMS, None, 2000),
+    (500, GRAMS, KILOGRAMS, None, 0.5),
+    (1, LITER, MILLILITER, None, 1000),
+    (3, WHOLE, WHOLE, None, 3),
+    (100, MILLILITER, GRAMS, 1.2, 120),
+    (1.2, KILOGRAMS, LITER, 1.2, 1),
+    (1, GRAMS, MILLILITER, None, None),
+    (1, WHOLE, GRAMS, 1.2, None),
+]
+
+
+@pytest.mark.parametrize('amount, source, target, density, result', CONVERSIONS)
+def test_convert(amount, source, target, density, result):
+    converted = TABLE.convert(amount, source, target, density)
+    if result is None:
+        assert converted is None
+    else:
+        assert converted == pytest.approx(result)
+
+
+def test_base_unit():
+    assert TABLE.base_unit(KILOGRAMS) == GRAMS
+    assert TABLE.base_unit(LITER) == MILLILITER
+    assert TABLE.base_unit(WHOLE) == WHOLE
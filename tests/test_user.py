@@ -1,7 +1,9 @@
 from datetime import date
 
+import flask
 import pytest
 
+from recipe_hub import db_funcs
 from recipe_hub.mappings import User
 from tests import conftest
 
@@ -176,6 +178,32 @@ def test_edit_page_returns_unauthorized(client, path):
     assert client.get(path).status_code == conftest.HTTP_CODES['unauthorized']
 
 
+@pytest.mark.parametrize('path, data, hashes', [
+    (conftest.ROUTES['edit_username'], {'username': NEW_USERNAME, 'password': NEW_PASSWORD}, 1),
+    (conftest.ROUTES['edit_password'], {'cur_password': PASSWORD, 'new_password': PASSWORD,
+                                        'confirm_password': PASSWORD}, 1),
+    (conftest.ROUTES['edit_password'], {'cur_password': NEW_PASSWORD, 'new_password': PASSWORD,
+                                        'confirm_password': PASSWORD}, 1),
+])
+def test_edit_profile_hashes_once_per_password(client, user, path, data, hashes):
+    conftest.login(client, user)
+    client.post(path, data=data)
+    assert flask.g.password_hashes == hashes
+    conftest.logout(client)
+
+
+def test_change_password_hashes_twice(client, user):
+    user_id = user.user_id
+    conftest.login(client, user)
+    for current, new in ((PASSWORD, NEW_PASSWORD), (NEW_PASSWORD, PASSWORD)):
+        page = client.post(conftest.ROUTES['edit_password'],
+                           data={'cur_password': current, 'new_password': new,
+                                 'confirm_password': new})
+        assert page.status_code == conftest.HTTP_CODES['found']
+        assert flask.g.password_hashes == 2
+    assert db_funcs.validate_password(User.query.get(user_id).email, PASSWORD)
+    conftest.logout(client)
+
 @pytest.mark.parametrize('path, data, message', EDITS)
 def test_edit_profile(client, user, user2, path, data, message):
     conftest.login(client, user)
@@ -183,4 +211,4 @@ def test_edit_profile(client, user, user2, path, data, message):
     if User.query.get(user.user_id).email == NEW_EMAIL:
         User.query.get(user.user_id).email = EMAIL
         conftest.db.session.commit()
-    conftest.logout(client)
\ No newline at end of file
+    conftest.logout(client)
@@ -1,9 +1,11 @@
 import datetime
 
+import pytest
 from bcrypt import checkpw
 
 from recipe_hub import db_funcs
 from recipe_hub.mappings import User
+from recipe_hub.passwords import DEFAULT_ROUNDS, get_rounds
 from tests import conftest
 
 CHANGES = [
@@ -37,6 +39,41 @@ def test_validate_password(user):
     assert db_funcs.validate_password(user.email, 'admin123')
 
 
+def test_load_user_is_cached(user):
+    user_id = user.user_id
+    db_funcs.invalidate_user(user_id)
+    loaded = db_funcs.load_user(str(user_id))
+    assert (loaded.user_id, loaded.username, loaded.email) == (user_id, user.username, user.email)
+    with conftest.count_queries() as statements:
+        assert db_funcs.load_user(str(user_id)) is loaded
+    assert statements == []
+    with pytest.raises(AttributeError):
+        loaded.username = 'changed'
+
+
+def test_load_user_invalidated_by_changes(user):
+    user_id = user.user_id
+    username = user.username
+    db_funcs.load_user(user_id)
+    db_funcs.change_username(user_id, 'cached admin')
+    assert db_funcs.load_user(user_id).username == 'cached admin'
+    db_funcs.change_username(user_id, username)
+    assert db_funcs.load_user(user_id).username == username
+
+
+def test_validate_password_rehashes(user):
+    email = user.email
+    rounds = db_funcs.app.config['BCRYPT_ROUNDS']
+    db_funcs.app.config['BCRYPT_ROUNDS'] = 4
+    try:
+        assert db_funcs.validate_password(email, 'admin123')
+        assert get_rounds(db_funcs.get_user_by_email(email).password_hash) == 4
+    finally:
+        db_funcs.app.config['BCRYPT_ROUNDS'] = rounds
+    assert db_funcs.validate_password(email, 'admin123')
+    assert get_rounds(db_funcs.get_user_by_email(email).password_hash) == DEFAULT_ROUNDS
+
+
 def test_change_username(user):
     username = 'admin1'
     assert user.username != username